@@ -4,3 +4,7 @@ class LateXError(Exception):
 
 class InvoicingError(Exception):
     pass
+
+
+class TemplateError(Exception):
+    pass
@@ -0,0 +1,83 @@
+from django.contrib.admin import SimpleListFilter
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.forms import ModelChoiceField
+from django.utils.translation import gettext as _
+
+from Invoicer.utils import get_invoicer_choices
+
+
+class InvoicerListFilter(SimpleListFilter):
+    title = _('INVOICER')
+    parameter_name = _('INVOICER')
+    lookup = 'invoicer'
+
+    def lookups(self, request, model_admin):
+        return get_invoicer_choices(request.user)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+
+
+class AutocompleteListFilter(SimpleListFilter):
+    template = 'admin/autocomplete_filter.html'
+    # The foreign key whose admin autocomplete view serves the choices, as
+    # (model, field name).
+    autocompleteField = None
+    lookup = None
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        sourceModel, fieldName = self.autocompleteField
+        self.field = sourceModel._meta.get_field(fieldName)
+        self.adminSite = model_admin.admin_site
+        # Only the selected choice is read, through the admin of the
+        # filtered model, so that users only see their own rows.
+        self.choiceQuerySet = self.adminSite.get_model_admin(
+            self.field.remote_field.model
+        ).get_queryset(request)
+        self.queryString = '?'
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return []
+
+    def choices(self, changelist):
+        self.queryString = changelist.get_query_string(
+            remove=[self.parameter_name]
+        )
+        yield from super().choices(changelist)
+
+    def render_widget(self):
+        choiceField = ModelChoiceField(
+            self.choiceQuerySet,
+            required=False,
+            widget=AutocompleteSelect(
+                self.field,
+                self.adminSite,
+                attrs={
+                    'class': 'autocomplete-filter',
+                    'data-query-string': self.queryString,
+                    'data-parameter-name': self.parameter_name,
+                },
+            ),
+        )
+        return choiceField.widget.render(self.parameter_name, self.value())
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+
+
+class AutocompleteFilterMixin:
+
+    # select2 has to be bound to the admin jQuery, so it is loaded in the
+    # page head rather than by the filter.
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(
+            self.opts.pk,
+            self.admin_site,
+        ).media
@@ -28,3 +28,32 @@ class InvoiceStates(IntegerChoices):
     Validated = 2, _('Validated')
     Paid = 3, _('Paid')
     Credited = 4, _('Credited')
+
+
+class RenderJobKinds(TextChoices):
+    INVOICE = 'IN', _('Invoice')
+    RECEIPT = 'RC', _('Receipt')
+
+
+class RenderJobStates(IntegerChoices):
+    PENDING = 0, _('Pending')
+    RUNNING = 1, _('Running')
+    DONE = 2, _('Done')
+    FAILED = 3, _('Failed')
+
+
+class PDFBackends(TextChoices):
+    AUTO = 'AU', _('Automatic')
+    LATEX = 'LX', _('LaTeX')
+    PYTHON = 'PY', _('Builtin')
+
+
+class DocumentTypes(TextChoices):
+    INVOICE = 'IN', _('Invoice')
+    CREDITNOTE = 'CN', _('CreditNote')
+
+
+class AllocationStrategies(TextChoices):
+    EQUAL = 'EQ', _('EqualSplit')
+    PROPORTIONAL = 'PR', _('ProportionalToOutstanding')
+    OLDESTFIRST = 'OF', _('OldestFirst')
@@ -1,20 +1,10 @@
 from datetime import date, timedelta
-from csv import DictWriter
-from os import getcwd, remove
-from os.path import join
 from decimal import Decimal
-from tempfile import (
-    SpooledTemporaryFile,
-)
-from zipfile import (
-    ZIP_DEFLATED,
-    ZipFile,
-)
 from django.contrib.admin.widgets import AdminDateWidget
 from django.urls import reverse
 from django.utils.translation import gettext as _
 from django.utils.safestring import mark_safe
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.contrib.admin import (
     action,
     register,
@@ -23,25 +13,37 @@ from django.contrib.admin import (
     SimpleListFilter,
     StackedInline,
 )
-from django.http import (
-    HttpResponse,
-)
-from django.contrib.messages import error, warning
-from django.db.models import F
+from django.http import StreamingHttpResponse
+from django.contrib.messages import ERROR, error, warning
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, F, OuterRef, Prefetch
+from django.db.transaction import atomic
 
 from rangefilter.filters import DateRangeFilter
 
-from Invoicee.models import Invoicee
-from Invoicer.models import Invoicer
-from .models import Invoice, Project, Fee, Payment
+from Invoicer.utils import get_invoicer, has_multiple_invoicers
+from .models import (
+    Invoice,
+    Project,
+    Fee,
+    Payment,
+    PaymentAllocation,
+    AMOUNT_FIELDS,
+    TOTAL_FIELDS,
+    get_update_fields,
+)
 from .forms import PaymentForm
 from .utils import (
     create_credit_note,
-    generate_invoice_file,
-    export_invoice_data,
-    LateXError,
+    stream_invoices_archive,
+    stream_invoices_export,
+)
+from InvoiceGenerator.settings import EXPORT_DATA_HEADER
+from Core.filters import (
+    AutocompleteFilterMixin,
+    AutocompleteListFilter,
+    InvoicerListFilter,
 )
-from InvoiceGenerator.settings import TEMPTEXFILESDIR, EXPORT_DATA_HEADER
 from Core.utils import (
     get_currency_symbol,
 )
@@ -55,53 +57,60 @@ def create_credit_note_action(invoiceAdmin, request, queryset):
 
 @action(description=_('InvoiceGenerateAction'))
 def generate_invoice(invoiceAdmin, request, querySet):
-    with SpooledTemporaryFile() as temporaryFile:
-        with ZipFile(temporaryFile, 'w', ZIP_DEFLATED) as archive:
-            for invoice in querySet:
-                try:
-                    file = generate_invoice_file(invoice)
-                    pathToFile = join(getcwd(), TEMPTEXFILESDIR, file)
-                    archive.write(pathToFile, file)
-                    remove(pathToFile)
-                except LateXError as e:
-                    error(request, ' '.join(e.args))
-                    return None
-            temporaryFile.seek(0)
-            response = HttpResponse(temporaryFile.read())
-            response['Content-Disposition'] = 'attachment; filename="pdfs.zip"'
-            return response
+    invoices = querySet.select_related(
+        'invoicer__legalinformation',
+        'invoicee',
+        'bankAccount',
+    )
+    response = StreamingHttpResponse(
+        stream_invoices_archive(invoices),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = 'attachment; filename="pdfs.zip"'
+    return response
 
 
 @action(description=_('InvoicesDataExportAction'))
 def export_invoices(invoiceAdmin, request, querySet):
-    if request.user.is_superuser:
-        with SpooledTemporaryFile(
-            mode='w',
-            encoding='utf-8',
-            newline='',
-        ) as temporaryFile:
-            dictWriter = DictWriter(temporaryFile, EXPORT_DATA_HEADER)
-            dictWriter.writeheader()
-            for invoice in querySet:
-                if invoice.state == 0:
-                    error(request, _('TheQUERYSETHasADraft'))
-                    return None
-                data = export_invoice_data(invoice, EXPORT_DATA_HEADER)
-                dictWriter.writerows(data)
-            temporaryFile.seek(0)
-            response = HttpResponse(temporaryFile.read())
-            response['Content-Disposition'] = 'attachment; filename="export.csv"'
-            return response
-    else:
+    if not request.user.is_superuser:
         warning(request, _('InvoiceDataExportActionReservedWarning'))
         return None
+    # Drafts are refused before streaming starts, as the response can no
+    # longer be turned into an error once rows have been sent.
+    if querySet.filter(state=0).exists():
+        error(request, _('TheQUERYSETHasADraft'))
+        return None
+    response = StreamingHttpResponse(
+        stream_invoices_export(querySet.order_by('id'), EXPORT_DATA_HEADER),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = 'attachment; filename="export.csv"'
+    return response
 
 
 @action(description=_('InvoiceValidateAction'))
 def validate_invoices(invoiceAdmin, request, querySet):
-    for invoice in querySet:
-        invoice.state = 1
-        invoice.save()
+    # Numbers are handed out in facturation order, so drafts with missing or
+    # inconsistent dates are reported before any number is taken.
+    drafts = list(querySet.filter(state=0).order_by('facturationDate', 'id'))
+    invalidDrafts = []
+    for invoice in drafts:
+        try:
+            invoice.clean()
+        except ValidationError:
+            invalidDrafts.append(invoice)
+    if invalidDrafts:
+        invoiceAdmin.message_user(
+            request,
+            f'{_('InvoicesWithInvalidDatesCannotBeValidated')}: '
+            + ', '.join(str(invoice) for invoice in invalidDrafts),
+            level=ERROR,
+        )
+        return None
+    with atomic():
+        for invoice in drafts:
+            invoice.state = 2
+            invoice.save()
 
 
 class InvoiceStatusFilter(SimpleListFilter):
@@ -121,69 +130,28 @@ class InvoiceStatusFilter(SimpleListFilter):
         if self.value() == '0':
             return querySet.filter(status=0)
         elif self.value() == '1':
-            return querySet.filter(status=1)
+            return querySet.outstanding().exclude(dueDate__lte=date.today())
         elif self.value() == '2':
             return querySet.filter(status=2)
         elif self.value() == '3':
-            return querySet.filter(
-                status=3
-            ).filter(
-                dueDate__lte=date.today()
-            ).filter(
+            return querySet.overdue().filter(
                 dueDate__gte=date.today() - timedelta(days=16)
             )
         elif self.value() == '4':
-            return querySet.filter(status=3).filter(
-                dueDate__lte=date.today() - timedelta(days=15)
-            )
+            return querySet.overdue(date.today() - timedelta(days=15))
         else:
             return None
 
 
-class InvoiceInvoiceeFilter(SimpleListFilter):
+class InvoiceInvoiceeFilter(AutocompleteListFilter):
     title = _('INVOICEE')
     parameter_name = _('INVOICEE')
+    autocompleteField = (Invoice, 'invoicee')
+    lookup = 'invoicee'
 
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicee.id, invoicee.name)
-                for invoicee in Invoicee.objects.all().order_by('name')
-            ]
-        return [
-            (invoicee.id, invoicee.name)
-            for invoicee in Invoicee.objects.filter(
-                invoicer__in=Invoicer.objects.filter(
-                    manager=request.user
-                )
-            ).order_by('name')
-        ]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(invoicee=self.value())
-
-
-class InvoiceInvoicerFilter(SimpleListFilter):
-    title = _('INVOICER')
-    parameter_name = _('INVOICER')
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicer.id, invoicer.name)
-                for invoicer in Invoicer.objects.all().order_by('name')
-            ]
-        return [
-            (invoicer.id, invoicer.name)
-            for invoicer in Invoicer.objects.filter(
-                manager=request.user
-            ).order_by('name')
-        ]
 
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(invoicer=self.value())
+class InvoiceInvoicerFilter(InvoicerListFilter):
+    lookup = 'invoicer'
 
 
 class FeeStackedInline(StackedInline):
@@ -199,7 +167,7 @@ class FeeStackedInline(StackedInline):
 
 
 @register(Invoice)
-class InvoiceAdmin(ModelAdmin):
+class InvoiceAdmin(AutocompleteFilterMixin, ModelAdmin):
 
     list_select_related = ['invoicee', 'invoicer']
     list_per_page = 25
@@ -229,16 +197,46 @@ class InvoiceAdmin(ModelAdmin):
 
     def save_model(self, request, invoice, form, change):
         if 'invoicer' not in form.fields:
-            invoice.invoicer = Invoicer.objects.get(manager=request.user)
-        invoice.save()
+            invoice.invoicer = get_invoicer(request)
+        if change:
+            # Ordinary saves leave the stored amounts alone, so only those
+            # edited by hand are written.
+            invoice.save(
+                update_fields=get_update_fields(
+                    invoice,
+                    TOTAL_FIELDS + [
+                        field for field in AMOUNT_FIELDS
+                        if field not in form.changed_data
+                    ],
+                ),
+            )
+        else:
+            invoice.save()
 
     def get_queryset(self, request):
-        querySet = super().get_queryset(request)
+        # The projects and fees of a whole changelist page are read in two
+        # queries, whatever the number of rows.
+        querySet = super().get_queryset(request).prefetch_related(
+            Prefetch(
+                'project_set',
+                queryset=Project.objects.only(
+                    'id',
+                    'invoice_id',
+                    'title',
+                ).order_by('id'),
+            ),
+            Prefetch(
+                'project_set__fee_set',
+                queryset=Fee.objects.only(
+                    'id',
+                    'project_id',
+                    'description',
+                ).order_by('id'),
+            ),
+        )
         if request.user.is_superuser:
             return querySet
-        return querySet.filter(
-            invoicer__in=Invoicer.objects.filter(manager=request.user),
-        ).order_by('-id')
+        return querySet.filter(invoicer__manager=request.user).order_by('-id')
 
     def has_view_permission(self, request, obj=None):
         if obj is not None:
@@ -268,7 +266,7 @@ class InvoiceAdmin(ModelAdmin):
         if not request.user.is_superuser:
             fields.remove('owedAmount')
             fields.remove('paidAmount')
-            if Invoicer.objects.filter(manager=request.user).count() == 1:
+            if not has_multiple_invoicers(request):
                 fields.remove('invoicer')
             fields.remove('count')
             fields.remove('salesAccount')
@@ -295,89 +293,61 @@ class InvoiceAdmin(ModelAdmin):
     get_balance.short_description = _('TBPaid')
 
     def get_projects(self, invoice):
-        projects = '<ul class="field_ul_table">'
-        for project in invoice.project_set.all():
-            projects += format_html(
-                '<li><a href="{}">{}</a></li>',
-                reverse('admin:Invoice_project_change', args=(project.id,)),
-                f'{project.title}',
-            )
-        projects += '</ul>'
-        return mark_safe(projects)
+        projectURL = reverse('admin:Invoice_project_changelist')
+        return format_html(
+            '<ul class="field_ul_table">{}</ul>',
+            format_html_join(
+                '',
+                '<li><a href="{}{}/change/">{}</a></li>',
+                (
+                    (projectURL, project.id, project.title)
+                    for project in invoice.project_set.all()
+                ),
+            ),
+        )
 
     get_projects.short_description = _('PROJECTS')
 
     def get_fees(self, invoice):
-        projects = '<ul class="field_ul_table">'
-        for project in invoice.project_set.all():
-            fees = '<ul class="field_ul_table">'
-            for fee in project.fee_set.all():
-                fees += format_html(
-                    '<li><a href="{}">{}</a></li>',
-                    reverse('admin:Invoice_fee_change', args=(fee.id,)),
-                    f'{fee.description}',
-                )
-            projects += fees + '</ul><hr>'
-        projects += '</ul>'
-        return mark_safe(projects)
+        feeURL = reverse('admin:Invoice_fee_changelist')
+        return format_html(
+            '<ul class="field_ul_table">{}</ul>',
+            format_html_join(
+                '',
+                '<ul class="field_ul_table">{}</ul><hr>',
+                (
+                    (
+                        format_html_join(
+                            '',
+                            '<li><a href="{}{}/change/">{}</a></li>',
+                            (
+                                (feeURL, fee.id, fee.description)
+                                for fee in project.fee_set.all()
+                            ),
+                        ),
+                    )
+                    for project in invoice.project_set.all()
+                ),
+            ),
+        )
 
     get_fees.short_description = _('Fees')
 
 
-class InvoicerOfProjectFilter(SimpleListFilter):
-    title = _('INVOICER')
+class InvoicerOfProjectFilter(InvoicerListFilter):
     parameter_name = 'InvoicerIS'
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicer.id, invoicer.name)
-                for invoicer in Invoicer.objects.all().order_by('name')
-            ]
-        return [
-            (invoicer.id, invoicer.name)
-            for invoicer in Invoicer.objects.filter(
-                manager=request.user
-            ).order_by('name')
-        ]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(
-                invoice__in=Invoice.objects.filter(
-                    invoicee__in=Invoicee.objects.filter(invoicer=self.value())
-                )
-            )
+    lookup = 'invoice__invoicer'
 
 
-class InvoiceeOfProjectFilter(SimpleListFilter):
+class InvoiceeOfProjectFilter(AutocompleteListFilter):
     title = _('INVOICEE')
     parameter_name = 'InvoiceeIS'
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicee.id, invoicee.name)
-                for invoicee in Invoicee.objects.all().order_by('name')
-            ]
-        return [
-            (invoicee.id, invoicee.name)
-            for invoicee in Invoicee.objects.filter(
-                invoicer__in=Invoicer.objects.filter(
-                    manager=request.user
-                )
-            ).order_by('name')
-        ]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(
-                invoice__in=Invoice.objects.filter(invoicee=self.value())
-            )
+    autocompleteField = (Invoice, 'invoicee')
+    lookup = 'invoice__invoicee'
 
 
 @register(Project)
-class ProjectAdmin(ModelAdmin):
+class ProjectAdmin(AutocompleteFilterMixin, ModelAdmin):
 
     list_per_page = 25
     list_select_related = ['invoice']
@@ -418,9 +388,7 @@ class ProjectAdmin(ModelAdmin):
         if request.user.is_superuser:
             return querySet
         return querySet.filter(
-            invoice__in=Invoice.objects.all().filter(
-                invoicer__in=Invoicer.objects.filter(manager=request.user),
-            )
+            invoice__invoicer__manager=request.user,
         ).order_by('-id')
 
     def has_view_permission(self, request, obj=None):
@@ -447,64 +415,21 @@ class ProjectAdmin(ModelAdmin):
         return True
 
 
-class InvoicerOfProjectItemsFilter(SimpleListFilter):
+class InvoicerOfProjectItemsFilter(InvoicerListFilter):
     title = _('Invoicer')
     parameter_name = 'InvoicerIS'
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicer.id, invoicer.name)
-                for invoicer in Invoicer.objects.all().order_by('name')
-            ]
-        return [
-            (invoicer.id, invoicer.name)
-            for invoicer in Invoicer.objects.filter(
-                manager=request.user
-            ).order_by('name')
-        ]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(
-                project__in=Project.objects.filter(
-                    invoice__in=Invoice.objects.filter(
-                        invoicee__in=Invoicee.objects.filter(
-                            invoicer=self.value()
-                        )
-                    )
-                )
-            )
+    lookup = 'project__invoice__invoicer'
 
 
-class InvoiceeOfProjectItemsFilter(SimpleListFilter):
+class InvoiceeOfProjectItemsFilter(AutocompleteListFilter):
     title = _('Invoicee')
     parameter_name = 'InvoiceeIS'
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicee.id, invoicee.name)
-                for invoicee in Invoicee.objects.all().order_by('name')
-            ]
-        return [
-            (invoicee.id, invoicee.name)
-            for invoicee in Invoicee.objects.filter(
-                invoicer__in=Invoicer.objects.filter(manager=request.user)
-            ).order_by('name')
-        ]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(
-                project__in=Project.objects.filter(
-                    invoice__in=Invoice.objects.filter(invoicee=self.value())
-                )
-            )
+    autocompleteField = (Invoice, 'invoicee')
+    lookup = 'project__invoice__invoicee'
 
 
 @register(Fee)
-class FeeAdmin(ModelAdmin):
+class FeeAdmin(AutocompleteFilterMixin, ModelAdmin):
 
     list_select_related = ['project']
     list_per_page = 25
@@ -552,13 +477,7 @@ class FeeAdmin(ModelAdmin):
         querySet = super().get_queryset(request)
         if request.user.is_superuser:
             return querySet
-        return querySet.filter(
-            project__in=Project.objects.all().filter(
-                invoice__in=Invoice.objects.all().filter(
-                    invoicer__in=Invoicer.objects.filter(manager=request.user),
-                )
-            )
-        )
+        return querySet.filter(project__invoice__invoicer__manager=request.user)
 
     def has_view_permission(self, request, obj=None):
         if obj is not None:
@@ -584,63 +503,34 @@ class FeeAdmin(ModelAdmin):
         return True
 
 
-class PaymentInvoiceeFilter(SimpleListFilter):
+class PaymentInvoiceeFilter(AutocompleteListFilter):
     title = _('INVOICEE')
     parameter_name = _('INVOICEE')
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicee.id, invoicee.name)
-                for invoicee in Invoicee.objects.all().order_by('name')
-            ]
-        return [
-            (invoicee.id, invoicee.name)
-            for invoicee in Invoicee.objects.filter(
-                invoicer__in=Invoicer.objects.filter(
-                    manager=request.user
-                )
-            ).order_by('name')
-        ]
+    autocompleteField = (Invoice, 'invoicee')
+    lookup = 'invoice__invoicee'
 
     def queryset(self, request, queryset):
+        # A payment is kept once, however many of its invoices match.
         if self.value():
-            return queryset.filter(
-                invoice__in=Invoice.objects.filter(
-                    invoicee=self.value()
-                )
-            )
-
+            return queryset.filter(Exists(PaymentAllocation.objects.filter(
+                payment=OuterRef('pk'),
+                **{self.lookup: self.value()},
+            )))
 
-class PaymentInvoicerFilter(SimpleListFilter):
 
-    title = _('INVOICER')
-    parameter_name = _('INVOICER')
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicer.id, invoicer.name)
-                for invoicer in Invoicer.objects.all().order_by('name')
-            ]
-        return [
-            (invoicer.id, invoicer.name)
-            for invoicer in Invoicer.objects.filter(
-                manager=request.user
-            ).order_by('name')
-        ]
+class PaymentInvoicerFilter(InvoicerListFilter):
+    lookup = 'invoice__invoicer'
 
     def queryset(self, request, queryset):
         if self.value():
-            return queryset.filter(
-                invoice__in=Invoice.objects.filter(
-                    invoicer=self.value()
-                )
-            )
+            return queryset.filter(Exists(PaymentAllocation.objects.filter(
+                payment=OuterRef('pk'),
+                **{self.lookup: self.value()},
+            )))
 
 
 @register(Payment)
-class PaymentAdmin(ModelAdmin):
+class PaymentAdmin(AutocompleteFilterMixin, ModelAdmin):
 
     list_select_related = ['payor', 'bankAccount']
     list_per_page = 25
@@ -683,8 +573,4 @@ class PaymentAdmin(ModelAdmin):
         querySet = super().get_queryset(request)
         if request.user.is_superuser:
             return querySet
-        return querySet.filter(
-            payor__in=Invoicer.objects.get(
-                manager=request.user
-            ).invoicee_set.all()
-        )
+        return querySet.filter(payor__invoicer=get_invoicer(request))
@@ -0,0 +1,146 @@
+from datetime import date
+from decimal import Decimal, ROUND_DOWN
+
+from django.db.transaction import atomic
+from django.utils.timezone import now
+
+from Core.models import AllocationStrategies
+from .models import Invoice, PaymentAllocation, MonthlySummary
+
+
+CENT = Decimal('0.01')
+
+
+def distribute(amount, weights):
+    if sum(weights) <= 0:
+        weights = [Decimal(1)] * len(weights)
+    total = sum(weights)
+    exactShares = [amount * weight / total for weight in weights]
+    shares = [share.quantize(CENT, rounding=ROUND_DOWN) for share in exactShares]
+    # The cents lost by rounding down go to the largest remainders, so the
+    # shares always add up to the paid amount.
+    leftoverCents = int((amount - sum(shares)) / CENT)
+    byRemainder = sorted(
+        range(len(shares)),
+        key=lambda i: exactShares[i] - shares[i],
+        reverse=True,
+    )
+    for i in byRemainder[:leftoverCents]:
+        shares[i] += CENT
+    return shares
+
+
+def get_outstanding(invoice):
+    return max(invoice.owedAmount - invoice.paidAmount, Decimal(0))
+
+
+def split_payment(amount, invoices, strategy):
+    if not invoices:
+        return {}
+    if strategy == AllocationStrategies.OLDESTFIRST:
+        # Invoices without a due date are paid last.
+        invoices = sorted(
+            invoices,
+            key=lambda invoice: (
+                invoice.dueDate is None,
+                invoice.dueDate or date.max,
+                invoice.id,
+            ),
+        )
+        allocation = {}
+        remaining = amount
+        for invoice in invoices:
+            allocation[invoice.id] = min(remaining, get_outstanding(invoice))
+            remaining -= allocation[invoice.id]
+        # Overpayments stay on the most recent invoice.
+        allocation[invoices[-1].id] += remaining
+        return allocation
+    if strategy == AllocationStrategies.PROPORTIONAL:
+        weights = [get_outstanding(invoice) for invoice in invoices]
+    else:
+        weights = [Decimal(1)] * len(invoices)
+    return {
+        invoice.id: share
+        for invoice, share in zip(invoices, distribute(amount, weights))
+    }
+
+
+def update_invoice_state(invoice):
+    if invoice.state in [2, 3]:
+        invoice.state = 2 if invoice.paidAmount < invoice.owedAmount else 3
+
+
+def allocate_payment(payment, invoiceIDs=None, strategy=None):
+    # PaymentAllocation rows are the payment's links to its invoices and
+    # record what was added to each invoice's paidAmount, so only the
+    # difference to the previous allocation is applied.
+    if strategy is None:
+        strategy = payment.allocationStrategy
+    with atomic():
+        allocations = {
+            allocation.invoice_id: allocation
+            for allocation in PaymentAllocation.objects.filter(payment=payment)
+        }
+        if invoiceIDs is None:
+            invoiceIDs = set(allocations)
+        invoices = list(
+            Invoice.objects.select_for_update().filter(
+                id__in=set(invoiceIDs) | set(allocations),
+            ).order_by('id')
+        )
+        summaryKeys = {MonthlySummary.get_key(invoice) for invoice in invoices}
+        for invoice in invoices:
+            if invoice.id in allocations:
+                invoice.paidAmount -= allocations[invoice.id].amount
+        split = split_payment(
+            payment.paidAmount,
+            [invoice for invoice in invoices if invoice.id in invoiceIDs],
+            strategy,
+        )
+        updatedAt = now()
+        for invoice in invoices:
+            if invoice.id in split:
+                invoice.paidAmount += split[invoice.id]
+                invoice.paymentMethod = payment.paymentMethod
+            update_invoice_state(invoice)
+            invoice.updatedAt = updatedAt
+        Invoice.objects.bulk_update(
+            invoices,
+            ['paidAmount', 'state', 'paymentMethod', 'updatedAt'],
+        )
+        MonthlySummary.refresh(
+            summaryKeys
+            | {MonthlySummary.get_key(invoice) for invoice in invoices}
+        )
+        PaymentAllocation.objects.filter(
+            payment=payment,
+            invoice_id__in=set(allocations) - set(split),
+        ).delete()
+        for invoiceID, allocation in allocations.items():
+            if invoiceID in split:
+                allocation.amount = split[invoiceID]
+        PaymentAllocation.objects.bulk_update(
+            [
+                allocation for invoiceID, allocation in allocations.items()
+                if invoiceID in split
+            ],
+            ['amount'],
+        )
+        PaymentAllocation.objects.bulk_create(
+            PaymentAllocation(
+                payment=payment,
+                invoice_id=invoiceID,
+                amount=amount,
+            )
+            for invoiceID, amount in split.items()
+            if invoiceID not in allocations
+        )
+    return split
+
+
+def release_payment(payment):
+    return allocate_payment(
+        payment,
+        invoiceIDs=set(),
+        strategy=AllocationStrategies.EQUAL,
+    )
@@ -0,0 +1,119 @@
+from hashlib import sha256
+from os import getcwd, makedirs, remove, replace, scandir, utime
+from os.path import join, isfile
+from threading import Lock
+from time import time
+
+from django.conf import settings
+
+from InvoiceGenerator.settings import TEMPTEXFILESDIR
+
+
+PDF_CACHE_DIR = getattr(
+    settings,
+    'PDF_CACHE_DIR',
+    join(TEMPTEXFILESDIR, 'cache'),
+)
+PDF_CACHE_MAX_SIZE = getattr(settings, 'PDF_CACHE_MAX_SIZE', 512 * 1024 ** 2)
+PDF_CACHE_MAX_AGE = getattr(settings, 'PDF_CACHE_MAX_AGE', 30 * 24 * 3600)
+# Entries used within the grace period are never evicted, so a path handed
+# out by get_cached_file stays readable while it is streamed.
+PDF_CACHE_GRACE_PERIOD = getattr(settings, 'PDF_CACHE_GRACE_PERIOD', 3600)
+PDF_CACHE_EVICTION_INTERVAL = getattr(
+    settings,
+    'PDF_CACHE_EVICTION_INTERVAL',
+    600,
+)
+
+evictionLock = Lock()
+lastEviction = 0
+
+
+def get_cache_directory():
+    directory = join(getcwd(), PDF_CACHE_DIR)
+    makedirs(directory, exist_ok=True)
+    return directory
+
+
+def hash_file(digest, path):
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(64 * 1024), b''):
+                digest.update(chunk)
+    except OSError:
+        digest.update(b'\0MISSING\0')
+
+
+def get_cache_key(data, *paths, digests=()):
+    digest = sha256()
+    for key, value in sorted(data.items()):
+        digest.update(f'{key}\0{value}\0'.encode('utf-8'))
+    for fileDigest in digests:
+        digest.update(fileDigest.encode('ascii'))
+    for path in paths:
+        hash_file(digest, path)
+    return digest.hexdigest()
+
+
+def get_cached_file(key):
+    path = join(get_cache_directory(), f'{key}.pdf')
+    if not isfile(path):
+        return None
+    # Eviction is least-recently-used, so a hit refreshes the entry.
+    try:
+        utime(path)
+    except OSError:
+        return None
+    return path
+
+
+def store_file(key, sourcePath):
+    path = join(get_cache_directory(), f'{key}.pdf')
+    replace(sourcePath, path)
+    evict_cached_files_periodically()
+    return path
+
+
+def evict_cached_files_periodically():
+    # Scanning the cache costs as much as its size, so a process evicts at
+    # most once per PDF_CACHE_EVICTION_INTERVAL seconds.
+    global lastEviction
+    with evictionLock:
+        if time() - lastEviction < PDF_CACHE_EVICTION_INTERVAL:
+            return
+        lastEviction = time()
+    evict_cached_files()
+
+
+def evict_cached_files(maxSize=None, maxAge=None):
+    maxSize = PDF_CACHE_MAX_SIZE if maxSize is None else maxSize
+    maxAge = max(
+        PDF_CACHE_MAX_AGE if maxAge is None else maxAge,
+        PDF_CACHE_GRACE_PERIOD,
+    )
+    now = time()
+    entries = []
+    for entry in scandir(get_cache_directory()):
+        if not entry.is_file() or not entry.name.endswith('.pdf'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > maxAge:
+            remove_cached_file(entry.path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    totalSize = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if totalSize <= maxSize or now - mtime < PDF_CACHE_GRACE_PERIOD:
+            break
+        remove_cached_file(path)
+        totalSize -= size
+
+
+def remove_cached_file(path):
+    try:
+        remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,62 @@
+from re import compile
+
+from django.db import NotSupportedError, connection
+from django.db.transaction import atomic
+
+from Invoicee.models import Invoicee
+from .models import Invoice, Payment, MonthlySummary, SUMMARY_STATES
+
+
+# Plan lines reading a whole table, per database vendor. SQLite reports
+# index walks as "SCAN <table> USING [COVERING] INDEX", which are not full
+# table scans.
+FULL_SCAN_PATTERNS = {
+    'sqlite': compile(
+        r'\bSCAN (?:TABLE )?(?!TABLE\b|CONSTANT ROW\b)(\w+)\b(?! USING)'
+    ),
+    'postgresql': compile(r'Seq Scan on "?(\w+)"?'),
+}
+
+
+def get_view_querysets(invoicer, invoicee, beginDate, endDate):
+    return {
+        'InvoiceList': Invoice.objects.filter(
+            invoicer=invoicer,
+            state__in=[0, 2, 3],
+            facturationDate__range=(beginDate, endDate),
+        ).order_by('-facturationDate', '-id'),
+        'Dashboard': Invoice.objects.filter(
+            invoicer=invoicer,
+            state__in=SUMMARY_STATES,
+            facturationDate__range=(beginDate, endDate),
+        ).values('baseCurrency').order_by(),
+        'MonthlySummaries': MonthlySummary.objects.filter(
+            invoicer=invoicer,
+            month__range=(beginDate, endDate),
+        ),
+        'InvoiceeInvoices': Invoice.objects.filter(
+            invoicee=invoicee,
+            facturationDate__range=(beginDate, endDate),
+        ),
+        'Overdue': Invoice.objects.overdue(endDate),
+        'PaymentList': Payment.objects.filter(
+            payor__in=Invoicee.objects.filter(invoicer=invoicer),
+            paymentDay__range=(beginDate, endDate),
+        ),
+    }
+
+
+def explain_queryset(queryset):
+    pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        raise NotSupportedError(
+            f'Full scans cannot be detected on {connection.vendor}.'
+        )
+    with atomic():
+        # PostgreSQL prefers sequential scans on small tables, so they are
+        # only reported when no index could be used at all.
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+    return plan, pattern.findall(plan)
@@ -22,14 +22,17 @@ class PaymentForm(ModelForm):
             owedAmount = 0
             if len(set(invoices.values_list('baseCurrency', flat=True))) > 1:
                 raise ValidationError(_('InvoicesHaveMoreThanOneBaseCurrency'))
-            if self.instance.id:
-                numInvoices = self.instance.invoice.count()
-                for invoice in invoices:
-                    owedAmount += round(self.instance.paidAmount / numInvoices, 2)
-                    owedAmount += invoice.owedAmount - invoice.paidAmount
-            else:
-                for invoice in invoices:
-                    owedAmount += invoice.owedAmount - invoice.paidAmount
+            allocated = {}
+            if not self.instance._state.adding:
+                allocated = dict(
+                    self.instance.paymentallocation_set.values_list(
+                        'invoice_id',
+                        'amount',
+                    )
+                )
+            for invoice in invoices:
+                owedAmount += allocated.get(invoice.id, 0)
+                owedAmount += invoice.owedAmount - invoice.paidAmount
             if owedAmount < self.cleaned_data['paidAmount']:
                 raise ValidationError(_('PaidAmountExceedsOwedAmount'))
 
@@ -41,6 +44,7 @@ class PaymentForm(ModelForm):
             'bankAccount',
             'paymentMethod',
             'paidAmount',
+            'allocationStrategy',
             'paymentDay',
         ]
         widgets = {
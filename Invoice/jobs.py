@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from Core.models import RenderJobKinds, RenderJobStates
+from Core.exceptions import LateXError
+from .models import RenderJob
+from .utils import get_invoice_pdf, get_receipt_pdf
+
+
+RENDER_JOB_RETENTION = getattr(
+    settings,
+    'RENDER_JOB_RETENTION',
+    timedelta(days=1),
+)
+
+
+def enqueue_invoice_render(invoice, user=None, backend=''):
+    return RenderJob.objects.create(
+        kind=RenderJobKinds.INVOICE,
+        invoice=invoice,
+        requestedBy=user,
+        backend=backend,
+    )
+
+
+def enqueue_receipt_render(payment, user=None):
+    return RenderJob.objects.create(
+        kind=RenderJobKinds.RECEIPT,
+        payment=payment,
+        requestedBy=user,
+    )
+
+
+def claim_render_jobs(limit):
+    claimedJobs = []
+    pendingJobs = RenderJob.objects.filter(
+        state=RenderJobStates.PENDING,
+    ).order_by('id').values_list('id', flat=True)[:limit]
+    for jobID in pendingJobs:
+        # The conditional update is the lock: only one worker can move a
+        # given job out of the pending state.
+        claimed = RenderJob.objects.filter(
+            id=jobID,
+            state=RenderJobStates.PENDING,
+        ).update(
+            state=RenderJobStates.RUNNING,
+            startedAt=timezone.now(),
+        )
+        if claimed:
+            claimedJobs.append(jobID)
+    return claimedJobs
+
+
+def render_job(job):
+    if job.kind == RenderJobKinds.INVOICE:
+        pathToFile, fileName = get_invoice_pdf(job.invoice, job.backend)
+        with open(pathToFile, 'rb') as pdfFile:
+            return fileName, pdfFile.read()
+    pdfFile, fileName = get_receipt_pdf(job.payment)
+    with pdfFile:
+        return fileName, pdfFile.read()
+
+
+def run_render_job(jobID):
+    close_old_connections()
+    job = RenderJob.objects.select_related(
+        'invoice__invoicer__legalinformation',
+        'invoice__invoicee',
+        'invoice__bankAccount',
+        'payment__payor__invoicer__legalinformation',
+        'payment__bankAccount',
+    ).get(id=jobID)
+    try:
+        job.fileName, job.pdf = render_job(job)
+        job.state = RenderJobStates.DONE
+    except LateXError as e:
+        job.error = ' '.join(e.args)
+        job.state = RenderJobStates.FAILED
+    except Exception as e:
+        job.error = repr(e)
+        job.state = RenderJobStates.FAILED
+    job.finishedAt = timezone.now()
+    job.save()
+    close_old_connections()
+    return job.state
+
+
+def requeue_stale_render_jobs(timeout):
+    return RenderJob.objects.filter(
+        state=RenderJobStates.RUNNING,
+        startedAt__lt=timezone.now() - timeout,
+    ).update(state=RenderJobStates.PENDING, startedAt=None)
+
+
+def prune_render_jobs(retention=None):
+    if retention is None:
+        retention = RENDER_JOB_RETENTION
+    return RenderJob.objects.filter(
+        state__in=[RenderJobStates.DONE, RenderJobStates.FAILED],
+        finishedAt__lt=timezone.now() - retention,
+    ).delete()
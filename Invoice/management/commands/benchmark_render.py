@@ -0,0 +1,80 @@
+from os.path import join
+from statistics import mean, median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Invoice.models import Invoice
+from Invoice.utils import (
+    compile_texFile,
+    generate_invoice_tex,
+    get_scratch_directory,
+)
+from Invoice.preamble import get_preamble_format
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Compares the per-invoice xelatex time with and without the '
+        'precompiled preamble format.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('invoices', nargs='*', type=int)
+        parser.add_argument('--runs', type=int, default=3)
+
+    def time_compile(self, rawTexs, formatName, runs):
+        timings = []
+        for _ in range(runs):
+            for rawTex in rawTexs:
+                with get_scratch_directory() as directory:
+                    texFilePath = join(directory, 'benchmark.tex')
+                    with open(texFilePath, 'w', encoding='utf-8') as texFile:
+                        texFile.write(rawTex)
+                    start = perf_counter()
+                    compile_texFile(texFilePath, directory, formatName)
+                    timings.append(perf_counter() - start)
+        return timings
+
+    def report(self, label, timings):
+        self.stdout.write(
+            f'{label:<24} mean {mean(timings):.3f}s '
+            f'median {median(timings):.3f}s ({len(timings)} compiles)'
+        )
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.select_related(
+            'invoicer__legalinformation',
+            'invoicee',
+            'bankAccount',
+        ).filter(state__in=[2, 3])
+        if options['invoices']:
+            invoices = invoices.filter(id__in=options['invoices'])
+        else:
+            invoices = invoices.order_by('-id')[:5]
+        rawTexs = [generate_invoice_tex(invoice) for invoice in invoices]
+        if not rawTexs:
+            raise CommandError('No validated invoices to benchmark.')
+
+        start = perf_counter()
+        formatName = get_preamble_format('invoice.tex')
+        if formatName is None:
+            raise CommandError(
+                'The invoice.tex preamble could not be precompiled.'
+            )
+        self.stdout.write(
+            f'format {formatName} ready in {perf_counter() - start:.3f}s'
+        )
+
+        fullTimings = self.time_compile(rawTexs, None, options['runs'])
+        formatTimings = self.time_compile(
+            rawTexs,
+            formatName,
+            options['runs'],
+        )
+        self.report('full preamble', fullTimings)
+        self.report('precompiled preamble', formatTimings)
+        self.stdout.write(
+            f'speedup {mean(fullTimings) / mean(formatTimings):.2f}x'
+        )
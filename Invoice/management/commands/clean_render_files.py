@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from Invoice.cache import evict_cached_files
+from Invoice.utils import clean_scratch_files, RENDER_SCRATCH_MAX_AGE
+
+
+class Command(BaseCommand):
+
+    help = 'Removes orphaned render scratch files and evicts the PDF cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=RENDER_SCRATCH_MAX_AGE,
+            help='Seconds after which a scratch file is considered orphaned.',
+        )
+
+    def handle(self, *args, **options):
+        removed = clean_scratch_files(options['max_age'])
+        evict_cached_files()
+        self.stdout.write(f'Removed {removed} orphaned render files.')
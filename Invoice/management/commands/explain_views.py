@@ -0,0 +1,66 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from Invoice.explain import get_view_querysets, explain_queryset
+from Invoicee.models import Invoicee
+from Invoicer.models import Invoicer
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Prints the query plans of the main invoice, dashboard and payment '
+        'querysets, and fails if one of them scans a whole table.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('invoicer', type=int)
+        parser.add_argument(
+            '--invoicee',
+            type=int,
+            help='Invoicee of the invoicee queries, the first one by default.',
+        )
+        parser.add_argument(
+            '--begin',
+            type=date.fromisoformat,
+            default=date(date.today().year, 1, 1),
+        )
+        parser.add_argument(
+            '--end',
+            type=date.fromisoformat,
+            default=date(date.today().year, 12, 31),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            invoicer = Invoicer.objects.get(id=options['invoicer'])
+            invoicees = invoicer.invoicee_set.order_by('id')
+            if options['invoicee'] is not None:
+                invoicees = invoicees.filter(id=options['invoicee'])
+            invoicee = invoicees[:1].get()
+        except (Invoicer.DoesNotExist, Invoicee.DoesNotExist):
+            raise CommandError('No such invoicer or invoicee.')
+        fullScans = {}
+        for name, queryset in get_view_querysets(
+            invoicer,
+            invoicee,
+            options['begin'],
+            options['end'],
+        ).items():
+            try:
+                plan, tables = explain_queryset(queryset)
+            except NotSupportedError as exception:
+                raise CommandError(str(exception))
+            self.stdout.write(f'{name}:\n{plan}\n')
+            if tables:
+                fullScans[name] = tables
+        if fullScans:
+            raise CommandError(
+                'Full scans: ' + ', '.join(
+                    f'{name} ({", ".join(tables)})'
+                    for name, tables in fullScans.items()
+                )
+            )
+        self.stdout.write('No query scans a whole table.')
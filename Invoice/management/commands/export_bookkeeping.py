@@ -0,0 +1,244 @@
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictWriter
+from datetime import date, datetime
+from decimal import Decimal
+from os import makedirs
+from os.path import join, isfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+
+from Invoice.models import Invoice
+from Invoice.utils import (
+    EXPORT_CHUNK_SIZE,
+    get_invoice_chunks,
+    export_invoices_data,
+)
+from Invoicer.models import Invoicer
+from InvoiceGenerator.settings import EXPORT_DATA_HEADER
+
+
+CENT = Decimal('0.01')
+EXPORTED_STATES = [2, 3, 4]
+
+
+class CSVJournalWriter:
+
+    extension = 'csv'
+
+    def __init__(self, path, headers):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.dictWriter = DictWriter(self.file, headers)
+        self.dictWriter.writeheader()
+
+    def write(self, rows):
+        self.dictWriter.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetJournalWriter:
+
+    extension = 'parquet'
+
+    def __init__(self, path, headers):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise CommandError('The parquet format requires pyarrow.')
+        self.pyarrow = pyarrow
+        self.headers = headers
+        # Journal lines are (due date, account, name, label, piece, debit,
+        # credit, facturation date), accounts being numbers or labels.
+        amount = pyarrow.decimal128(14, 2)
+        self.schema = pyarrow.schema(zip(headers, [
+            pyarrow.date32(),
+            pyarrow.string(),
+            pyarrow.string(),
+            pyarrow.string(),
+            pyarrow.string(),
+            amount,
+            amount,
+            pyarrow.date32(),
+        ]))
+        self.parquetWriter = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def convert(self, row):
+        values = [row[header] for header in self.headers]
+        values[1] = str(values[1])
+        values[5] = Decimal(values[5]).quantize(CENT)
+        values[6] = Decimal(values[6]).quantize(CENT)
+        return dict(zip(self.headers, values))
+
+    def write(self, rows):
+        self.rows.extend(self.convert(row) for row in rows)
+        if len(self.rows) >= EXPORT_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.parquetWriter.write_table(
+                self.pyarrow.Table.from_pylist(self.rows, schema=self.schema)
+            )
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.parquetWriter.close()
+
+
+JOURNAL_WRITERS = {
+    'csv': CSVJournalWriter,
+    'parquet': ParquetJournalWriter,
+}
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Exports the bookkeeping journal lines of validated invoices and '
+        'credit notes, one directory per invoicer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to export to.')
+        parser.add_argument('--begin', type=date.fromisoformat)
+        parser.add_argument('--end', type=date.fromisoformat)
+        parser.add_argument(
+            '--invoicers',
+            nargs='+',
+            type=int,
+            help='Only export the invoices of these invoicers.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=list(JOURNAL_WRITERS),
+            default='csv',
+        )
+        parser.add_argument(
+            '--monthly',
+            action='store_true',
+            help='Write one file per facturation month.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of invoicers exported in parallel.',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=(
+                'Only export the invoices changed since the last incremental '
+                'run into the same directory.'
+            ),
+        )
+
+    def get_watermark_path(self, output):
+        return join(output, '.watermark')
+
+    def read_watermark(self, output):
+        path = self.get_watermark_path(output)
+        if not isfile(path):
+            return None
+        with open(path, encoding='utf-8') as file:
+            return datetime.fromisoformat(file.read().strip())
+
+    def write_watermark(self, output, watermark):
+        with open(
+            self.get_watermark_path(output),
+            'w',
+            encoding='utf-8',
+        ) as file:
+            file.write(watermark.isoformat())
+
+    def export_invoicer(self, invoicerID, invoices, output, options, stamp):
+        journalWriter = JOURNAL_WRITERS[options['format']]
+        writer = None
+        partition = None
+        invoiceCount = 0
+        try:
+            for chunk in get_invoice_chunks(
+                invoices.filter(
+                    invoicer_id=invoicerID,
+                ).select_related(
+                    'invoicer',
+                    'invoicee',
+                ).order_by(
+                    'facturationDate',
+                    'id',
+                ).iterator(chunk_size=EXPORT_CHUNK_SIZE),
+                EXPORT_CHUNK_SIZE,
+            ):
+                for invoice, data in zip(
+                    chunk,
+                    export_invoices_data(chunk, EXPORT_DATA_HEADER),
+                ):
+                    invoicePartition = (
+                        f'{invoice.facturationDate:%Y-%m}'
+                        if options['monthly'] else ''
+                    )
+                    # Invoices come in facturation order, so only one
+                    # partition is open at a time.
+                    if writer is None or invoicePartition != partition:
+                        if writer is not None:
+                            writer.close()
+                        partition = invoicePartition
+                        directory = join(output, str(invoicerID), partition)
+                        makedirs(directory, exist_ok=True)
+                        writer = journalWriter(
+                            join(
+                                directory,
+                                f'{stamp}.{journalWriter.extension}',
+                            ),
+                            EXPORT_DATA_HEADER,
+                        )
+                    writer.write(data)
+                    invoiceCount += 1
+        finally:
+            if writer is not None:
+                writer.close()
+            connection.close()
+        return invoiceCount
+
+    def handle(self, *args, **options):
+        output = options['output']
+        makedirs(output, exist_ok=True)
+        startedAt = now()
+        invoices = Invoice.objects.filter(state__in=EXPORTED_STATES)
+        if options['begin'] is not None:
+            invoices = invoices.filter(facturationDate__gte=options['begin'])
+        if options['end'] is not None:
+            invoices = invoices.filter(facturationDate__lte=options['end'])
+        if options['incremental']:
+            watermark = self.read_watermark(output)
+            if watermark is not None:
+                invoices = invoices.filter(updatedAt__gt=watermark)
+        invoicerIDs = Invoicer.objects.order_by('id').values_list(
+            'id',
+            flat=True,
+        )
+        if options['invoicers']:
+            invoicerIDs = invoicerIDs.filter(id__in=options['invoicers'])
+        stamp = f'{startedAt:%Y%m%dT%H%M%S}'
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            invoiceCounts = list(executor.map(
+                lambda invoicerID: self.export_invoicer(
+                    invoicerID,
+                    invoices,
+                    output,
+                    options,
+                    stamp,
+                ),
+                list(invoicerIDs),
+            ))
+        # The watermark only moves once every invoicer was exported, so a
+        # failed run is fully repeated by the next one.
+        if options['incremental']:
+            self.write_watermark(output, startedAt)
+        self.stdout.write(f'{sum(invoiceCounts)} invoices were exported.')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from Invoice.models import MonthlySummary
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Rebuilds the monthly invoice summaries used by the dashboard from '
+        'the invoices.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'invoicers',
+            nargs='*',
+            type=int,
+            help='Only rebuild the summaries of these invoicers.',
+        )
+
+    def handle(self, *args, **options):
+        summaryCount = MonthlySummary.rebuild(options['invoicers'])
+        self.stdout.write(f'{summaryCount} monthly summaries were rebuilt.')
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Now
+from django.db.transaction import atomic
+
+from Invoice.models import (
+    Invoice,
+    Project,
+    MonthlySummary,
+    TOTAL_FIELDS,
+)
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Recomputes the stored project and invoice totals from their fees '
+        'and reports the ones that were out of date.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('invoices', nargs='*', type=int)
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify the stored totals, fail if any differ.',
+        )
+
+    def compare(self, instance, totals):
+        return [
+            f'{field}: {getattr(instance, field)} != {total}'
+            for field, total in totals.items()
+            if getattr(instance, field) != total
+        ]
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.order_by('id')
+        if options['invoices']:
+            invoices = invoices.filter(id__in=options['invoices'])
+        mismatches = 0
+        for invoice in invoices.iterator(chunk_size=500):
+            with atomic():
+                invoiceTotals = {field: 0 for field in TOTAL_FIELDS}
+                for project in invoice.project_set.all():
+                    totals = project.compute_totals()
+                    for field in TOTAL_FIELDS:
+                        invoiceTotals[field] += totals[field]
+                    differences = self.compare(project, totals)
+                    if differences:
+                        mismatches += 1
+                        self.stdout.write(
+                            f'Project {project.id}: {", ".join(differences)}'
+                        )
+                        if not options['check']:
+                            Project.objects.filter(id=project.id).update(
+                                **totals,
+                            )
+                differences = self.compare(invoice, invoiceTotals)
+                if differences:
+                    mismatches += 1
+                    self.stdout.write(
+                        f'Invoice {invoice.id}: {", ".join(differences)}'
+                    )
+                    if not options['check']:
+                        Invoice.objects.filter(id=invoice.id).update(
+                            updatedAt=Now(),
+                            **invoiceTotals,
+                        )
+                        MonthlySummary.refresh_invoices(
+                            Invoice.objects.filter(id=invoice.id),
+                        )
+        if options['check'] and mismatches:
+            raise CommandError(f'{mismatches} stored totals are out of date.')
+        self.stdout.write(f'{mismatches} stored totals were out of date.')
@@ -0,0 +1,82 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait,
+)
+from datetime import timedelta
+from multiprocessing import get_context
+from os import cpu_count
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from Invoice.jobs import (
+    claim_render_jobs,
+    run_render_job,
+    requeue_stale_render_jobs,
+    prune_render_jobs,
+)
+from Invoice.utils import clean_scratch_files
+
+
+class Command(BaseCommand):
+
+    help = 'Compiles queued invoice and receipt PDFs with a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=getattr(settings, 'RENDER_WORKER_PROCESSES', cpu_count()),
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=600,
+            help='Seconds after which a running job is considered lost.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is drained.',
+        )
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        staleAfter = timedelta(seconds=options['stale_after'])
+        requeued = requeue_stale_render_jobs(staleAfter)
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale jobs.')
+        clean_scratch_files()
+        # Forked workers must not share the parent's database connections,
+        # so the pool is started before the parent touches the database again.
+        connections.close_all()
+        running = set()
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=get_context('fork'),
+        ) as executor:
+            executor.submit(int).result()
+            while True:
+                freeSlots = processes - len(running)
+                if freeSlots > 0:
+                    for jobID in claim_render_jobs(freeSlots):
+                        running.add(executor.submit(run_render_job, jobID))
+                if not running:
+                    if options['once']:
+                        break
+                    prune_render_jobs()
+                    sleep(options['poll_interval'])
+                    continue
+                done, running = wait(
+                    running,
+                    timeout=options['poll_interval'],
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    exception = future.exception()
+                    if exception is not None:
+                        self.stderr.write(repr(exception))
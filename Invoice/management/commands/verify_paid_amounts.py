@@ -0,0 +1,120 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Sum, Count, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.db.transaction import atomic
+from django.utils.timezone import now
+
+from Invoice.models import (
+    Invoice,
+    Payment,
+    PaymentAllocation,
+    MonthlySummary,
+)
+from Invoice.allocation import distribute, update_invoice_state
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Checks the paid amount of every invoice against its payment '
+        'allocations.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Set the paid amounts to the allocated totals.',
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help=(
+                'First split payments without recorded allocations equally '
+                'across their invoices.'
+            ),
+        )
+
+    def backfill(self):
+        payments = dict(
+            Payment.objects.annotate(
+                allocated=Sum('paymentallocation__amount'),
+                links=Count('paymentallocation'),
+            ).filter(
+                allocated=0,
+                links__gt=0,
+                paidAmount__gt=0,
+            ).values_list('id', 'paidAmount')
+        )
+        allocations = defaultdict(list)
+        for allocation in PaymentAllocation.objects.filter(
+            payment_id__in=payments,
+        ).order_by('invoice_id'):
+            allocations[allocation.payment_id].append(allocation)
+        for paymentID, paymentAllocations in allocations.items():
+            shares = distribute(
+                payments[paymentID],
+                [Decimal(1)] * len(paymentAllocations),
+            )
+            for allocation, share in zip(paymentAllocations, shares):
+                allocation.amount = share
+        PaymentAllocation.objects.bulk_update(
+            [
+                allocation
+                for paymentAllocations in allocations.values()
+                for allocation in paymentAllocations
+            ],
+            ['amount'],
+            batch_size=500,
+        )
+        self.stdout.write(f'Backfilled {len(allocations)} payments.')
+
+    def handle(self, *args, **options):
+        with atomic():
+            if options['backfill']:
+                self.backfill()
+            invoices = list(
+                Invoice.objects.annotate(
+                    allocated=Coalesce(
+                        Sum('paymentallocation__amount'),
+                        Value(Decimal(0)),
+                        output_field=DecimalField(
+                            max_digits=12,
+                            decimal_places=2,
+                        ),
+                    ),
+                ).exclude(
+                    paidAmount=F('allocated'),
+                ).only(
+                    'id',
+                    'state',
+                    'paidAmount',
+                    'owedAmount',
+                    'updatedAt',
+                )
+            )
+            for invoice in invoices:
+                self.stdout.write(
+                    f'Invoice {invoice.id}: paid {invoice.paidAmount}, '
+                    f'allocated {invoice.allocated}'
+                )
+                invoice.paidAmount = invoice.allocated
+                update_invoice_state(invoice)
+                invoice.updatedAt = now()
+            if options['fix']:
+                Invoice.objects.bulk_update(
+                    invoices,
+                    ['paidAmount', 'state', 'updatedAt'],
+                    batch_size=500,
+                )
+                MonthlySummary.refresh_invoices(
+                    Invoice.objects.filter(
+                        id__in=[invoice.id for invoice in invoices],
+                    )
+                )
+        if invoices and not options['fix']:
+            raise CommandError(f'{len(invoices)} paid amounts are out of date.')
+        self.stdout.write(f'{len(invoices)} paid amounts were out of date.')
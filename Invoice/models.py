@@ -1,19 +1,31 @@
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
 
 from django.urls import reverse_lazy
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.db.transaction import atomic
 from django.db.models import (
-    Q, F, When, Case, Value, Avg, Sum,
+    Q, F, When, Case, Value, Sum, Count, Max,
+    OuterRef, Exists,
     Model,
+    QuerySet,
+    Index,
+    UniqueConstraint,
     ForeignKey,
     IntegerField,
     CharField,
+    TextField,
+    BinaryField,
     DateField,
+    DateTimeField,
     DecimalField,
     GeneratedField,
     ManyToManyField,
     CASCADE,
+    SET_NULL,
 )
+from django.db.models.functions import Now, TruncMonth
 from django.db.models.lookups import LessThanOrEqual
 from django.core.validators import (
     MinValueValidator,
@@ -28,14 +40,89 @@ from Core.models import (
     PaymentMethod,
     SystemCurrency,
     InvoiceStates,
+    RenderJobKinds,
+    RenderJobStates,
+    PDFBackends,
+    DocumentTypes,
+    AllocationStrategies,
 )
 from Core.utils import (
     get_currency_symbol,
 )
 
 
+TOTAL_FIELDS = ['beforeVATAmount', 'vatAmount', 'afterVATAmount']
+# Invoice amounts kept by refresh_totals and the payment allocations.
+AMOUNT_FIELDS = ['owedAmount', 'paidAmount']
+SUMMARY_STATES = [2, 3]
+# Aggregates are aliased apart from the Invoice and MonthlySummary fields, as
+# an alias named after a field shadows it in the following aggregates.
+SUMMARY_AGGREGATES = {
+    'numInvoices': Count('id'),
+    'numPaidInvoices': Count('id', filter=Q(state=3)),
+    'numOpenInvoices': Count('id', filter=Q(state=2)),
+    'sumBeforeVAT': Sum('beforeVATAmount'),
+    'sumVAT': Sum('vatAmount'),
+    'sumAfterVAT': Sum('afterVATAmount'),
+    'sumPaid': Sum('paidAmount', filter=Q(paidAmount__gt=0)),
+    'sumOutstanding': Sum(
+        F('owedAmount') - F('paidAmount'),
+        filter=Q(state=2, paidAmount__gt=0),
+    ),
+    'sumOpenOwed': Sum('owedAmount', filter=Q(state=2)),
+    'sumOpenPaid': Sum('paidAmount', filter=Q(state=2)),
+}
+SUMMARY_FIELDS = {
+    'numInvoices': 'invoiceCount',
+    'numPaidInvoices': 'paidInvoiceCount',
+    'numOpenInvoices': 'openInvoiceCount',
+    'sumBeforeVAT': 'beforeVATAmount',
+    'sumVAT': 'vatAmount',
+    'sumAfterVAT': 'afterVATAmount',
+    'sumPaid': 'paidAmount',
+    'sumOutstanding': 'outstandingAmount',
+    'sumOpenOwed': 'openOwedAmount',
+    'sumOpenPaid': 'openPaidAmount',
+}
+
+
+def get_update_fields(instance, excludedFields):
+    # Stored totals are only written by refresh_totals, so that saving a
+    # stale instance cannot overwrite them.
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key
+        and not field.generated
+        and field.name not in excludedFields
+    ]
+
+
+class InvoiceQuerySet(QuerySet):
+
+    def with_flags(self):
+        return self.annotate(
+            hasProjects=Exists(Project.objects.filter(invoice=OuterRef('pk'))),
+            hasEmptyProjects=Exists(
+                Project.objects.filter(
+                    invoice=OuterRef('pk'),
+                    fee__isnull=True,
+                )
+            ),
+        )
+
+    def outstanding(self):
+        return self.filter(status=1)
+
+    def overdue(self, day=None):
+        # Overdue depends on the current day, so it is compared at query time
+        # against the (status, dueDate) index instead of being stored.
+        return self.outstanding().filter(dueDate__lte=day or date.today())
+
+
 class Invoice(Model):
 
+    objects = InvoiceQuerySet.as_manager()
+
     invoicer = ForeignKey(
         'Invoicer.Invoicer',
         on_delete=CASCADE,
@@ -107,9 +194,8 @@ class Invoice(Model):
         verbose_name=_('State'),
     )
     # 0: Draft or Estimate
-    # 1: Validated, not paid and not overdue
+    # 1: Validated and not paid, overdue once dueDate has passed
     # 2: Validated and fully Paid
-    # 3: Validated, not paid and overdue
     status = GeneratedField(
         expression=Case(
             When(Q(state__in=[0, 1]), then=Value(0)),
@@ -117,7 +203,6 @@ class Invoice(Model):
                 Q(LessThanOrEqual(F('owedAmount'), F('paidAmount'))),
                 then=Value(2),
             ),
-            When(dueDate__lte=date.today(), then=Value(3)),
             default=1,
         ),
         output_field=IntegerField(),
@@ -140,6 +225,33 @@ class Invoice(Model):
         null=True,
         blank=True,
     )
+    beforeVATAmount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        editable=False,
+        verbose_name=_('TotalBeforeVAT'),
+    )
+    vatAmount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        editable=False,
+        verbose_name=_('TotalVAT'),
+    )
+    afterVATAmount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        editable=False,
+        verbose_name=_('TotalAfterVAT'),
+    )
+    updatedAt = DateTimeField(
+        auto_now=True,
+        db_default=Now(),
+        db_index=True,
+        verbose_name=_('UpdatedAt'),
+    )
 
     def __str__(self):
         if self.state == 0:
@@ -183,45 +295,30 @@ class Invoice(Model):
                 raise ValidationError(_('DueDateIsLessThanFacturationDate'))
 
     def save(self, *args, **kwargs):
-        invoices = Invoice.objects
         self.description = f'{self.invoicer}|{self.invoicee}'
-        if self.state == 0 or self.state == 1:
-            self.count = None
-        elif self.state == 4 and (
-            self.count is None
-            or isinstance(self.count, DatabaseDefault)
-            or self.count == 0
-        ):
-            invoices = invoices.filter(
-                state=4,
-            ).filter(
-                invoicer=self.invoicer,
-            ).filter(
-                facturationDate__gte=f'{self.facturationDate.year}-01-01',
-            ).filter(
-                facturationDate__lte=f'{self.facturationDate.year}-12-31',
-            )
-            self.count = 1 if invoices.count() == 0 else max(
-                invoice.count for invoice in invoices
-            ) + 1
-        elif self.state == 2 and (
-            self.count is None
-            or isinstance(self.count, DatabaseDefault)
-            or self.count == 0
-        ):
-            invoices = invoices.filter(
-                state__in=[2, 3],
-            ).filter(
-                invoicer=self.invoicer,
-            ).filter(
-                facturationDate__gte=f'{self.facturationDate.year}-01-01',
-            ).filter(
-                facturationDate__lte=f'{self.facturationDate.year}-12-31',
-            )
-            self.count = 1 if invoices.count() == 0 else max(
-                invoice.count for invoice in invoices
-            ) + 1
-        super(Invoice, self).save()
+        with atomic():
+            if self.state == 0 or self.state == 1:
+                self.count = None
+            elif self.state in [2, 4] and (
+                self.count is None
+                or isinstance(self.count, DatabaseDefault)
+                or self.count == 0
+            ):
+                self.count = InvoiceSequence.next_value(
+                    self.invoicer,
+                    self.facturationDate.year,
+                    (
+                        DocumentTypes.CREDITNOTE
+                        if self.state == 4
+                        else DocumentTypes.INVOICE
+                    ),
+                )
+            if not self._state.adding and 'update_fields' not in kwargs:
+                kwargs['update_fields'] = get_update_fields(
+                    self,
+                    TOTAL_FIELDS + AMOUNT_FIELDS,
+                )
+            super(Invoice, self).save(*args, **kwargs)
 
     @property
     def outstandingAmount(self):
@@ -231,43 +328,178 @@ class Invoice(Model):
             return 0
 
     @property
-    def wellFormed(self):
-        wellFormed = self.project_set.count() > 0
-        return wellFormed and all(
-            project.fee_set.count() > 0 for project in self.project_set.all()
+    def isOverdue(self):
+        return (
+            self.status == 1
+            and self.dueDate is not None
+            and self.dueDate <= date.today()
         )
 
+    @property
+    def wellFormed(self):
+        # Invoices from Invoice.objects.with_flags() carry the flags, others
+        # read them in a single query.
+        if hasattr(self, 'hasProjects'):
+            flags = {
+                'hasProjects': self.hasProjects,
+                'hasEmptyProjects': self.hasEmptyProjects,
+            }
+        else:
+            flags = Invoice.objects.filter(id=self.id).with_flags().values(
+                'hasProjects',
+                'hasEmptyProjects',
+            ).get()
+        return flags['hasProjects'] and not flags['hasEmptyProjects']
+
     @property
     def downloadable(self):
         return self.wellFormed
 
+    def compute_totals(self):
+        totals = self.project_set.aggregate(
+            beforeVATAmount=Sum('beforeVATAmount'),
+            vatAmount=Sum('vatAmount'),
+            afterVATAmount=Sum('afterVATAmount'),
+        )
+        return {
+            field: Decimal(0) if total is None else total
+            for field, total in totals.items()
+        }
+
+    def refresh_totals(self):
+        with atomic():
+            # Locking the invoice row serializes concurrent fee edits, so
+            # each recomputation sees the fees committed before it.
+            stored = Invoice.objects.select_for_update().values(
+                'afterVATAmount',
+                'owedAmount',
+            ).get(id=self.id)
+            totals = self.compute_totals()
+            # owedAmount may have been set by hand (e.g. for credit notes),
+            # so it only follows the change of the computed total.
+            owedAmount = (
+                stored['owedAmount']
+                + totals['afterVATAmount']
+                - stored['afterVATAmount']
+            )
+            Invoice.objects.filter(id=self.id).update(
+                owedAmount=owedAmount,
+                updatedAt=Now(),
+                **totals,
+            )
+            MonthlySummary.refresh_invoices(
+                Invoice.objects.filter(id=self.id),
+            )
+        self.owedAmount = owedAmount
+        for field, total in totals.items():
+            setattr(self, field, total)
+
     @property
     def totalBeforeVAT(self):
-        return sum(
-            project.totalBeforeVAT for project in self.project_set.all()
-        )
+        return self.beforeVATAmount
 
     @property
     def totalVAT(self):
-        return sum(project.totalVAT for project in self.project_set.all())
+        return self.vatAmount
 
     @property
     def totalAfterVAT(self):
-        return sum(project.totalAfterVAT for project in self.project_set.all())
+        return self.afterVATAmount
 
     @property
     def avgVAT(self):
-        if self.project_set.all().count() > 0:
-            return (
-                sum(project.avgVAT for project in self.project_set.all())
-                / self.project_set.count()
-            )
-        else:
-            return 0
+        averages = [
+            vatSum / feeCount
+            for vatSum, feeCount in self.project_set.filter(
+                feeCount__gt=0,
+            ).values_list('vatSum', 'feeCount')
+        ]
+        return sum(averages) / len(averages) if averages else 0
 
     class Meta:
         verbose_name = _('INVOICE')
         verbose_name_plural = _('INVOICES')
+        indexes = [
+            Index(
+                fields=['invoicer', 'state', 'facturationDate'],
+                name='invoice_invoicer_state_date',
+            ),
+            Index(
+                fields=['invoicee', 'facturationDate', 'baseCurrency'],
+                name='invoice_invoicee_date',
+            ),
+            Index(fields=['status', 'dueDate'], name='invoice_status_due'),
+        ]
+
+
+class InvoiceSequence(Model):
+
+    invoicer = ForeignKey(
+        'Invoicer.Invoicer',
+        on_delete=CASCADE,
+        verbose_name=_('INVOICER'),
+    )
+    year = IntegerField(verbose_name=_('Year'))
+    documentType = CharField(
+        max_length=2,
+        choices=DocumentTypes,
+        default=DocumentTypes.INVOICE,
+        verbose_name=_('DocumentType'),
+    )
+    value = IntegerField(db_default=0, verbose_name=_('LastNumber'))
+
+    @classmethod
+    def get_initial_value(cls, invoicer, year, documentType):
+        # Sequences created after invoices were already numbered continue
+        # from the highest number in use.
+        return Invoice.objects.filter(
+            invoicer=invoicer,
+            state__in=(
+                [4] if documentType == DocumentTypes.CREDITNOTE else [2, 3]
+            ),
+            facturationDate__year=year,
+        ).aggregate(value=Max('count'))['value'] or 0
+
+    @classmethod
+    def next_value(cls, invoicer, year, documentType):
+        sequences = cls.objects.filter(
+            invoicer=invoicer,
+            year=year,
+            documentType=documentType,
+        )
+        with atomic():
+            # The UPDATE locks the row until the surrounding transaction ends,
+            # so concurrent callers are serialized and the number is only
+            # consumed if the invoice is saved.
+            if not sequences.update(value=F('value') + 1):
+                try:
+                    with atomic():
+                        cls.objects.create(
+                            invoicer=invoicer,
+                            year=year,
+                            documentType=documentType,
+                            value=cls.get_initial_value(
+                                invoicer,
+                                year,
+                                documentType,
+                            ) + 1,
+                        )
+                except IntegrityError:
+                    sequences.update(value=F('value') + 1)
+            return sequences.values_list('value', flat=True).get()
+
+    def __str__(self):
+        return f'{self.invoicer}|{self.get_documentType_display()}:{self.year}'
+
+    class Meta:
+        verbose_name = _('InvoiceSequence')
+        verbose_name_plural = _('InvoiceSequences')
+        constraints = [
+            UniqueConstraint(
+                fields=['invoicer', 'year', 'documentType'],
+                name='unique_invoice_sequence',
+            ),
+        ]
 
 
 class Project(Model):
@@ -282,41 +514,95 @@ class Project(Model):
         db_default='',
         verbose_name=_('Title'),
     )
+    beforeVATAmount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        editable=False,
+        verbose_name=_('TotalBeforeVAT'),
+    )
+    vatAmount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        editable=False,
+        verbose_name=_('TotalVAT'),
+    )
+    afterVATAmount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        editable=False,
+        verbose_name=_('TotalAfterVAT'),
+    )
+    feeCount = IntegerField(
+        db_default=0,
+        editable=False,
+        verbose_name=_('NumFees'),
+    )
+    vatSum = IntegerField(db_default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = get_update_fields(
+                self,
+                TOTAL_FIELDS + ['feeCount', 'vatSum'],
+            )
+        super().save(*args, **kwargs)
+
+    def compute_totals(self):
+        totals = {
+            'beforeVATAmount': Decimal(0),
+            'vatAmount': Decimal(0),
+            'afterVATAmount': Decimal(0),
+            'feeCount': 0,
+            'vatSum': 0,
+        }
+        for count, rateUnit, vat in self.fee_set.values_list(
+            'count',
+            'rateUnit',
+            'vat',
+        ):
+            fee = Fee(count=count, rateUnit=rateUnit, vat=vat)
+            totals['beforeVATAmount'] += fee.totalBeforeVAT
+            totals['vatAmount'] += fee.totalVAT
+            totals['afterVATAmount'] += fee.totalAfterVAT
+            totals['feeCount'] += 1
+            totals['vatSum'] += vat
+        return totals
 
-    def delete(self, *args, **kwargs):
-        invoice = self.invoice
-        invoice.owedAmount -= self.totalAfterVAT
-        invoice.save()
-        super().delete(*args, **kwargs)
+    def refresh_totals(self):
+        with atomic():
+            Invoice.objects.select_for_update().filter(
+                id=self.invoice_id,
+            ).exists()
+            totals = self.compute_totals()
+            Project.objects.filter(id=self.id).update(**totals)
+            for field, total in totals.items():
+                setattr(self, field, total)
+            self.invoice.refresh_totals()
 
     @property
     def totalBeforeVAT(self):
-        return self.fee_set.aggregate(totalBeforeVAT=Sum('rateUnit'))[
-            'totalBeforeVAT'
-        ]
+        return self.beforeVATAmount
 
     @property
     def totalVAT(self):
-        return round(
-            self.fee_set.annotate(
-                VAT=F('rateUnit')*F('vat')/100
-            ).aggregate(
-                total=Sum('VAT')
-            )['total'],
-            2,
-        )
+        return self.vatAmount
 
     @property
     def totalAfterVAT(self):
-        return self.totalBeforeVAT + self.totalVAT
+        return self.afterVATAmount
 
     @property
     def avgVAT(self):
-        return self.fee_set.aggregate(averageVAT=Avg('vat'))['averageVAT']
+        if self.feeCount == 0:
+            return None
+        return self.vatSum / self.feeCount
 
     @property
     def numFees(self):
-        return self.fee_set.count()
+        return self.feeCount
 
     def __str__(self):
         return f'{self.invoice}|{self.title}'
@@ -358,16 +644,9 @@ class Fee(Model):
     )
 
     def save(self, *args, **kwargs):
-        super(Fee, self).save(*args, **kwargs)
-        invoice = self.project.invoice
-        invoice.owedAmount += self.totalAfterVAT
-        invoice.save()
-
-    def delete(self, *args, **kwargs):
-        invoice = self.project.invoice
-        invoice.owedAmount -= self.totalAfterVAT
-        invoice.save()
-        super(Fee, self).delete(*args, **kwargs)
+        with atomic():
+            super(Fee, self).save(*args, **kwargs)
+            self.project.refresh_totals()
 
     @property
     def totalBeforeVAT(self):
@@ -420,6 +699,7 @@ class Payment(Model):
     )
     invoice = ManyToManyField(
         'Invoice.Invoice',
+        through='Invoice.PaymentAllocation',
         verbose_name=_('PaidInvoices'),
         related_name='paymentInvoice',
         related_query_name='paymentInvoice',
@@ -431,41 +711,350 @@ class Payment(Model):
         null=True,
         blank=True,
     )
+    allocationStrategy = CharField(
+        max_length=2,
+        choices=AllocationStrategies,
+        default=AllocationStrategies.EQUAL,
+        verbose_name=_('AllocationStrategy'),
+    )
     history = HistoricalRecords()
 
     def __str__(self):
         return f'{self.payor}|{self.paymentDay}'
 
-    def save(self, *args, **kwargs):
-        # lastPayment = self.history.last()
-        # if lastPayment is not None:
-        #     coverage = round(
-        #         Decimal(lastPayment.paidAmount / self.invoice.count()),
-        #         2,
-        #     )
-        #     for invoice in self.invoice.all():
-        #         invoice.paidAmount -= coverage
-        #         invoice.save()
-        super(Payment, self).save()
-        # numInvoices = self.invoice.count()
-        # if numInvoices > 0:
-        #     coverage = round(Decimal(self.paidAmount / numInvoices), 2)
-        #     for invoice in self.invoice.all():
-        #         invoice.paidAmount += coverage
-        #         invoice.save()
-
-    def delete(self, *args, **kwargs):
-        invoices = self.invoice
-        coverage = round(self.paidAmount / invoices.count(), 2)
-        for invoice in invoices.all():
-            invoice.paidAmount -= coverage
-            invoice.state = 2
-            invoice.save()
-        super(Payment, self).delete()
-
     def get_absolute_url(self):
         return reverse_lazy('Invoice:payment', args=[self.id])
 
     class Meta:
         verbose_name = _('Payment')
         verbose_name_plural = _('Payments')
+        indexes = [
+            Index(fields=['payor', 'paymentDay'], name='payment_payor_day'),
+        ]
+
+
+class PaymentAllocation(Model):
+
+    payment = ForeignKey(
+        'Invoice.Payment',
+        on_delete=CASCADE,
+        verbose_name=_('Payment'),
+    )
+    invoice = ForeignKey(
+        'Invoice.Invoice',
+        on_delete=CASCADE,
+        verbose_name=_('INVOICE'),
+    )
+    amount = DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        db_default=0,
+        verbose_name=_('AllocatedAmount'),
+    )
+
+    def __str__(self):
+        return f'{self.payment}|{self.invoice}:{self.amount}'
+
+    class Meta:
+        verbose_name = _('PaymentAllocation')
+        verbose_name_plural = _('PaymentAllocations')
+        constraints = [
+            UniqueConstraint(
+                fields=['payment', 'invoice'],
+                name='unique_payment_allocation',
+            ),
+        ]
+
+
+class MonthlySummary(Model):
+
+    invoicer = ForeignKey(
+        'Invoicer.Invoicer',
+        on_delete=CASCADE,
+        verbose_name=_('INVOICER'),
+    )
+    invoicee = ForeignKey(
+        'Invoicee.Invoicee',
+        on_delete=CASCADE,
+        verbose_name=_('INVOICEE'),
+    )
+    currency = CharField(
+        max_length=4,
+        choices=SystemCurrency,
+        verbose_name=_('BaseCurrency'),
+    )
+    month = DateField(verbose_name=_('Month'))
+    paymentMethod = CharField(
+        max_length=2,
+        choices=PaymentMethod,
+        verbose_name=_('PaymentMethod'),
+    )
+    invoiceCount = IntegerField(db_default=0, verbose_name=_('InvoiceCount'))
+    paidInvoiceCount = IntegerField(
+        db_default=0,
+        verbose_name=_('PaidInvoiceCount'),
+    )
+    openInvoiceCount = IntegerField(
+        db_default=0,
+        verbose_name=_('OpenInvoiceCount'),
+    )
+    beforeVATAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('TotalBeforeVAT'),
+    )
+    vatAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('TotalVAT'),
+    )
+    afterVATAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('TotalAfterVAT'),
+    )
+    paidAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('PaidAmount'),
+    )
+    outstandingAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('OutstandingAmount'),
+    )
+    openOwedAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('OpenOwedAmount'),
+    )
+    openPaidAmount = DecimalField(
+        decimal_places=2,
+        max_digits=12,
+        db_default=0,
+        verbose_name=_('OpenPaidAmount'),
+    )
+
+    @staticmethod
+    def get_key(invoice):
+        if (
+            invoice.state not in SUMMARY_STATES
+            or invoice.facturationDate is None
+        ):
+            return None
+        return (
+            invoice.invoicer_id,
+            invoice.invoicee_id,
+            invoice.baseCurrency,
+            invoice.facturationDate.replace(day=1),
+            invoice.paymentMethod,
+        )
+
+    @staticmethod
+    def get_keys(invoices):
+        return {
+            (
+                row['invoicer'],
+                row['invoicee'],
+                row['baseCurrency'],
+                row['month'],
+                row['paymentMethod'],
+            )
+            for row in invoices.filter(
+                state__in=SUMMARY_STATES,
+                facturationDate__isnull=False,
+            ).values(
+                'invoicer',
+                'invoicee',
+                'baseCurrency',
+                'paymentMethod',
+                month=TruncMonth('facturationDate'),
+            ).distinct()
+        }
+
+    @staticmethod
+    def get_filter(key):
+        invoicer, invoicee, currency, month, paymentMethod = key
+        return {
+            'invoicer_id': invoicer,
+            'invoicee_id': invoicee,
+            'currency': currency,
+            'month': month,
+            'paymentMethod': paymentMethod,
+        }
+
+    @staticmethod
+    def get_totals(key):
+        invoicer, invoicee, currency, month, paymentMethod = key
+        totals = Invoice.objects.filter(
+            state__in=SUMMARY_STATES,
+            invoicer_id=invoicer,
+            invoicee_id=invoicee,
+            baseCurrency=currency,
+            paymentMethod=paymentMethod,
+            facturationDate__gte=month,
+            facturationDate__lt=(month + timedelta(days=32)).replace(day=1),
+        ).aggregate(**SUMMARY_AGGREGATES)
+        return {
+            SUMMARY_FIELDS[alias]: 0 if total is None else total
+            for alias, total in totals.items()
+        }
+
+    @classmethod
+    def refresh(cls, keys):
+        # A month is recomputed from its invoices while its row is locked,
+        # so concurrent changes to the same month are applied one after
+        # the other. Keys are sorted to always lock rows in the same order.
+        for key in sorted(key for key in keys if key is not None):
+            summaries = cls.objects.filter(**cls.get_filter(key))
+            with atomic():
+                if summaries.select_for_update().exists():
+                    summaries.update(**cls.get_totals(key))
+                    continue
+                totals = cls.get_totals(key)
+                if not totals['invoiceCount']:
+                    continue
+                try:
+                    with atomic():
+                        cls.objects.create(**cls.get_filter(key), **totals)
+                except IntegrityError:
+                    summaries.select_for_update().exists()
+                    summaries.update(**cls.get_totals(key))
+
+    @classmethod
+    def refresh_invoices(cls, invoices):
+        cls.refresh(cls.get_keys(invoices))
+
+    @classmethod
+    def rebuild(cls, invoicers=None):
+        invoices = Invoice.objects.filter(
+            state__in=SUMMARY_STATES,
+            facturationDate__isnull=False,
+        )
+        summaries = cls.objects.all()
+        if invoicers:
+            invoices = invoices.filter(invoicer__in=invoicers)
+            summaries = summaries.filter(invoicer__in=invoicers)
+        with atomic():
+            summaries.delete()
+            return len(cls.objects.bulk_create(
+                (
+                    cls(
+                        invoicer_id=row['invoicer'],
+                        invoicee_id=row['invoicee'],
+                        currency=row['baseCurrency'],
+                        month=row['month'],
+                        paymentMethod=row['paymentMethod'],
+                        **{
+                            field: 0 if row[alias] is None else row[alias]
+                            for alias, field in SUMMARY_FIELDS.items()
+                        },
+                    )
+                    for row in invoices.values(
+                        'invoicer',
+                        'invoicee',
+                        'baseCurrency',
+                        'paymentMethod',
+                        month=TruncMonth('facturationDate'),
+                    ).annotate(**SUMMARY_AGGREGATES).order_by()
+                ),
+                batch_size=1000,
+            ))
+
+    def __str__(self):
+        return f'{self.invoicer}|{self.invoicee}:{self.month:%Y-%m}'
+
+    class Meta:
+        verbose_name = _('MonthlySummary')
+        verbose_name_plural = _('MonthlySummaries')
+        constraints = [
+            UniqueConstraint(
+                fields=[
+                    'invoicer',
+                    'invoicee',
+                    'currency',
+                    'month',
+                    'paymentMethod',
+                ],
+                name='unique_monthly_summary',
+            ),
+        ]
+
+
+class RenderJob(Model):
+
+    kind = CharField(
+        max_length=2,
+        choices=RenderJobKinds,
+        default=RenderJobKinds.INVOICE,
+        verbose_name=_('Kind'),
+    )
+    invoice = ForeignKey(
+        'Invoice.Invoice',
+        on_delete=CASCADE,
+        null=True,
+        blank=True,
+        verbose_name=_('INVOICE'),
+    )
+    payment = ForeignKey(
+        'Invoice.Payment',
+        on_delete=CASCADE,
+        null=True,
+        blank=True,
+        verbose_name=_('Payment'),
+    )
+    requestedBy = ForeignKey(
+        User,
+        on_delete=SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name=_('RequestedBy'),
+    )
+    state = IntegerField(
+        choices=RenderJobStates,
+        default=RenderJobStates.PENDING,
+        verbose_name=_('State'),
+    )
+    backend = CharField(
+        max_length=2,
+        choices=PDFBackends,
+        db_default='',
+        blank=True,
+        verbose_name=_('PDFBackend'),
+    )
+    fileName = CharField(
+        max_length=100,
+        db_default='',
+        blank=True,
+        verbose_name=_('FileName'),
+    )
+    pdf = BinaryField(null=True, blank=True, verbose_name=_('PDF'))
+    error = TextField(db_default='', blank=True, verbose_name=_('Error'))
+    createdAt = DateTimeField(auto_now_add=True, verbose_name=_('CreatedAt'))
+    startedAt = DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('StartedAt'),
+    )
+    finishedAt = DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_('FinishedAt'),
+    )
+
+    def __str__(self):
+        return f'{self.get_kind_display()}:{self.id}|{self.get_state_display()}'
+
+    @property
+    def finished(self):
+        return self.state in [RenderJobStates.DONE, RenderJobStates.FAILED]
+
+    class Meta:
+        verbose_name = _('RenderJob')
+        verbose_name_plural = _('RenderJobs')
@@ -0,0 +1,210 @@
+from io import BytesIO
+from unicodedata import normalize
+from zlib import compress
+
+
+PAGE_WIDTH = 595.28
+PAGE_HEIGHT = 841.89
+CM = 72 / 2.54
+
+# Advance widths of the base-14 Helvetica faces for the printable ASCII range
+# (32-126), in thousandths of the font size.
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333,
+    278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278,
+    584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278,
+    500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944,
+    667, 667, 611, 278, 278, 278, 469, 556, 333, 556, 556, 500, 556, 556,
+    278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500,
+    278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333,
+    278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333,
+    584, 584, 584, 611, 975, 722, 722, 722, 722, 667, 611, 778, 722, 278,
+    556, 722, 611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944,
+    667, 667, 611, 333, 278, 333, 584, 556, 333, 556, 611, 556, 611, 556,
+    333, 611, 611, 278, 278, 556, 278, 889, 611, 611, 611, 611, 389, 556,
+    333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+FONTS = {
+    False: ('F1', 'Helvetica', HELVETICA_WIDTHS),
+    True: ('F2', 'Helvetica-Bold', HELVETICA_BOLD_WIDTHS),
+}
+
+
+def char_width(char, widths):
+    # Accented letters are measured as their base letter.
+    base = normalize('NFD', char)[:1] or char
+    if 32 <= ord(base) <= 126:
+        return widths[ord(base) - 32]
+    return 556
+
+
+def text_width(text, size, bold=False):
+    widths = FONTS[bold][2]
+    return sum(char_width(char, widths) for char in text) * size / 1000
+
+
+def wrap_text(text, width, size, bold=False):
+    lines = []
+    for paragraph in str(text).splitlines() or ['']:
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f'{line} {word}' if line else word
+            if text_width(candidate, size, bold) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            while text_width(word, size, bold) > width and len(word) > 1:
+                cut = len(word) - 1
+                while cut > 1 and text_width(word[:cut], size, bold) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def encode_text(text):
+    # The base-14 fonts only cover WinAnsiEncoding, so text outside cp1252
+    # raises UnicodeEncodeError rather than being printed as question marks.
+    return str(text).encode('cp1252').replace(
+        b'\\', b'\\\\'
+    ).replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class PDFPage:
+
+    def __init__(self):
+        self.content = bytearray()
+
+    def text(self, x, y, text, size=10, bold=False, align='left'):
+        width = text_width(text, size, bold)
+        if align == 'right':
+            x -= width
+        elif align == 'center':
+            x -= width / 2
+        font = FONTS[bold][0]
+        self.content += b'BT /%s %.2f Tf %.2f %.2f Td (' % (
+            font.encode('ascii'), size, x, y,
+        )
+        self.content += encode_text(text) + b') Tj ET\n'
+        return width
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.content += b'%.2f w %.2f %.2f m %.2f %.2f l S\n' % (
+            width, x1, y1, x2, y2,
+        )
+
+    def image(self, name, x, y, width, height):
+        self.content += b'q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q\n' % (
+            width, height, x, y, name.encode('ascii'),
+        )
+
+
+class PDFFlow:
+
+    def __init__(self, document, top, bottom, decorate=None):
+        self.document = document
+        self.top = top
+        self.bottom = bottom
+        self.decorate = decorate
+        self.new_page()
+
+    def new_page(self):
+        self.page = self.document.add_page()
+        self.y = self.top
+        if self.decorate is not None:
+            self.decorate(self.page)
+
+    def reserve(self, height):
+        if self.y - height < self.bottom:
+            self.new_page()
+        return self.page
+
+
+class PDFDocument:
+
+    def __init__(self):
+        self.pages = []
+        self.images = {}
+
+    def add_page(self):
+        page = PDFPage()
+        self.pages.append(page)
+        return page
+
+    def add_jpeg(self, data, width, height):
+        name = f'Im{len(self.images) + 1}'
+        self.images[name] = (data, width, height)
+        return name
+
+    def render(self):
+        objects = [None, None]
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        fonts = b''.join(
+            b'/%s %d 0 R ' % (
+                key.encode('ascii'),
+                add(
+                    b'<< /Type /Font /Subtype /Type1 /BaseFont /%s '
+                    b'/Encoding /WinAnsiEncoding >>' % name.encode('ascii')
+                ),
+            )
+            for key, name, _ in FONTS.values()
+        )
+        images = b''.join(
+            b'/%s %d 0 R ' % (
+                name.encode('ascii'),
+                add(
+                    b'<< /Type /XObject /Subtype /Image /Width %d '
+                    b'/Height %d /ColorSpace /DeviceRGB /BitsPerComponent 8 '
+                    b'/Filter /DCTDecode /Length %d >>\nstream\n' % (
+                        width, height, len(data),
+                    ) + data + b'\nendstream'
+                ),
+            )
+            for name, (data, width, height) in self.images.items()
+        )
+        resources = b'<< /Font << %s>> /XObject << %s>> >>' % (fonts, images)
+        kids = []
+        for page in self.pages:
+            stream = compress(bytes(page.content))
+            contents = add(
+                b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(
+                    stream
+                ) + stream + b'\nendstream'
+            )
+            kids.append(add(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] '
+                b'/Resources %s /Contents %d 0 R >>' % (
+                    PAGE_WIDTH, PAGE_HEIGHT, resources, contents,
+                )
+            ))
+        objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % kid for kid in kids),
+            len(kids),
+        )
+        output = BytesIO()
+        output.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(output.tell())
+            output.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        xref = output.tell()
+        output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        for offset in offsets:
+            output.write(b'%010d 00000 n \n' % offset)
+        output.write(
+            b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+                len(objects) + 1, xref,
+            )
+        )
+        return output.getvalue()
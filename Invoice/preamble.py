@@ -0,0 +1,97 @@
+from os import getcwd, makedirs, replace
+from os.path import isfile, join, splitext
+from subprocess import run, DEVNULL
+from tempfile import TemporaryDirectory
+from threading import Lock
+
+from django.conf import settings
+
+from InvoiceGenerator.settings import TEMPTEXFILESDIR
+from .templating import get_tex_template
+
+
+LATEX_PRECOMPILE_PREAMBLE = getattr(
+    settings,
+    'LATEX_PRECOMPILE_PREAMBLE',
+    True,
+)
+FORMATS_DIR = getattr(
+    settings,
+    'LATEX_FORMATS_DIR',
+    join(TEMPTEXFILESDIR, 'formats'),
+)
+
+formatsLock = Lock()
+failedFormats = set()
+rebuiltFormats = set()
+
+
+def get_formats_directory():
+    directory = join(getcwd(), FORMATS_DIR)
+    makedirs(directory, exist_ok=True)
+    return directory
+
+
+def get_format_name(templateName, template):
+    return f'{splitext(templateName)[0]}-{template.digest[:16]}'
+
+
+def build_preamble_format(templateName, formatName):
+    templateDirectory = join(getcwd(), TEMPTEXFILESDIR)
+    with TemporaryDirectory(prefix='format-', dir=templateDirectory) as scratch:
+        run(
+            [
+                'xelatex',
+                '-ini',
+                '-interaction=nonstopmode',
+                f'-jobname={formatName}',
+                f'-output-directory={scratch}',
+                '&xelatex',
+                'mylatexformat.ltx',
+                templateName,
+            ],
+            cwd=templateDirectory,
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+        )
+        formatFile = join(scratch, f'{formatName}.fmt')
+        if not isfile(formatFile):
+            return False
+        replace(formatFile, join(get_formats_directory(), f'{formatName}.fmt'))
+        return True
+
+
+def get_preamble_format(templateName):
+    if not LATEX_PRECOMPILE_PREAMBLE:
+        return None
+    template = get_tex_template(templateName)
+    if not template.staticPreamble:
+        return None
+    formatName = get_format_name(templateName, template)
+    if formatName in failedFormats:
+        return None
+    if isfile(join(get_formats_directory(), f'{formatName}.fmt')):
+        return formatName
+    with formatsLock:
+        if isfile(join(get_formats_directory(), f'{formatName}.fmt')):
+            return formatName
+        if build_preamble_format(templateName, formatName):
+            return formatName
+        # A preamble that cannot be dumped (e.g. fonts loaded through
+        # fontspec before \endofdump) falls back to full compilation.
+        failedFormats.add(formatName)
+        return None
+
+
+def rebuild_preamble_format(templateName, formatName):
+    with formatsLock:
+        # A format that still fails once rebuilt is given up, so documents
+        # are not compiled twice on every render.
+        if formatName not in rebuiltFormats and build_preamble_format(
+            templateName,
+            formatName,
+        ):
+            rebuiltFormats.add(formatName)
+            return formatName
+        failedFormats.add(formatName)
+        return None
@@ -1,74 +1,74 @@
-from collections.abc import Iterable
-from decimal import Decimal
 from django.db.models.signals import (
     pre_save,
     post_save,
     pre_delete,
+    post_delete,
     m2m_changed,
 )
 from django.dispatch import receiver
-from .models import Payment, Invoice, Project, Fee
+from .models import Invoice, Project, Fee, Payment, MonthlySummary
+from .allocation import allocate_payment, release_payment
 
 
-def m2m_changed_payment_invoice_pre_add(payment):
-    if payment.invoice.count() > 0:
-        lastPayment = payment.history.last()
-        coverage = Decimal(
-            round(
-                lastPayment.paidAmount / payment.invoice.all().count(), 2
-            )
-        )
-        for invoice in payment.invoice.all():
-            invoice.paidAmount -= coverage
-            invoice.state = 2
-            invoice.save()
+@receiver(pre_save, sender=Invoice)
+def pre_save_invoice(sender=None, instance=None, **kwargs):
+    # The stored row tells which month the invoice is leaving.
+    instance._summaryKeys = MonthlySummary.get_keys(
+        Invoice.objects.filter(id=instance.id)
+    ) if not instance._state.adding else set()
 
 
-def m2m_changed_payment_invoice_post_add(payment):
-    for invoice in payment.invoice.all():
-        invoice.paidAmount += Decimal(
-            round(
-                payment.paidAmount / payment.invoice.all().count(), 2
-            )
+@receiver(post_save, sender=Invoice)
+def post_save_invoice(sender=None, instance=None, **kwargs):
+    if not kwargs.get('raw'):
+        MonthlySummary.refresh(
+            getattr(instance, '_summaryKeys', set())
+            | MonthlySummary.get_keys(Invoice.objects.filter(id=instance.id))
         )
-        invoice.state = 2 if invoice.paidAmount < invoice.owedAmount else 3
-        invoice.paymentMethod = payment.paymentMethod
-        invoice.save()
 
 
-def m2m_changed_payment_invoice_pre_remove(payment):
-    for invoice in payment.invoice.all():
-        invoice.paidAmount -= Decimal(
-            round(
-                payment.paidAmount / payment.invoice.all().count(), 2
-            )
-        )
-        invoice.state = 2
-        invoice.save()
+@receiver(pre_delete, sender=Invoice)
+def pre_delete_invoice(sender=None, instance=None, **kwargs):
+    instance._summaryKeys = MonthlySummary.get_keys(
+        Invoice.objects.filter(id=instance.id)
+    )
 
 
-def m2m_changed_payment_invoice_post_remove(payment):
-    lastPayment = payment.history.last()
-    for invoice in payment.invoice.all():
-        invoice.paidAmount += Decimal(
-            round(
-                lastPayment.paidAmount / payment.invoice.all().count(), 2
-            )
-        )
-        invoice.state = 2 if invoice.paidAmount < invoice.owedAmount else 3
-        invoice.save()
+@receiver(post_delete, sender=Invoice)
+def post_delete_invoice(sender=None, instance=None, **kwargs):
+    MonthlySummary.refresh(getattr(instance, '_summaryKeys', set()))
 
 
-def m2m_changed_payment_invoice_pre_clear(payment):
-    for invoice in payment.invoice.all():
-        invoice = Invoice.objects.filter(id=id).first()
-        invoice.paidAmount -= Decimal(
-            round(
-                payment.paidAmount / payment.invoice.all().count(), 2
-            )
-        )
-        invoice.state = 2
-        invoice.save()
+@receiver(post_delete, sender=Fee)
+def post_delete_fee(sender=None, instance=None, **kwargs):
+    # Queryset deletes and cascades skip Model.delete, so the stored totals
+    # are refreshed here. Parents deleted in the same cascade are skipped.
+    project = Project.objects.filter(id=instance.project_id).first()
+    if project is not None:
+        project.refresh_totals()
+
+
+@receiver(post_delete, sender=Project)
+def post_delete_project(sender=None, instance=None, **kwargs):
+    invoice = Invoice.objects.filter(id=instance.invoice_id).first()
+    if invoice is not None:
+        invoice.refresh_totals()
+
+
+@receiver(post_save, sender=Payment)
+def post_save_payment(sender=None, instance=None, created=None, **kwargs):
+    # New payments get their invoices afterwards, through m2m_changed.
+    if not created and not kwargs.get('raw'):
+        allocate_payment(instance)
+
+
+@receiver(pre_delete, sender=Payment)
+def pre_delete_payment(sender=None, instance=None, **kwargs):
+    release_payment(instance)
+
+
+def get_payment_invoiceIDs(payment):
+    return set(payment.invoice.values_list('id', flat=True))
 
 
 @receiver(m2m_changed, sender=Payment.invoice.through)
@@ -78,19 +78,34 @@ def m2m_changed_payment_invoice(
     action=None,
     reverse=None,
     model=None,
-    pq_set=None,
+    pk_set=None,
     using=None,
     **kwargs,
 ):
-    if action == 'pre_add':
-        m2m_changed_payment_invoice_pre_add(instance)
-    elif action == 'post_add':
-        m2m_changed_payment_invoice_post_add(instance)
+    # Removed links are released before their allocation rows disappear,
+    # added links (created with a zero amount) are allocated afterwards.
+    if not reverse:
+        if action == 'post_add':
+            allocate_payment(instance)
+        elif action == 'pre_remove':
+            allocate_payment(
+                instance,
+                get_payment_invoiceIDs(instance) - pk_set,
+            )
+        elif action == 'pre_clear':
+            release_payment(instance)
+        return
+    if action in ['post_add', 'pre_remove']:
+        payments = Payment.objects.filter(id__in=pk_set)
     elif action == 'pre_clear':
-        m2m_changed_payment_invoice_pre_clear(instance)
-    elif action == 'post_clear':
-        pass
-    elif action == 'pre_remove':
-        m2m_changed_payment_invoice_pre_remove(instance)
-    elif action == 'post_remove':
-        m2m_changed_payment_invoice_post_remove(instance)
+        payments = instance.paymentInvoice.all()
+    else:
+        return
+    for payment in payments:
+        if action == 'post_add':
+            allocate_payment(payment)
+        else:
+            allocate_payment(
+                payment,
+                get_payment_invoiceIDs(payment) - {instance.id},
+            )
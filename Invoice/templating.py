@@ -0,0 +1,76 @@
+from hashlib import sha256
+from os import getcwd
+from os.path import getmtime, join
+from re import compile as compile_regex
+from threading import Lock
+
+from django.utils.translation import gettext as _
+
+from InvoiceGenerator.settings import TEMPTEXFILESDIR
+from Core.exceptions import TemplateError
+
+
+PLACEHOLDER = compile_regex(r'(%[A-Z]+%)')
+
+
+class TexTemplate:
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = getmtime(path)
+        with open(path, 'rb') as texFile:
+            rawTex = texFile.read()
+        self.digest = sha256(rawTex).hexdigest()
+        # split() with a capturing group alternates literal chunks and
+        # placeholders, so rendering is a single join over both lists.
+        source = rawTex.decode('utf-8')
+        chunks = PLACEHOLDER.split(source)
+        self.literals = chunks[0::2]
+        self.keys = chunks[1::2]
+        self.placeholders = frozenset(self.keys)
+        self.staticPreamble = has_static_preamble(source)
+
+    def render(self, data):
+        missing = self.placeholders.difference(data)
+        unknown = set(data).difference(self.placeholders)
+        if missing or unknown:
+            raise TemplateError(
+                _('TemplatePlaceholdersMismatch'),
+                self.path,
+                f'missing={sorted(missing)}',
+                f'unknown={sorted(unknown)}',
+            )
+        pieces = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            pieces.append(data[key])
+            pieces.append(literal)
+        return ''.join(pieces)
+
+
+def has_static_preamble(source):
+    # A preamble can only be dumped into a format when nothing in it depends
+    # on the rendered data; mylatexformat stops at \endofdump if present.
+    end = source.find('\\endofdump')
+    if end == -1:
+        end = source.find('\\begin{document}')
+    if end == -1:
+        return False
+    placeholder = PLACEHOLDER.search(source)
+    return placeholder is None or placeholder.start() > end
+
+
+templates = {}
+templatesLock = Lock()
+
+
+def get_tex_template(name):
+    path = join(getcwd(), TEMPTEXFILESDIR, name)
+    mtime = getmtime(path)
+    template = templates.get(path)
+    if template is None or template.mtime != mtime:
+        with templatesLock:
+            template = templates.get(path)
+            if template is None or template.mtime != mtime:
+                template = TexTemplate(path)
+                templates[path] = template
+    return template
@@ -1,14 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
-from django.test import TestCase
+from decimal import Decimal
+from threading import Barrier
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.transaction import atomic
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
 from django.core.exceptions import ValidationError
+from django.urls import reverse
 from Invoice.models import (
     Invoice,
     Project,
     Fee,
     Payment,
+    PaymentAllocation,
+    MonthlySummary,
+    InvoiceSequence,
 )
+from Invoice.forms import PaymentForm
+from Invoice.utils import create_credit_note
+from Core.models import AllocationStrategies, DocumentTypes
 from Invoicee.models import Invoicee
 from Invoicer.models import Invoicer
+from home.dashboard import get_currency_figures, get_dashboard
+from home.cache import (
+    get_cached_dashboard,
+    get_dashboard_cache_stats,
+)
 
 
 class InvoiceTestCase(TestCase):
@@ -386,6 +411,116 @@ class ManyInvoicesOnePaymentModifyTestCase(TestCase):
         self.assertEqual(invoice.paidAmount, 1000)
 
 
+class PaymentAllocationFollowsInvoicesTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID in range(2):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=2,
+                facturationDate=date.today(),
+                dueDate=date.today(),
+            )
+            Project.objects.create(id=invoiceID, invoice_id=invoiceID)
+            Fee.objects.create(
+                project_id=invoiceID,
+                rateUnit=1000,
+                count=1,
+                vat=10,
+            )
+        payment = Payment.objects.create(
+            id=0,
+            payor_id=0,
+            paymentDay=date.today(),
+            paidAmount=2200,
+        )
+        payment.invoice.add(*Invoice.objects.all())
+
+    def test_allocationsFollowInvoiceChanges(self):
+        payment = Payment.objects.get(id=0)
+        self.assertEqual(Invoice.objects.get(id=0).paidAmount, 1100)
+        invoice_2 = Invoice.objects.create(
+            id=2,
+            invoicer_id=0,
+            invoicee_id=0,
+            state=2,
+            facturationDate=date.today(),
+            dueDate=date.today(),
+        )
+        payment.invoice.add(invoice_2)
+        self.assertEqual(
+            sorted(
+                PaymentAllocation.objects.filter(
+                    payment=payment,
+                ).values_list('amount', flat=True)
+            ),
+            [Decimal('733.33'), Decimal('733.33'), Decimal('733.34')],
+        )
+        payment.invoice.remove(invoice_2)
+        self.assertEqual(Invoice.objects.get(id=2).paidAmount, 0)
+        self.assertEqual(Invoice.objects.get(id=0).paidAmount, 1100)
+        self.assertEqual(Invoice.objects.get(id=0).state, 3)
+
+
+class PaymentFormTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID in range(2):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=2,
+                facturationDate=date.today(),
+                dueDate=date.today(),
+            )
+            Project.objects.create(id=invoiceID, invoice_id=invoiceID)
+            Fee.objects.create(
+                project_id=invoiceID,
+                rateUnit=1000,
+                count=1,
+                vat=0,
+            )
+        self.payment = Payment.objects.create(
+            id=0,
+            payor_id=0,
+            paymentDay=date.today(),
+            paidAmount=1000,
+            allocationStrategy=AllocationStrategies.EQUAL,
+        )
+        self.payment.invoice.add(*Invoice.objects.all())
+
+    def get_form_data(self, **data):
+        return {
+            'payor': 0,
+            'invoice': [0, 1],
+            'paymentMethod': self.payment.paymentMethod,
+            'paidAmount': 1000,
+            'allocationStrategy': AllocationStrategies.EQUAL,
+            'paymentDay': date.today().isoformat(),
+            **data,
+        }
+
+    def test_form_countsTheAllocationsOfThePayment(self):
+        self.assertEqual(Invoice.objects.get(id=0).paidAmount, 500)
+        form = PaymentForm(
+            self.get_form_data(paidAmount=2000),
+            instance=self.payment,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form = PaymentForm(
+            self.get_form_data(paidAmount=2001),
+            instance=self.payment,
+        )
+        self.assertFalse(form.is_valid())
+
+
 class ManyInvoicesOnePaymentDeleteTestCase(TestCase):
 
     def setUp(self):
@@ -433,3 +568,497 @@ class ManyInvoicesOnePaymentDeleteTestCase(TestCase):
         self.assertEqual(invoice.paidAmount, 0)
         invoice = Invoice.objects.get(id=1)
         self.assertEqual(invoice.paidAmount, 0)
+
+
+class StoredTotalsTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        Invoice.objects.create(
+            id=0,
+            invoicer_id=0,
+            invoicee_id=0,
+            state=2,
+            facturationDate=date.today(),
+            dueDate=date.today(),
+        )
+        Project.objects.create(id=0, invoice_id=0, title='First')
+        Project.objects.create(id=1, invoice_id=0, title='Second')
+        Fee.objects.create(id=0, project_id=0, rateUnit=1000, count=2, vat=10)
+        Fee.objects.create(id=1, project_id=1, rateUnit=100, count=1, vat=20)
+
+    def test_totals_afterAddingFees(self):
+        project = Project.objects.get(id=0)
+        self.assertEqual(project.totalBeforeVAT, 2000)
+        self.assertEqual(project.totalVAT, 200)
+        self.assertEqual(project.numFees, 1)
+        invoice = Invoice.objects.get(id=0)
+        self.assertEqual(invoice.totalBeforeVAT, 2100)
+        self.assertEqual(invoice.totalVAT, 220)
+        self.assertEqual(invoice.totalAfterVAT, 2320)
+        self.assertEqual(invoice.owedAmount, 2320)
+        self.assertEqual(invoice.avgVAT, 15)
+
+    def test_totals_afterModifyingFee(self):
+        fee = Fee.objects.get(id=0)
+        fee.count = 1
+        fee.save()
+        invoice = Invoice.objects.get(id=0)
+        self.assertEqual(invoice.totalAfterVAT, 1220)
+        self.assertEqual(invoice.owedAmount, 1220)
+
+    def test_totals_afterDeletingFeeAndProject(self):
+        Fee.objects.get(id=1).delete()
+        self.assertEqual(Invoice.objects.get(id=0).totalAfterVAT, 2200)
+        Project.objects.get(id=0).delete()
+        invoice = Invoice.objects.get(id=0)
+        self.assertEqual(invoice.totalAfterVAT, 0)
+        self.assertEqual(invoice.owedAmount, 0)
+
+    def test_totals_afterQuerySetDeletes(self):
+        Fee.objects.filter(id=1).delete()
+        project = Project.objects.get(id=1)
+        self.assertEqual((project.totalAfterVAT, project.numFees), (0, 0))
+        self.assertEqual(Invoice.objects.get(id=0).totalAfterVAT, 2200)
+        Project.objects.filter(id=0).delete()
+        invoice = Invoice.objects.get(id=0)
+        self.assertEqual((invoice.totalAfterVAT, invoice.owedAmount), (0, 0))
+        Invoice.objects.filter(id=0).delete()
+        self.assertFalse(Project.objects.exists())
+
+    def test_staleInvoiceSave_keepsTotals(self):
+        invoice = Invoice.objects.get(id=0)
+        Fee.objects.create(project_id=1, rateUnit=100, count=1, vat=0)
+        invoice.save()
+        invoice = Invoice.objects.get(id=0)
+        self.assertEqual(invoice.totalAfterVAT, 2420)
+        self.assertEqual(invoice.owedAmount, 2420)
+
+    def test_creditNote_clearsOwedAmount(self):
+        create_credit_note(Invoice.objects.get(id=0))
+        invoice = Invoice.objects.get(id=0)
+        self.assertEqual((invoice.state, invoice.owedAmount), (3, 0))
+        creditNote = Invoice.objects.get(state=4)
+        self.assertEqual(creditNote.totalBeforeVAT, -2100)
+
+
+class MonthlySummaryTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID, facturationDate in enumerate([
+            date(2024, 1, 15),
+            date(2024, 2, 10),
+            date(2024, 3, 20),
+        ]):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=2,
+                facturationDate=facturationDate,
+                dueDate=facturationDate,
+            )
+            Project.objects.create(
+                id=invoiceID,
+                invoice_id=invoiceID,
+                title='Project',
+            )
+            Fee.objects.create(
+                project_id=invoiceID,
+                rateUnit=1000,
+                count=1,
+                vat=10,
+            )
+
+    def get_summary(self, month):
+        return MonthlySummary.objects.get(invoicer_id=0, month=month)
+
+    def test_summary_followsFees(self):
+        summary = self.get_summary(date(2024, 1, 1))
+        self.assertEqual(summary.invoiceCount, 1)
+        self.assertEqual(summary.openInvoiceCount, 1)
+        self.assertEqual(summary.afterVATAmount, 1100)
+        self.assertEqual(summary.openOwedAmount, 1100)
+        Fee.objects.create(project_id=0, rateUnit=100, count=1, vat=0)
+        summary = self.get_summary(date(2024, 1, 1))
+        self.assertEqual(summary.afterVATAmount, 1200)
+
+    def test_summary_followsPayments(self):
+        payment = Payment.objects.create(
+            payor_id=0,
+            paymentDay=date(2024, 2, 1),
+            paidAmount=1100,
+        )
+        payment.invoice.add(Invoice.objects.get(id=0))
+        summary = self.get_summary(date(2024, 1, 1))
+        self.assertEqual(summary.paidInvoiceCount, 1)
+        self.assertEqual(summary.openInvoiceCount, 0)
+        self.assertEqual(summary.paidAmount, 1100)
+        payment.delete()
+        summary = self.get_summary(date(2024, 1, 1))
+        self.assertEqual(summary.paidInvoiceCount, 0)
+        self.assertEqual(summary.paidAmount, 0)
+
+    def test_summary_followsFacturationDate(self):
+        invoice = Invoice.objects.get(id=0)
+        invoice.facturationDate = date(2024, 2, 20)
+        invoice.dueDate = date(2024, 2, 20)
+        invoice.save()
+        self.assertEqual(self.get_summary(date(2024, 1, 1)).invoiceCount, 0)
+        self.assertEqual(self.get_summary(date(2024, 2, 1)).invoiceCount, 2)
+        invoice.delete()
+        self.assertEqual(self.get_summary(date(2024, 2, 1)).invoiceCount, 1)
+
+    def test_rebuild_matchesSummaries(self):
+        fields = ['month', 'invoiceCount', 'afterVATAmount', 'openOwedAmount']
+        summaries = list(
+            MonthlySummary.objects.order_by('month').values(*fields)
+        )
+        self.assertEqual(MonthlySummary.rebuild(), 3)
+        self.assertEqual(
+            list(MonthlySummary.objects.order_by('month').values(*fields)),
+            summaries,
+        )
+
+    def test_dashboard_combinesSummariesAndInvoices(self):
+        MonthlySummary.objects.filter(month=date(2024, 2, 1)).update(
+            afterVATAmount=1,
+        )
+        figures = get_currency_figures(date(2024, 1, 20), date(2024, 3, 25))
+        self.assertEqual(figures['MAD'].invoiceCount, 2)
+        self.assertEqual(figures['MAD'].afterVATAmount, 1101)
+        figures = get_currency_figures(date(2024, 1, 1), date(2024, 1, 31))
+        self.assertEqual(figures['MAD'].invoiceCount, 1)
+
+
+class InvoiceOverdueTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        today = date.today()
+        for invoiceID, state, dueDate, paidAmount in [
+            (0, 0, today - timedelta(days=30), 0),
+            (1, 2, today - timedelta(days=30), 0),
+            (2, 2, today, 0),
+            (3, 2, today + timedelta(days=1), 0),
+            (4, 2, today - timedelta(days=30), 100),
+        ]:
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=state,
+                facturationDate=today - timedelta(days=60),
+                dueDate=dueDate,
+            )
+            Invoice.objects.filter(id=invoiceID).update(
+                owedAmount=100,
+                paidAmount=paidAmount,
+            )
+
+    def test_overdue_isComputedAtQueryTime(self):
+        self.assertEqual(
+            set(Invoice.objects.outstanding().values_list('id', flat=True)),
+            {1, 2, 3},
+        )
+        self.assertEqual(
+            set(Invoice.objects.overdue().values_list('id', flat=True)),
+            {1, 2},
+        )
+        self.assertEqual(
+            set(Invoice.objects.overdue(
+                date.today() + timedelta(days=1)
+            ).values_list('id', flat=True)),
+            {1, 2, 3},
+        )
+        self.assertEqual(
+            [invoice.isOverdue for invoice in Invoice.objects.order_by('id')],
+            [False, True, True, False, False],
+        )
+
+
+class InvoiceFlagsTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID in range(4):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                facturationDate=date.today(),
+            )
+        Project.objects.create(id=0, invoice_id=1, title='Empty')
+        Project.objects.create(id=1, invoice_id=2, title='Full')
+        Project.objects.create(id=2, invoice_id=3, title='Full')
+        Project.objects.create(id=3, invoice_id=3, title='Empty')
+        Fee.objects.create(project_id=1, rateUnit=100, count=1, vat=20)
+        Fee.objects.create(project_id=2, rateUnit=100, count=1, vat=20)
+
+    def test_flags_matchPerInvoiceQueries(self):
+        with self.assertNumQueries(1):
+            flags = [
+                (invoice.wellFormed, invoice.downloadable)
+                for invoice in Invoice.objects.with_flags().order_by('id')
+            ]
+        self.assertEqual(
+            flags,
+            [(False, False), (False, False), (True, True), (False, False)],
+        )
+        for invoice in Invoice.objects.order_by('id'):
+            with self.assertNumQueries(1):
+                self.assertEqual(invoice.wellFormed, flags[invoice.id][0])
+
+    def test_flags_queryCountDoesNotGrow(self):
+        for invoiceID in range(4, 40):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                facturationDate=date.today(),
+            )
+        with self.assertNumQueries(1):
+            for invoice in Invoice.objects.select_related(
+                'invoicer',
+                'invoicee',
+            ).with_flags():
+                invoice.wellFormed
+                invoice.downloadable
+                invoice.totalAfterVAT
+
+
+class DashboardTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(
+            id=0,
+            name='TestInvoicee',
+            invoicer_id=0,
+            country='MAR',
+        )
+        self.invoiceCount = 0
+        self.add_invoices(date(2024, 1, 20), date(2024, 2, 10))
+
+    def add_invoices(self, *facturationDates):
+        for facturationDate in facturationDates:
+            invoice = Invoice.objects.create(
+                id=self.invoiceCount,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=2,
+                facturationDate=facturationDate,
+                dueDate=facturationDate,
+            )
+            project = Project.objects.create(invoice=invoice, title='Project')
+            Fee.objects.create(project=project, rateUnit=1000, count=1, vat=20)
+            self.invoiceCount += 1
+
+    def test_dashboard_figures(self):
+        dashboard = get_dashboard(date(2024, 1, 10), date(2024, 3, 31))
+        figures = dashboard.currencies['MAD']
+        self.assertEqual(figures.invoiceCount, 2)
+        self.assertEqual(figures.paidInvoiceCount, 0)
+        self.assertEqual(figures.beforeVATAmount, 2000)
+        self.assertEqual(figures.vatAmount, 400)
+        self.assertEqual(figures.afterVATAmount, 2400)
+        self.assertEqual(
+            [
+                (invoicee.name, invoicee.owedAmount, invoicee.paidAmount)
+                for invoicee in dashboard.invoicees
+            ],
+            [('TestInvoicee', 2400, 0)],
+        )
+        self.assertEqual(
+            [(project.title, project.paidAmount) for project in dashboard.projects],
+            [('Project', 0)],
+        )
+
+    def test_dashboard_queryCount_doesNotGrowWithInvoices(self):
+        # Two queries for the currency and invoicee figures each, summaries
+        # and edge days, and one for the projects.
+        with self.assertNumQueries(5):
+            get_dashboard(date(2024, 1, 10), date(2024, 3, 31))
+        self.add_invoices(*[date(2024, 2, day) for day in range(1, 29)])
+        with self.assertNumQueries(5):
+            dashboard = get_dashboard(date(2024, 1, 10), date(2024, 3, 31))
+        self.assertEqual(dashboard.currencies['MAD'].invoiceCount, 30)
+
+    def test_homePage_rendersDashboard(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.get(
+            reverse('home:index'),
+            {'beginDate': '2024-01-01', 'endDate': '2024-12-31'},
+            HTTP_HX_REQUEST='true',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['invoicesInformation']['MAD'][1], 2)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class DashboardCacheTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicer.objects.create(id=1, name='OtherInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        Invoice.objects.create(
+            id=0,
+            invoicer_id=0,
+            invoicee_id=0,
+            state=2,
+            facturationDate=date(2024, 1, 15),
+            dueDate=date(2024, 1, 15),
+        )
+        Project.objects.create(id=0, invoice_id=0, title='Project')
+        # The local memory cache outlives the test transactions, and the
+        # on-commit invalidations never run inside them.
+        cache.clear()
+
+    def get_dashboard(self, invoicerID):
+        return get_cached_dashboard(
+            date(2024, 1, 1),
+            date(2024, 12, 31),
+            Invoicer.objects.get(id=invoicerID),
+        )
+
+    def test_dashboard_isCached(self):
+        self.get_dashboard(0)
+        self.get_dashboard(0)
+        self.assertEqual(
+            get_dashboard_cache_stats(),
+            {'hits': 1, 'misses': 1},
+        )
+
+    def test_changes_invalidateTheirInvoicerOnly(self):
+        self.get_dashboard(0)
+        self.get_dashboard(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Fee.objects.create(project_id=0, rateUnit=1000, count=1, vat=10)
+        dashboard = self.get_dashboard(0)
+        self.get_dashboard(1)
+        self.assertEqual(dashboard.currencies['MAD'].afterVATAmount, 1100)
+        self.assertEqual(
+            get_dashboard_cache_stats(),
+            {'hits': 1, 'misses': 3},
+        )
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentNumberingTestCase(TransactionTestCase):
+
+    numInvoices = 24
+    numCreditNotes = 8
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for _ in range(self.numInvoices + self.numCreditNotes):
+            Invoice.objects.create(
+                invoicer_id=0,
+                invoicee_id=0,
+                state=0,
+                facturationDate=date.today(),
+                dueDate=date.today(),
+            )
+        self.barrier = Barrier(8)
+
+    def validate(self, invoiceID, state):
+        try:
+            invoice = Invoice.objects.get(id=invoiceID)
+            invoice.state = state
+            self.barrier.wait(timeout=10)
+            invoice.save()
+        finally:
+            connection.close()
+
+    def test_concurrent_validation(self):
+        invoiceIDs = list(Invoice.objects.values_list('id', flat=True))
+        states = [2] * self.numInvoices + [4] * self.numCreditNotes
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self.validate, invoiceIDs, states))
+        invoiceNumbers = sorted(
+            Invoice.objects.filter(state=2).values_list('count', flat=True)
+        )
+        creditNoteNumbers = sorted(
+            Invoice.objects.filter(state=4).values_list('count', flat=True)
+        )
+        self.assertEqual(invoiceNumbers, list(range(1, self.numInvoices + 1)))
+        self.assertEqual(
+            creditNoteNumbers,
+            list(range(1, self.numCreditNotes + 1)),
+        )
+
+
+class InvoiceSequenceTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID in range(3):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=0,
+                facturationDate=date.today(),
+                dueDate=date.today(),
+            )
+
+    def test_sequence_continuesExistingNumbers(self):
+        Invoice.objects.filter(id=0).update(state=2, count=7)
+        invoice = Invoice.objects.get(id=1)
+        invoice.state = 2
+        invoice.save()
+        self.assertEqual(invoice.count, 8)
+
+    def test_sequence_retriesWhenRowWasCreatedConcurrently(self):
+        invoicer = Invoicer.objects.get(id=0)
+        blocks = []
+
+        # Another transaction creates the row between the UPDATE that found
+        # none and the savepoint of the create, which then hits the unique
+        # constraint.
+        def concurrent_atomic(*args, **kwargs):
+            blocks.append(None)
+            if len(blocks) == 2:
+                InvoiceSequence.objects.create(
+                    invoicer=invoicer,
+                    year=2024,
+                    documentType=DocumentTypes.INVOICE,
+                    value=5,
+                )
+            return atomic(*args, **kwargs)
+
+        with patch('Invoice.models.atomic', concurrent_atomic):
+            value = InvoiceSequence.next_value(
+                invoicer,
+                2024,
+                DocumentTypes.INVOICE,
+            )
+        self.assertEqual(value, 6)
+        self.assertEqual(
+            InvoiceSequence.next_value(invoicer, 2024, DocumentTypes.INVOICE),
+            7,
+        )
+
+    def test_validateAction_refusesDraftsWithoutDates(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        Invoice.objects.filter(id=2).update(facturationDate=None)
+        url = reverse('admin:Invoice_invoice_changelist')
+        data = {'action': 'validate_invoices', '_selected_action': [1, 2]}
+        response = self.client.post(url, data, follow=True)
+        self.assertContains(response, 'InvoicesWithInvalidDatesCannotBeValidated')
+        self.assertFalse(Invoice.objects.filter(state=2).exists())
+        self.client.post(url, {**data, '_selected_action': [0, 1]})
+        self.assertEqual(
+            list(Invoice.objects.order_by('id').values_list('state', 'count')),
+            [(2, 1), (2, 2), (0, None)],
+        )
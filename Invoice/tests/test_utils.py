@@ -1,21 +1,93 @@
-from datetime import date
+from csv import DictReader, DictWriter
+from datetime import date, datetime, timedelta, timezone as tz
+from io import BytesIO, StringIO
+from decimal import Decimal
+from types import SimpleNamespace
+from os import listdir, makedirs, remove, utime
+from os.path import exists, join
+from random import Random
+from unittest import skipUnless
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from concurrent.futures import Future, ThreadPoolExecutor
+from zipfile import ZipFile
+from time import time
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import connection
+from django.core.management import call_command
+from django.test import (
+    TestCase,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
 from Invoice.models import (
     Invoice,
     Project,
     Fee,
+    Payment,
+    RenderJob,
 )
 from Invoicee.models import Invoicee
-from Invoicer.models import Invoicer
+from Invoicer.models import Invoicer, LegalInformation
+from Invoicer.utils import (
+    get_invoicer,
+    get_invoicer_choices,
+    has_multiple_invoicers,
+)
 from Invoice.utils import (
     parse_fee,
     parse_project,
     parse_activities,
+    divide_half_even,
+    get_invoice_page,
+    export_invoice_data,
+    export_invoices_data,
+    stream_invoices_export,
+    stream_invoices_archive,
+    get_invoice_file_name,
+    clean_scratch_files,
+    compile_texFile,
+    PDF_RENDERERS,
+    LatexRenderer,
+    PDFRenderer,
+)
+from Invoice.templating import TexTemplate
+from Invoice.allocation import distribute, split_payment
+from Invoice.explain import (
+    FULL_SCAN_PATTERNS,
+    explain_queryset,
+    get_view_querysets,
+)
+from Invoice.cache import evict_cached_files, store_file
+from Invoice.preamble import failedFormats, rebuild_preamble_format
+from Invoice.pdf import PDFDocument, PDFFlow, text_width, wrap_text
+from InvoiceGenerator.settings import EXPORT_DATA_HEADER
+from Invoice.management.commands.export_bookkeeping import (
+    Command as ExportBookkeepingCommand,
+)
+from Invoice.jobs import (
+    enqueue_invoice_render,
+    claim_render_jobs,
+    run_render_job,
+    requeue_stale_render_jobs,
+    prune_render_jobs,
+)
+from Core.models import (
+    AllocationStrategies,
+    PDFBackends,
+    RenderJobStates,
+    SystemCurrency,
 )
 from Core.exceptions import (
+    InvoicingError,
     LateXError,
+    TemplateError,
 )
 
 
@@ -108,6 +180,427 @@ TestFeeDescription& 10\\%& 2
         self.assertEqual(rawTEXActivitiesParsed, rawTEXActivities)
 
 
+class InvoiceExportTestCase(TestCase):
+
+    headers = [
+        'Date',
+        'Account',
+        'Name',
+        'Label',
+        'Piece',
+        'Debit',
+        'Credit',
+        'FacturationDate',
+    ]
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID in range(3):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=2,
+                facturationDate=date(2024, 1, 15),
+                dueDate=date(2024, 2, 15),
+            )
+            Project.objects.create(
+                id=invoiceID,
+                invoice_id=invoiceID,
+                title='Project',
+            )
+            Fee.objects.create(
+                project_id=invoiceID,
+                rateUnit=1000,
+                count=invoiceID + 1,
+                vat=20,
+                bookKeepingAmount=1000 * (invoiceID + 1),
+            )
+
+    def test_stream_matchesExportData(self):
+        expected = StringIO()
+        dictWriter = DictWriter(expected, self.headers)
+        dictWriter.writeheader()
+        for invoice in Invoice.objects.select_related(
+            'invoicer',
+            'invoicee',
+        ).order_by('id'):
+            dictWriter.writerows(export_invoice_data(invoice, self.headers))
+        chunks = list(stream_invoices_export(
+            Invoice.objects.order_by('id'),
+            self.headers,
+            chunkSize=2,
+        ))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(
+            b''.join(chunks).decode('utf-8'),
+            expected.getvalue(),
+        )
+
+
+class BatchExportTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+
+    def create_invoices(self, random):
+        invoiceIDs = []
+        for _ in range(random.randint(1, 6)):
+            invoice = Invoice.objects.create(
+                invoicer_id=0,
+                invoicee_id=0,
+                state=random.choice([2, 4]),
+                baseCurrency=random.choice(SystemCurrency.values),
+                facturationDate=date(2024, 1, 15),
+                dueDate=date(2024, 2, 15),
+            )
+            invoiceIDs.append(invoice.id)
+            for _ in range(random.randint(0, 2)):
+                project = Project.objects.create(
+                    invoice=invoice,
+                    title='Project',
+                )
+                for _ in range(random.randint(0, 4)):
+                    Fee.objects.create(
+                        project=project,
+                        rateUnit=Decimal(random.randint(0, 10 ** 5)) / 100,
+                        count=random.randint(0, 20),
+                        vat=random.randint(0, 100),
+                        bookKeepingAmount=Decimal(
+                            random.randint(-10 ** 5, 10 ** 5)
+                        ) / 100,
+                    )
+        return invoiceIDs
+
+    def test_divide_half_even(self):
+        self.assertEqual(divide_half_even(249, 100), 2)
+        self.assertEqual(divide_half_even(250, 100), 2)
+        self.assertEqual(divide_half_even(350, 100), 4)
+        self.assertEqual(divide_half_even(-250, 100), -2)
+        self.assertEqual(divide_half_even(-251, 100), -3)
+
+    def test_batch_matchesPerInvoiceExport(self):
+        headers = InvoiceExportTestCase.headers
+        for seed in range(10):
+            with self.subTest(seed=seed):
+                invoices = list(Invoice.objects.filter(
+                    id__in=self.create_invoices(Random(seed)),
+                ).select_related('invoicer', 'invoicee').order_by('id'))
+                self.assertEqual(
+                    list(export_invoices_data(invoices, headers)),
+                    [
+                        export_invoice_data(invoice, headers)
+                        for invoice in invoices
+                    ],
+                )
+
+
+class InvoiceArchiveTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID in range(3):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                state=1,
+                facturationDate=date(2024, 1, 15),
+            )
+        self.pdfFile = NamedTemporaryFile(suffix='.pdf')
+        self.pdfFile.write(b'%PDF-1.4 test')
+        self.pdfFile.flush()
+        self.addCleanup(self.pdfFile.close)
+
+    def test_failures_areReportedPerInvoice(self):
+        invoices = list(Invoice.objects.order_by('id'))
+
+        def submit_invoice_pdf(executor, invoice):
+            if invoice.id == 1:
+                raise TemplateError('Unknown placeholder')
+            future = Future()
+            # The cached PDF of the last invoice was evicted meanwhile.
+            future.set_result(
+                self.pdfFile.name if invoice.id == 0 else '/nonexistent.pdf'
+            )
+            return future
+
+        with patch('Invoice.utils.submit_invoice_pdf', submit_invoice_pdf):
+            archive = ZipFile(BytesIO(b''.join(
+                stream_invoices_archive(invoices, 1),
+            )))
+        self.assertEqual(
+            archive.namelist(),
+            [get_invoice_file_name(invoices[0]), 'errors.txt'],
+        )
+        self.assertEqual(
+            archive.read(archive.namelist()[0]),
+            b'%PDF-1.4 test',
+        )
+        errors = archive.read('errors.txt').decode().splitlines()
+        self.assertEqual(errors[0], f'{invoices[1]}: Unknown placeholder')
+        self.assertTrue(errors[1].startswith(f'{invoices[2]}: '))
+        self.assertIn('/nonexistent.pdf', errors[1])
+
+
+class InvoicePageTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        for invoiceID, day in enumerate([1, 2, 2, 2, 3]):
+            Invoice.objects.create(
+                id=invoiceID,
+                invoicer_id=0,
+                invoicee_id=0,
+                facturationDate=date(2024, 1, day),
+                dueDate=date(2024, 1, day),
+            )
+
+    def test_pages_followFacturationOrder(self):
+        invoiceIDs = []
+        cursor = None
+        for _ in range(3):
+            invoices, cursor = get_invoice_page(
+                Invoice.objects.all(),
+                cursor,
+                pageSize=2,
+            )
+            invoiceIDs.extend(invoice.id for invoice in invoices)
+        self.assertEqual(invoiceIDs, [4, 3, 2, 1, 0])
+        self.assertIsNone(cursor)
+
+    def test_invalidCursor(self):
+        with self.assertRaises(InvoicingError):
+            get_invoice_page(Invoice.objects.all(), 'yesterday_1')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class InvoicerResolutionTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='manager')
+        Invoicer.objects.create(id=0, name='TestInvoicer', manager=self.user)
+
+    def get_invoicer(self):
+        return get_invoicer(SimpleNamespace(user=self.user))
+
+    def test_invoicer_isCachedAcrossRequests(self):
+        with self.assertNumQueries(1):
+            request = SimpleNamespace(user=self.user)
+            self.assertEqual(get_invoicer(request).id, 0)
+            self.assertEqual(get_invoicer(request).id, 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_invoicer().id, 0)
+
+    def test_invoicerChanges_areNotCached(self):
+        self.get_invoicer()
+        invoicer = Invoicer.objects.get(id=0)
+        invoicer.name = 'RenamedInvoicer'
+        invoicer.save()
+        self.assertEqual(self.get_invoicer().name, 'RenamedInvoicer')
+
+    def test_multipleInvoicers_isCachedAcrossRequests(self):
+        with self.assertNumQueries(1):
+            request = SimpleNamespace(user=self.user)
+            self.assertFalse(has_multiple_invoicers(request))
+            self.assertFalse(has_multiple_invoicers(request))
+        with self.assertNumQueries(0):
+            self.assertFalse(
+                has_multiple_invoicers(SimpleNamespace(user=self.user)),
+            )
+
+    def test_reassignedInvoicer_isForgottenForPreviousManager(self):
+        self.get_invoicer()
+        get_invoicer_choices(self.user)
+        invoicer = Invoicer.objects.get(id=0)
+        invoicer.manager = User.objects.create(username='newManager')
+        invoicer.save()
+        with self.assertRaises(Invoicer.DoesNotExist):
+            self.get_invoicer()
+        self.assertEqual(get_invoicer_choices(self.user), [])
+
+
+class InvoiceAdminChangelistTestCase(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        self.invoiceCount = 0
+
+    def add_invoices(self, count):
+        for _ in range(count):
+            invoice = Invoice.objects.create(
+                id=self.invoiceCount,
+                invoicer_id=0,
+                invoicee_id=0,
+                facturationDate=date.today(),
+            )
+            for title in ['First', 'Second']:
+                project = Project.objects.create(invoice=invoice, title=title)
+                Fee.objects.create(
+                    project=project,
+                    rateUnit=100,
+                    count=1,
+                    vat=20,
+                    description=f'{title}Fee',
+                )
+            self.invoiceCount += 1
+
+    def get_changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:Invoice_invoice_changelist')
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_queryCount_doesNotGrowWithRows(self):
+        self.add_invoices(2)
+        self.get_changelist_queries()
+        _, queryCount = self.get_changelist_queries()
+        self.add_invoices(20)
+        response, largerQueryCount = self.get_changelist_queries()
+        self.assertEqual(queryCount, largerQueryCount)
+        fee = Fee.objects.filter(description='SecondFee').last()
+        self.assertContains(
+            response,
+            reverse('admin:Invoice_fee_change', args=(fee.id,)),
+        )
+        self.assertContains(
+            response,
+            reverse('admin:Invoice_project_change', args=(fee.project_id,)),
+        )
+
+
+class AdminFilterTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin')
+        self.client.force_login(self.user)
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        for invoiceeID in range(2):
+            Invoicee.objects.create(
+                id=invoiceeID,
+                name=f'TestInvoicee{invoiceeID}',
+                invoicer_id=0,
+                ice=f'{invoiceeID + 1:015}',
+            )
+            invoice = Invoice.objects.create(
+                id=invoiceeID,
+                invoicer_id=0,
+                invoicee_id=invoiceeID,
+                facturationDate=date.today(),
+            )
+            project = Project.objects.create(invoice=invoice, title='Test')
+            Fee.objects.create(
+                project=project,
+                description=f'FeeOfInvoicee{invoiceeID}',
+            )
+
+    def test_invoicerChoices_areCached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                get_invoicer_choices(self.user),
+                [(0, 'TestInvoicer')],
+            )
+            get_invoicer_choices(self.user)
+        Invoicer.objects.create(id=1, name='OtherInvoicer')
+        self.assertEqual(
+            get_invoicer_choices(self.user),
+            [(1, 'OtherInvoicer'), (0, 'TestInvoicer')],
+        )
+
+    def test_invoiceeFilter_doesNotListInvoicees(self):
+        url = reverse('admin:Invoice_fee_changelist')
+        # The first render fills the cached invoicer choices.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        for invoiceeID in range(2, 40):
+            Invoicee.objects.create(
+                id=invoiceeID,
+                name=f'TestInvoicee{invoiceeID}',
+                invoicer_id=0,
+                ice=f'{invoiceeID + 1:015}',
+            )
+        with CaptureQueriesContext(connection) as largerQueries:
+            self.client.get(url)
+        self.assertEqual(len(queries), len(largerQueries))
+        response = self.client.get(url, {'InvoiceeIS': 1})
+        self.assertContains(response, 'FeeOfInvoicee1')
+        self.assertNotContains(response, 'FeeOfInvoicee0')
+
+
+@skipUnless(
+    connection.vendor in FULL_SCAN_PATTERNS,
+    'Full scans are only detected on SQLite and PostgreSQL.',
+)
+class ViewQueryPlanTestCase(TestCase):
+
+    indexes = {
+        'InvoiceList': 'invoice_invoicer_state_date',
+        'Dashboard': 'invoice_invoicer_state_date',
+        'InvoiceeInvoices': 'invoice_invoicee_date',
+        'Overdue': 'invoice_status_due',
+        'PaymentList': 'payment_payor_day',
+    }
+
+    def setUp(self):
+        random = Random(24)
+        for invoicerID in range(3):
+            Invoicer.objects.create(id=invoicerID, name=f'Invoicer{invoicerID}')
+            for invoiceeID in range(invoicerID * 5, invoicerID * 5 + 5):
+                Invoicee.objects.create(
+                    id=invoiceeID,
+                    name=f'Invoicee{invoiceeID}',
+                    invoicer_id=invoicerID,
+                    ice=f'{invoiceeID + 1:015}',
+                )
+        Invoice.objects.bulk_create(
+            Invoice(
+                id=invoiceID,
+                invoicer_id=invoiceID % 3,
+                invoicee_id=invoiceID % 3 * 5 + random.randrange(5),
+                state=random.choice([0, 2, 3, 4]),
+                facturationDate=date(2024, 1, 1) + timedelta(
+                    days=random.randrange(730)
+                ),
+            )
+            for invoiceID in range(300)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                payor_id=random.randrange(15),
+                paidAmount=100,
+                paymentDay=date(2024, 1, 1) + timedelta(
+                    days=random.randrange(730)
+                ),
+            )
+            for _ in range(100)
+        )
+
+    def test_viewQuerysets_useIndexes(self):
+        for name, queryset in get_view_querysets(
+            Invoicer.objects.get(id=1),
+            Invoicee.objects.get(id=5),
+            date(2025, 1, 1),
+            date(2025, 12, 31),
+        ).items():
+            plan, fullScans = explain_queryset(queryset)
+            self.assertEqual(fullScans, [], f'{name}:\n{plan}')
+            # The foreign key indexes alone already avoid most full scans,
+            # so SQLite plans are also checked for the composite indexes.
+            if connection.vendor == 'sqlite' and name in self.indexes:
+                self.assertIn(self.indexes[name], plan, name)
+
+
 class InvoiceValidationNoFeeParserTestCase(TestCase):
 
     def setUp(self):
@@ -147,3 +640,599 @@ class InvoiceValidationNoProjectParserTestCase(TestCase):
     def test(self):
         with self.assertRaises(LateXError):
             parse_activities(Invoice.objects.get(id=0))
+
+
+class TexTemplateTestCase(SimpleTestCase):
+
+    def setUp(self):
+        with NamedTemporaryFile(
+            'w', suffix='.tex', delete=False, encoding='utf-8'
+        ) as texFile:
+            texFile.write('\\textbf{%NAME%}\\\\%NAME%-%IF%\\%')
+        self.template = TexTemplate(texFile.name)
+
+    def tearDown(self):
+        remove(self.template.path)
+
+    def test_render(self):
+        self.assertEqual(
+            self.template.render({'%NAME%': 'A', '%IF%': '%NAME%'}),
+            '\\textbf{A}\\\\A-%NAME%\\%',
+        )
+
+    def test_missing_key(self):
+        with self.assertRaises(TemplateError):
+            self.template.render({'%NAME%': 'A'})
+
+    def test_unknown_key(self):
+        with self.assertRaises(TemplateError):
+            self.template.render({'%NAME%': 'A', '%IF%': '', '%RC%': ''})
+
+
+class PDFDocumentTestCase(SimpleTestCase):
+
+    def test_xref_offsets(self):
+        document = PDFDocument()
+        flow = PDFFlow(document, 800, 100)
+        for line in range(100):
+            page = flow.reserve(12)
+            flow.y -= 12
+            page.text(50, flow.y, f'Désignation (ligne {line})', 9)
+        pdf = document.render()
+        self.assertEqual(len(document.pages), 2)
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        entries = pdf[xref:].split(b'\n')
+        count = int(entries[1].split()[1])
+        for number, entry in enumerate(entries[3:count + 2], start=1):
+            offset = int(entry[:10])
+            self.assertTrue(pdf[offset:].startswith(b'%d 0 obj' % number))
+
+    def test_wrap_text(self):
+        lines = wrap_text('Forfait maintenance ' * 10, 100, 9)
+        self.assertGreater(len(lines), 1)
+        for line in lines:
+            self.assertLessEqual(text_width(line, 9), 100)
+
+
+class PythonRendererTestCase(TestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        LegalInformation.objects.create(invoicer_id=0)
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        self.invoice = Invoice.objects.create(
+            id=0,
+            invoicer_id=0,
+            invoicee_id=0,
+            state=1,
+            baseCurrency='EURO',
+            facturationDate=date.today(),
+        )
+        Project.objects.create(id=0, invoice_id=0, title='Développement')
+        Fee.objects.create(
+            id=0,
+            project_id=0,
+            rateUnit=1000,
+            count=2,
+            vat=20,
+            description='Forfait',
+        )
+        self.renderer = PDF_RENDERERS[PDFBackends.PYTHON]
+
+    def test_rendererIsAbstract(self):
+        with self.assertRaises(TypeError):
+            PDFRenderer()
+
+    def test_cp1252TextIsDrawn(self):
+        with TemporaryDirectory() as directory, patch.object(
+            LatexRenderer,
+            'render_invoice',
+        ) as render_invoice:
+            fileName = self.renderer.render_invoice(
+                self.invoice,
+                {},
+                directory,
+            )
+            with open(join(directory, fileName), 'rb') as pdfFile:
+                self.assertTrue(pdfFile.read().startswith(b'%PDF'))
+        render_invoice.assert_not_called()
+
+    def test_otherTextFallsBackToLatex(self):
+        Invoicee.objects.filter(id=0).update(name='شركة الاختبار')
+        invoice = Invoice.objects.get(id=0)
+        with patch.object(
+            LatexRenderer,
+            'render_invoice',
+            return_value='latex.pdf',
+        ) as render_invoice:
+            fileName = self.renderer.render_invoice(invoice, {}, '/tmp')
+        self.assertEqual(fileName, 'latex.pdf')
+        render_invoice.assert_called_once_with(invoice, {}, '/tmp')
+
+
+class PDFCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = patch(
+            'Invoice.cache.get_cache_directory',
+            return_value=self.directory,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_entry(self, name, age):
+        path = join(self.directory, f'{name}.pdf')
+        with open(path, 'wb') as pdfFile:
+            pdfFile.write(b'%PDF-1.4 test')
+        mtime = time() - age
+        utime(path, (mtime, mtime))
+        return path
+
+    def test_eviction_sparesRecentlyUsedEntries(self):
+        paths = [
+            self.create_entry('expired', 40 * 24 * 3600),
+            self.create_entry('old', 2 * 3600),
+            self.create_entry('recent', 60),
+        ]
+        evict_cached_files(maxSize=0)
+        self.assertEqual(
+            [exists(path) for path in paths],
+            [False, False, True],
+        )
+
+    def test_store_evictsPeriodically(self):
+        with patch('Invoice.cache.evict_cached_files') as evict, patch(
+            'Invoice.cache.lastEviction',
+            0,
+        ):
+            for name in ['first', 'second']:
+                source = self.create_entry(f'{name}-source', 0)
+                self.assertEqual(
+                    store_file(name, source),
+                    join(self.directory, f'{name}.pdf'),
+                )
+        self.assertEqual(evict.call_count, 1)
+
+
+class ScratchCleanupTestCase(SimpleTestCase):
+
+    def test_onlyScratchDirectoriesAreRemoved(self):
+        # The template directory is a deployment setting, so the test runs
+        # against an absolute one of its own.
+        with TemporaryDirectory() as root, patch(
+            'Invoice.utils.TEMPTEXFILESDIR',
+            root,
+        ):
+            paths = [
+                join(root, name)
+                for name in ('render-old', 'format-old', 'logos', 'logo.pdf')
+            ]
+            for path in paths[:3]:
+                makedirs(path)
+            open(paths[3], 'w').close()
+            for path in paths:
+                utime(path, (0, 0))
+            makedirs(join(root, 'render-recent'))
+            self.assertEqual(clean_scratch_files(3600), 2)
+            self.assertEqual(
+                [exists(path) for path in paths],
+                [False, False, True, True],
+            )
+            self.assertTrue(exists(join(root, 'render-recent')))
+
+
+class PreambleFormatFallbackTestCase(SimpleTestCase):
+
+    def compile(self, root, formatWorks):
+        directory = join(root, 'render-test')
+        makedirs(directory)
+        texFilePath = join(directory, 'invoice.tex')
+        open(texFilePath, 'w').close()
+        commands = []
+
+        def run(command, **kwargs):
+            commands.append(command)
+            if formatWorks or not any(
+                argument.startswith('-fmt=') for argument in command
+            ):
+                open(join(directory, 'invoice.pdf'), 'w').close()
+            return SimpleNamespace(stdout=b'')
+
+        with patch('Invoice.utils.TEMPTEXFILESDIR', root), patch(
+            'Invoice.utils.run',
+            run,
+        ), patch('Invoice.utils.rebuild_preamble_format') as rebuild:
+            pdfFilePath = compile_texFile(
+                texFilePath,
+                directory,
+                'invoice-0123456789abcdef',
+                'invoice.tex',
+            )
+        self.assertEqual(pdfFilePath, join(directory, 'invoice.pdf'))
+        return commands, rebuild
+
+    def test_workingFormat_compilesOnce(self):
+        with TemporaryDirectory() as root:
+            commands, rebuild = self.compile(root, True)
+        self.assertEqual(len(commands), 1)
+        self.assertIn('-fmt=invoice-0123456789abcdef', commands[0])
+        rebuild.assert_not_called()
+
+    def test_staleFormat_fallsBackAndRebuilds(self):
+        with TemporaryDirectory() as root:
+            commands, rebuild = self.compile(root, False)
+        self.assertEqual(len(commands), 2)
+        self.assertFalse(any(arg.startswith('-fmt=') for arg in commands[1]))
+        rebuild.assert_called_once_with(
+            'invoice.tex',
+            'invoice-0123456789abcdef',
+        )
+
+    def test_rebuild_givesUpAfterSecondFailure(self):
+        formatName = 'receipt-fallbacktest'
+        self.addCleanup(failedFormats.discard, formatName)
+        with patch(
+            'Invoice.preamble.build_preamble_format',
+            return_value=True,
+        ) as build:
+            self.assertEqual(
+                rebuild_preamble_format('receipt.tex', formatName),
+                formatName,
+            )
+            self.assertIsNone(
+                rebuild_preamble_format('receipt.tex', formatName),
+            )
+        self.assertEqual(build.call_count, 1)
+        self.assertIn(formatName, failedFormats)
+
+
+class PaymentAllocationTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.invoices = [
+            SimpleNamespace(
+                id=i,
+                dueDate=date(2024, 1, 3 - i),
+                owedAmount=Decimal(owed),
+                paidAmount=Decimal(0),
+            )
+            for i, owed in enumerate(['100.00', '50.00', '50.00'])
+        ]
+
+    def test_distribute_keepsEveryCent(self):
+        shares = distribute(Decimal('100.00'), [Decimal(1)] * 3)
+        self.assertEqual(sum(shares), Decimal('100.00'))
+        self.assertEqual(sorted(shares)[-1] - sorted(shares)[0], Decimal('0.01'))
+
+    def test_equal(self):
+        allocation = split_payment(
+            Decimal('90.00'),
+            self.invoices,
+            AllocationStrategies.EQUAL,
+        )
+        self.assertEqual(list(allocation.values()), [Decimal('30.00')] * 3)
+
+    def test_proportional(self):
+        allocation = split_payment(
+            Decimal('100.00'),
+            self.invoices,
+            AllocationStrategies.PROPORTIONAL,
+        )
+        self.assertEqual(
+            allocation,
+            {0: Decimal('50.00'), 1: Decimal('25.00'), 2: Decimal('25.00')},
+        )
+
+    def test_oldestFirst(self):
+        allocation = split_payment(
+            Decimal('120.00'),
+            self.invoices,
+            AllocationStrategies.OLDESTFIRST,
+        )
+        self.assertEqual(
+            allocation,
+            {2: Decimal('50.00'), 1: Decimal('50.00'), 0: Decimal('20.00')},
+        )
+
+    def test_oldestFirst_paysInvoicesWithoutDueDateLast(self):
+        self.invoices[2].dueDate = None
+        allocation = split_payment(
+            Decimal('120.00'),
+            self.invoices,
+            AllocationStrategies.OLDESTFIRST,
+        )
+        self.assertEqual(
+            list(allocation.items()),
+            [(1, Decimal('50.00')), (0, Decimal('70.00')), (2, Decimal(0))],
+        )
+
+
+class RenderJobTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('manager')
+        self.otherUser = User.objects.create_user('other')
+        Invoicer.objects.create(id=0, name='TestInvoicer', manager=self.user)
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        self.invoice = Invoice.objects.create(
+            id=0,
+            invoicer_id=0,
+            invoicee_id=0,
+            state=1,
+            facturationDate=date.today(),
+        )
+        self.pdfFile = NamedTemporaryFile(suffix='.pdf')
+        self.pdfFile.write(b'%PDF-1.4 test')
+        self.pdfFile.flush()
+        # The worker closes its connections around each job, which would
+        # end the test transaction.
+        patcher = patch('Invoice.jobs.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.pdfFile.close)
+
+    def render(self, **kwargs):
+        kwargs.setdefault('return_value', (self.pdfFile.name, 'Invoice.pdf'))
+        with patch('Invoice.jobs.get_invoice_pdf', **kwargs):
+            job = enqueue_invoice_render(self.invoice, self.user)
+            claim_render_jobs(1)
+            run_render_job(job.id)
+        return RenderJob.objects.get(id=job.id)
+
+    def test_claim_takesEachJobOnce(self):
+        jobs = [
+            enqueue_invoice_render(self.invoice, self.user).id
+            for _ in range(4)
+        ]
+        otherClaims = []
+        now = timezone.now
+
+        # A second worker claims the queue between the first worker's read
+        # of the pending jobs and its first update.
+        def interleave():
+            if not otherClaims:
+                otherClaims.append(None)
+                otherClaims.extend(claim_render_jobs(3))
+            return now()
+
+        with patch('Invoice.jobs.timezone.now', side_effect=interleave):
+            claims = claim_render_jobs(3)
+        self.assertEqual(otherClaims[1:], jobs[:3])
+        self.assertEqual(claims, [])
+        self.assertEqual(claim_render_jobs(3), jobs[3:])
+        self.assertEqual(claim_render_jobs(3), [])
+
+    def test_stateTransitions(self):
+        job = enqueue_invoice_render(self.invoice, self.user)
+        self.assertEqual(job.state, RenderJobStates.PENDING)
+        self.assertEqual(claim_render_jobs(5), [job.id])
+        job.refresh_from_db()
+        self.assertEqual(job.state, RenderJobStates.RUNNING)
+        self.assertIsNotNone(job.startedAt)
+        self.assertEqual(requeue_stale_render_jobs(timedelta(minutes=5)), 0)
+        RenderJob.objects.filter(id=job.id).update(
+            startedAt=timezone.now() - timedelta(minutes=10),
+        )
+        self.assertEqual(requeue_stale_render_jobs(timedelta(minutes=5)), 1)
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.state, job.startedAt),
+            (RenderJobStates.PENDING, None),
+        )
+        RenderJob.objects.filter(id=job.id).delete()
+        job = self.render()
+        self.assertEqual(job.state, RenderJobStates.DONE)
+        self.assertEqual(
+            (job.fileName, bytes(job.pdf)),
+            ('Invoice.pdf', b'%PDF-1.4 test'),
+        )
+        self.assertIsNotNone(job.finishedAt)
+        self.assertEqual(prune_render_jobs()[0], 0)
+        self.assertEqual(prune_render_jobs(timedelta(0))[0], 1)
+
+    def test_failures(self):
+        job = self.render(side_effect=LateXError('Missing', 'font'))
+        self.assertEqual(
+            (job.state, job.error, job.pdf),
+            (RenderJobStates.FAILED, 'Missing font', None),
+        )
+        job = self.render(side_effect=OSError('disk full'))
+        self.assertEqual(job.state, RenderJobStates.FAILED)
+        self.assertEqual(job.error, repr(OSError('disk full')))
+
+    def test_views(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('Invoice:render-invoice', args=[0]),
+            {'backend': PDFBackends.PYTHON},
+        )
+        job = RenderJob.objects.get()
+        self.assertEqual(
+            (job.requestedBy, job.backend),
+            (self.user, PDFBackends.PYTHON),
+        )
+        statusURL = reverse('Invoice:render-job', args=[job.id])
+        downloadURL = reverse('Invoice:download-render-job', args=[job.id])
+        self.assertContains(response, f'hx-get="{statusURL}"')
+        self.assertEqual(self.client.get(downloadURL).status_code, 404)
+        with patch(
+            'Invoice.jobs.get_invoice_pdf',
+            return_value=(self.pdfFile.name, 'Invoice.pdf'),
+        ):
+            claim_render_jobs(1)
+            run_render_job(job.id)
+        response = self.client.get(statusURL)
+        self.assertContains(response, f'href="{downloadURL}"')
+        self.assertNotContains(response, 'hx-get')
+        response = self.client.get(downloadURL)
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b'%PDF-1.4 test',
+        )
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.client.force_login(self.otherUser)
+        self.assertEqual(self.client.get(statusURL).status_code, 404)
+        self.assertEqual(self.client.get(downloadURL).status_code, 404)
+
+
+class RenderWorkerTestCase(TransactionTestCase):
+
+    def setUp(self):
+        Invoicer.objects.create(id=0, name='TestInvoicer')
+        Invoicee.objects.create(id=0, name='TestInvoicee', invoicer_id=0)
+        invoice = Invoice.objects.create(
+            id=0,
+            invoicer_id=0,
+            invoicee_id=0,
+            state=1,
+            facturationDate=date.today(),
+        )
+        for _ in range(3):
+            enqueue_invoice_render(invoice)
+
+    def test_once_drainsQueue(self):
+        failures = iter([None, LateXError('Missing font'), None])
+
+        def get_invoice_pdf(invoice, backend):
+            failure = next(failures)
+            if failure is not None:
+                raise failure
+            with NamedTemporaryFile(suffix='.pdf', delete=False) as pdfFile:
+                pdfFile.write(b'%PDF-1.4 test')
+            self.addCleanup(remove, pdfFile.name)
+            return pdfFile.name, 'Invoice.pdf'
+
+        # Threads stand in for the forked workers, which would not see the
+        # test database.
+        with patch(
+            'Invoice.management.commands.render_worker.ProcessPoolExecutor',
+            lambda max_workers, mp_context: ThreadPoolExecutor(1),
+        ), patch(
+            'Invoice.management.commands.render_worker.clean_scratch_files',
+        ), patch('Invoice.jobs.get_invoice_pdf', get_invoice_pdf):
+            call_command('render_worker', '--once', '--processes', '1')
+        jobs = RenderJob.objects.order_by('id').values_list('state', 'error')
+        self.assertEqual(
+            list(jobs),
+            [
+                (RenderJobStates.DONE, ''),
+                (RenderJobStates.FAILED, 'Missing font'),
+                (RenderJobStates.DONE, ''),
+            ],
+        )
+
+
+class IncrementalBookkeepingExportTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.startedAt = datetime(2024, 6, 1, 12, tzinfo=tz.utc)
+        for invoicerID in range(2):
+            Invoicer.objects.create(
+                id=invoicerID,
+                name=f'Invoicer{invoicerID}',
+            )
+            Invoicee.objects.create(
+                id=invoicerID,
+                name=f'Invoicee{invoicerID}',
+                invoicer_id=invoicerID,
+                ice=f'{invoicerID + 1:015}',
+            )
+            for state in [0, 2, 2]:
+                Invoice.objects.create(
+                    invoicer_id=invoicerID,
+                    invoicee_id=invoicerID,
+                    state=state,
+                    facturationDate=date(2024, 5, 1),
+                    dueDate=date(2024, 5, 31),
+                )
+        Invoice.objects.update(updatedAt=self.startedAt - timedelta(days=1))
+        self.output = TemporaryDirectory()
+        self.addCleanup(self.output.cleanup)
+
+    def export(self, hours):
+        stdout = StringIO()
+        with patch(
+            'Invoice.management.commands.export_bookkeeping.now',
+            return_value=self.startedAt + timedelta(hours=hours),
+        ):
+            call_command(
+                'export_bookkeeping',
+                self.output.name,
+                '--incremental',
+                stdout=stdout,
+            )
+        return stdout.getvalue()
+
+    def change(self, invoice, hours):
+        Invoice.objects.filter(id=invoice.id).update(
+            updatedAt=self.startedAt + timedelta(hours=hours),
+        )
+
+    def read_watermark(self):
+        return ExportBookkeepingCommand().read_watermark(self.output.name)
+
+    def read_pieces(self, invoicerID, hours):
+        stamp = f'{self.startedAt + timedelta(hours=hours):%Y%m%dT%H%M%S}'
+        path = join(self.output.name, str(invoicerID), f'{stamp}.csv')
+        if not exists(path):
+            return []
+        with open(path, encoding='utf-8', newline='') as csvFile:
+            return sorted(row['Piece'] for row in DictReader(csvFile))
+
+    def get_pieces(self, *invoices):
+        return sorted(
+            str(row['Piece'])
+            for invoice in invoices
+            for row in export_invoice_data(
+                Invoice.objects.get(id=invoice.id),
+                EXPORT_DATA_HEADER,
+            )
+        )
+
+    def test_secondRun_exportsChangedInvoices(self):
+        invoices = list(Invoice.objects.filter(state=2).order_by('id'))
+        self.assertIn('4 invoices', self.export(0))
+        self.assertEqual(self.read_watermark(), self.startedAt)
+        self.assertEqual(
+            self.read_pieces(0, 0),
+            self.get_pieces(*invoices[:2]),
+        )
+        self.change(invoices[1], 1)
+        self.assertIn('1 invoices', self.export(2))
+        self.assertEqual(self.read_pieces(0, 2), self.get_pieces(invoices[1]))
+        self.assertEqual(self.read_pieces(1, 2), [])
+        self.assertEqual(
+            sorted(listdir(join(self.output.name, '0'))),
+            ['20240601T120000.csv', '20240601T140000.csv'],
+        )
+
+    def test_failedRun_keepsWatermark(self):
+        invoices = list(Invoice.objects.filter(state=2).order_by('id'))
+        self.export(0)
+        self.change(invoices[0], 1)
+        self.change(invoices[2], 1)
+        exportInvoicer = ExportBookkeepingCommand.export_invoicer
+
+        def export_invoicer(command, invoicerID, *args):
+            if invoicerID == 1:
+                raise OSError('No space left on device')
+            return exportInvoicer(command, invoicerID, *args)
+
+        with patch.object(
+            ExportBookkeepingCommand,
+            'export_invoicer',
+            export_invoicer,
+        ), self.assertRaises(OSError):
+            self.export(2)
+        self.assertEqual(self.read_watermark(), self.startedAt)
+        self.assertIn('2 invoices', self.export(3))
+        self.assertEqual(self.read_pieces(0, 3), self.get_pieces(invoices[0]))
+        self.assertEqual(self.read_pieces(1, 3), self.get_pieces(invoices[2]))
+        self.assertEqual(
+            self.read_watermark(),
+            self.startedAt + timedelta(hours=3),
+        )
@@ -18,6 +18,10 @@ from .views import (
     invoice_estimate,
     delete_payment,
     download_receipt,
+    render_invoice,
+    render_receipt,
+    render_job_status,
+    download_render_job,
     InvoiceDetailView,
     InvoiceListView,
     EstimateListView,
@@ -106,4 +110,12 @@ urlpatterns = [
         download_receipt,
         name='download-receipt',
     ),
+    path('renderInvoice/<int:invoice>', render_invoice, name='render-invoice'),
+    path('renderReceipt/<int:payment>', render_receipt, name='render-receipt'),
+    path('renderJob/<int:job>', render_job_status, name='render-job'),
+    path(
+        'downloadRenderJob/<int:job>',
+        download_render_job,
+        name='download-render-job',
+    ),
 ]
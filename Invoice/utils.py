@@ -1,19 +1,34 @@
-from glob import glob
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from csv import DictWriter
 from datetime import date
 from decimal import Decimal
-from subprocess import run
-from os import chdir, getcwd, remove
-from os.path import join
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice
+from subprocess import run, STDOUT, PIPE
+from tempfile import TemporaryDirectory
+from os import cpu_count, environ, getcwd, pathsep, remove, scandir, stat
+from os.path import basename, join, isfile, splitext
+from shutil import rmtree
+from time import time
+from zipfile import ZIP_DEFLATED, ZipFile
+from PIL import Image
+from django.conf import settings
+from django.db.models import Q, Count
+from django.db.transaction import atomic
 from django.utils.translation import gettext as _
 
-from .models import Invoice, Project, Fee
+from .models import Invoice, Project, Fee, TOTAL_FIELDS, get_update_fields
 from InvoiceGenerator.settings import (
     TEMPTEXFILESDIR,
     PREFIX_CLIENT_BOOKKEEPING_MOROCCO,
     PREFIX_CLIENT_BOOKKEEPING_FRANCE,
     VAT_NOTE,
 )
+from Core.models import PDFBackends
 from Core.utils import (
+    get_currency_symbol,
     get_currency_symbol_latex,
     get_paymentMethod_label,
     lformat_decimal,
@@ -23,18 +38,45 @@ from Core.exceptions import (
     LateXError,
     InvoicingError,
 )
+from .cache import (
+    get_cache_key,
+    get_cached_file,
+    store_file,
+)
+from .templating import get_tex_template
+from .preamble import (
+    get_preamble_format,
+    get_formats_directory,
+    rebuild_preamble_format,
+)
+from .pdf import PAGE_WIDTH, PAGE_HEIGHT, CM, PDFDocument, PDFFlow, wrap_text
+
+
+RENDER_PARALLELISM = getattr(settings, 'RENDER_PARALLELISM', cpu_count())
+RENDER_SCRATCH_MAX_AGE = getattr(settings, 'RENDER_SCRATCH_MAX_AGE', 3600)
+PDF_SIMPLE_MAX_PROJECTS = getattr(settings, 'PDF_SIMPLE_MAX_PROJECTS', 2)
+PDF_SIMPLE_MAX_FEES = getattr(settings, 'PDF_SIMPLE_MAX_FEES', 10)
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 500)
+INVOICE_LIST_PAGE_SIZE = getattr(settings, 'INVOICE_LIST_PAGE_SIZE', 50)
 
 
 def create_credit_note(invoice):
-    if (
+    if not (
         invoice.state == 2
         and invoice.paidAmount == 0
         and invoice.paymentMethod != 'CN'
     ):
+        raise InvoicingError(_('ACreditNotCanOnlyBeMadeForInvoices'))
+    with atomic():
         invoice.paymentMethod = 'CN'
         invoice.owedAmount = 0
         invoice.state = 3
-        invoice.save()
+        invoice.save(
+            update_fields=get_update_fields(
+                invoice,
+                TOTAL_FIELDS + ['paidAmount'],
+            ),
+        )
         creditNote = Invoice()
         creditNote.invoicer = invoice.invoicer
         creditNote.invoicee = invoice.invoicee
@@ -59,8 +101,6 @@ def create_credit_note(invoice):
         fee.vat = invoice.avgVAT
         creditNote.owedAmount = 0
         fee.save()
-    else:
-        raise InvoicingError(_('ACreditNotCanOnlyBeMadeForInvoices'))
 
 
 def split_description(description):
@@ -278,51 +318,542 @@ def get_placeHolder_data(invoice):
     }
 
 
-def generate_invoice_tex(invoice):
-    template = join(getcwd(), TEMPTEXFILESDIR, 'invoice.tex')
-    with open(template, 'r', encoding='utf-8') as texFile:
-        rawTex = texFile.read()
-    data = get_placeHolder_data(invoice)
-    for key, value in data.items():
-        rawTex = rawTex.replace(key, value)
-    return rawTex
-
-
-def compile_texFile(texFileName):
-    current_path = getcwd()
-    targetPath = join(getcwd(), TEMPTEXFILESDIR)
-    chdir(targetPath)
-    run(['xelatex', texFileName])
-    for file in glob('*.aux'):
-        remove(file)
-    for file in glob('*.log'):
-        remove(file)
-    remove(texFileName)
-    chdir(current_path)
-
-
-def generate_invoice_file(invoice):
-    rawTex = generate_invoice_tex(invoice)
+def generate_invoice_tex(invoice, data=None):
+    if data is None:
+        data = get_placeHolder_data(invoice)
+    return get_tex_template('invoice.tex').render(data)
+
+
+def get_scratch_directory():
+    # Scratch directories live next to the templates so that compiled PDFs
+    # can be moved into the cache without crossing filesystems.
+    return TemporaryDirectory(
+        prefix='render-',
+        dir=join(getcwd(), TEMPTEXFILESDIR),
+    )
+
+
+def clean_scratch_files(maxAge=None):
+    # Removes the scratch directories that crashed renders left behind. The
+    # template directory also holds the templates and their assets, so
+    # nothing else in it is touched.
+    if maxAge is None:
+        maxAge = RENDER_SCRATCH_MAX_AGE
+    now = time()
+    removed = 0
+    for entry in scandir(join(getcwd(), TEMPTEXFILESDIR)):
+        if not entry.name.startswith(('render-', 'format-')):
+            continue
+        try:
+            if not entry.is_dir() or now - entry.stat().st_mtime <= maxAge:
+                continue
+        except FileNotFoundError:
+            continue
+        rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+def run_xelatex(texFilePath, outputDirectory, formatName=None):
+    command = [
+        'xelatex',
+        '-interaction=nonstopmode',
+        f'-output-directory={outputDirectory}',
+    ]
+    environment = None
+    if formatName is not None:
+        command.append(f'-fmt={formatName}')
+        environment = environ | {
+            'TEXFORMATS': f'{get_formats_directory()}{pathsep}',
+        }
+    return run(
+        command + [texFilePath],
+        cwd=join(getcwd(), TEMPTEXFILESDIR),
+        env=environment,
+        stdout=PIPE,
+        stderr=STDOUT,
+    )
+
+
+def compile_texFile(
+    texFilePath,
+    outputDirectory=None,
+    formatName=None,
+    templateName=None,
+):
+    templateDirectory = join(getcwd(), TEMPTEXFILESDIR)
+    if outputDirectory is None:
+        outputDirectory = templateDirectory
+    jobName = splitext(basename(texFilePath))[0]
+    pdfFilePath = join(outputDirectory, f'{jobName}.pdf')
+    process = run_xelatex(texFilePath, outputDirectory, formatName)
+    if formatName is not None and not isfile(pdfFilePath):
+        # A stale or missing format fails the compilation, so the document
+        # is compiled in full and the format rebuilt once it did.
+        process = run_xelatex(texFilePath, outputDirectory)
+        if templateName is not None and isfile(pdfFilePath):
+            rebuild_preamble_format(templateName, formatName)
+    for extension in ['aux', 'log']:
+        auxiliaryFile = join(outputDirectory, f'{jobName}.{extension}')
+        if isfile(auxiliaryFile):
+            remove(auxiliaryFile)
+    remove(join(templateDirectory, texFilePath))
+    if not isfile(pdfFilePath):
+        raise LateXError(
+            _('PDFGenerationFailed'),
+            process.stdout.decode('utf-8', errors='replace')[-1000:],
+        )
+    return pdfFilePath
+
+
+def get_invoice_file_name(invoice, extension='pdf'):
     if invoice.state == 0:
-        texFileName = f'{invoice.invoicer.name}_'\
+        return f'{invoice.invoicer.name}_'\
             f'{date.today()}_'\
-            f'{invoice.count}.tex'.replace(' ', '')
+            f'{invoice.count}.{extension}'.replace(' ', '')
     else:
-        texFileName = f'{invoice.invoicer.name}_'\
+        return f'{invoice.invoicer.name}_'\
             f'{invoice.facturationDate}_'\
-            f'{invoice.count}.tex'.replace(' ', '')
-    texFilePath = join(getcwd(), TEMPTEXFILESDIR, texFileName)
+            f'{invoice.count}.{extension}'.replace(' ', '')
+
+
+def generate_invoice_file(invoice, directory, data=None):
+    rawTex = generate_invoice_tex(invoice, data)
+    texFileName = get_invoice_file_name(invoice, extension='tex')
+    texFilePath = join(directory, texFileName)
     with open(texFilePath, 'w', encoding='utf-8') as texFile:
         texFile.write(rawTex)
-    compile_texFile(texFileName)
-    if invoice.state == 0:
-        return f'{invoice.invoicer.name}_'\
-            f'{date.today()}_'\
-            f'{invoice.count}.pdf'.replace(' ', '')
+    compile_texFile(
+        texFilePath,
+        directory,
+        get_preamble_format('invoice.tex'),
+        'invoice.tex',
+    )
+    return get_invoice_file_name(invoice)
+
+
+@lru_cache(maxsize=32)
+def load_logo(path, modified):
+    with Image.open(path) as image:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+    jpeg = BytesIO()
+    background.save(jpeg, 'JPEG', quality=90)
+    return jpeg.getvalue(), background.size
+
+
+def get_logo(invoicer):
+    path = join(getcwd(), TEMPTEXFILESDIR, str(invoicer.logo))
+    try:
+        return load_logo(path, stat(path).st_mtime)
+    except OSError:
+        return None
+
+
+def get_invoice_lines(invoice, invoiceType):
+    if invoice.state == 1:
+        return [
+            f'Date de devis: {lformat_date(date.today())}',
+            f'Devis Numéro: D{date.today().year}-'
+            f'{date.today().day}{date.today().month}',
+        ]
+    invoiceStatus = 'e facturation' if invoiceType == 'Facture' else '\'avoir'
+    return [
+        f'Date d{invoiceStatus}: {lformat_date(invoice.facturationDate)}',
+        f'{invoiceType} Numéro: {invoice.number}',
+    ]
+
+
+def get_bank_lines(bankAccount, isDomestic):
+    if bankAccount is None:
+        return []
+    return [
+        ('Banque', bankAccount.bankName),
+        ('SWIFT/BIC', bankAccount.bic),
+        ('RIB', bankAccount.rib) if isDomestic else ('IBAN', bankAccount.iban),
+    ]
+
+
+def get_invoiceeID_line(invoicer, invoicee):
+    if invoicee.is_person and invoicer.country.lower() == 'mar':
+        return ('CIN', invoicee.cin)
+    return (get_ice_designation(invoicee), invoicee.ice)
+
+
+def draw_labelled_lines(flow, x, lines, size=9):
+    for label, value in lines:
+        page = flow.reserve(size + 3)
+        flow.y -= size + 3
+        offset = page.text(x, flow.y, f'{label}: ', size, bold=True)
+        page.text(x + offset, flow.y, value or '', size)
+
+
+def draw_invoice_footer(invoicer, page):
+    legalInformation = invoicer.legalinformation
+    left, right = 2 * CM, PAGE_WIDTH - 2 * CM
+    page.line(left, 2 * CM, right, 2 * CM)
+    page.text(
+        PAGE_WIDTH / 2,
+        2 * CM - 10,
+        f'{invoicer.name} {legalInformation.legalForm} - '
+        f'{invoicer.address} - Tél: {invoicer.telefon}',
+        7,
+        align='center',
+    )
+    page.text(
+        PAGE_WIDTH / 2,
+        2 * CM - 19,
+        f'RC: {legalInformation.rc} - Patente: {legalInformation.patente} - '
+        f'CNSS: {legalInformation.cnss} - IF: {legalInformation.fiscal} - '
+        f'{get_ice_designation(invoicer)}: {legalInformation.ice}',
+        7,
+        align='center',
+    )
+
+
+def draw_invoice_header(flow, invoice, invoiceType):
+    invoicer = invoice.invoicer
+    invoicee = invoice.invoicee
+    page = flow.page
+    left, middle = 2 * CM, PAGE_WIDTH / 2
+    logo = get_logo(invoicer)
+    logoHeight = 0
+    if logo is not None:
+        data, (width, height) = logo
+        scale = min(5 * CM / width, 2.5 * CM / height)
+        logoHeight = height * scale
+        page.image(
+            flow.document.add_jpeg(data, width, height),
+            left,
+            flow.y - logoHeight,
+            width * scale,
+            logoHeight,
+        )
+    page.text(PAGE_WIDTH - 2 * CM, flow.y - 16, invoicer.name, 16, True, 'right')
+    top = flow.y - max(logoHeight, 20) - 20
+    invoicerLines = [
+        *invoicer.address.split(','),
+        get_country(invoicer),
+        f'{get_ice_designation(invoicer)}: {invoicer.legalinformation.ice}',
+        f'Tél: {invoicer.telefon}',
+    ]
+    invoiceeID = get_invoiceeID_line(invoicer, invoicee)
+    invoiceeLines = [
+        *invoicee.address.split(','),
+        get_country(invoicee),
+        f'{invoiceeID[0]}: {invoiceeID[1]}',
+    ]
+    columns = [
+        (left, f'{invoicer.name} {invoicer.legalinformation.legalForm}',
+         invoicerLines),
+        (middle, invoicee.name, invoiceeLines),
+    ]
+    bottom = top
+    for x, title, lines in columns:
+        y = top
+        page.text(x, y, title, 10, bold=True)
+        for line in lines:
+            y -= 12
+            page.text(x, y, line.strip(), 9)
+        bottom = min(bottom, y)
+    y = bottom - 24
+    for line in get_invoice_lines(invoice, invoiceType):
+        page.text(left, y, line, 10, bold=True)
+        y -= 13
+    page.text(middle, bottom - 24, get_dueDate_block(invoice), 10)
+    flow.y = y - 10
+
+
+PROJECT_COLUMNS = [10 * CM, 1.5 * CM, 1.5 * CM, 2 * CM, 2 * CM]
+
+
+def draw_project(flow, project, currency):
+    left, right = 2 * CM, PAGE_WIDTH - 2 * CM
+    edges = [left]
+    for width in PROJECT_COLUMNS:
+        edges.append(edges[-1] + width)
+    centers = [
+        (start + end) / 2 for start, end in zip(edges[:-1], edges[1:])
+    ]
+    for line in wrap_text(project.title, right - left, 14, bold=True):
+        page = flow.reserve(18)
+        flow.y -= 18
+        page.text(PAGE_WIDTH / 2, flow.y, line, 14, True, 'center')
+    page = flow.reserve(60)
+    flow.y -= 8
+    page.line(left, flow.y, right, flow.y)
+    flow.y -= 12
+    for index, title in enumerate(
+        ['Désignation', 'TVA', 'QTÉ', 'PU HT', 'Total HT'],
+    ):
+        if index == 0:
+            page.text(left + 2, flow.y, title, 9, bold=True)
+        else:
+            page.text(centers[index], flow.y, title, 9, True, 'center')
+    flow.y -= 5
+    page.line(left, flow.y, right, flow.y)
+    page.line(left, flow.y - 1.5, right, flow.y - 1.5)
+    flow.y -= 2
+    fees, feesVAT, feesVATIncluded = 0, 0, 0
+    for fee in project.fee_set.all():
+        fee_ = fee.rateUnit * fee.count
+        fees += fee_
+        feesVAT += round(fee_ * Decimal(fee.vat / 100), 2)
+        feesVATIncluded += round(fee_ * Decimal(1 + fee.vat / 100), 2)
+        description = wrap_text(fee.description, PROJECT_COLUMNS[0] - 4, 9)
+        page = flow.reserve(len(description) * 11 + 3)
+        flow.y -= 11
+        cells = [
+            f'{fee.vat}%',
+            f'{fee.count}',
+            lformat_decimal(fee.rateUnit),
+            lformat_decimal(fee_),
+        ]
+        for center, cell in zip(centers[1:], cells):
+            page.text(center, flow.y, cell, 9, align='center')
+        for index, line in enumerate(description):
+            if index:
+                flow.y -= 11
+            page.text(left + 2, flow.y, line, 9)
+        flow.y -= 3
+    page = flow.reserve(48)
+    page.line(left, flow.y, right, flow.y)
+    page.line(left, flow.y - 1.5, right, flow.y - 1.5)
+    flow.y -= 2
+    for label, amount in [
+        ('Total HT', fees),
+        ('TVA', feesVAT),
+        ('Total TTC', feesVATIncluded),
+    ]:
+        flow.y -= 12
+        page.text(left + 2, flow.y, f'{label} ({currency})', 9, bold=True)
+        page.text(centers[-1], flow.y, lformat_decimal(amount), 9, align='center')
+    flow.y -= 4
+    page.line(left, flow.y, right, flow.y)
+    flow.y -= 16
+    return fees
+
+
+def draw_invoice_pdf(invoice):
+    invoicer = invoice.invoicer
+    invoicee = invoice.invoicee
+    projects = list(invoice.project_set.prefetch_related('fee_set'))
+    totalSum = sum(
+        fee.rateUnit * fee.count
+        for project in projects
+        for fee in project.fee_set.all()
+    )
+    document = PDFDocument()
+    flow = PDFFlow(
+        document,
+        PAGE_HEIGHT - 2 * CM,
+        2.5 * CM,
+        lambda page: draw_invoice_footer(invoicer, page),
+    )
+    draw_invoice_header(
+        flow,
+        invoice,
+        'Facture' if totalSum >= 0 else 'Avoir',
+    )
+    currency = get_currency_symbol(invoice.baseCurrency)
+    for project in projects:
+        draw_project(flow, project, currency)
+    left = 2 * CM
+    paymentMethodLabel = get_paymentMethod_label(invoice.paymentMethod)
+    draw_labelled_lines(
+        flow,
+        left,
+        [('Methode de payement', _(paymentMethodLabel))],
+    )
+    if check_invoiceIsForeign(invoicer, invoicee):
+        flow.y -= 6
+        for line in wrap_text(VAT_NOTE, PAGE_WIDTH - 4 * CM, 9):
+            page = flow.reserve(12)
+            flow.y -= 12
+            page.text(PAGE_WIDTH / 2, flow.y, line, 9, align='center')
+    if invoice.state not in [1, 4]:
+        flow.y -= 6
+        draw_labelled_lines(
+            flow,
+            left,
+            get_bank_lines(
+                invoice.bankAccount,
+                invoice.baseCurrency == invoicer.bookKeepingCurrency,
+            ),
+        )
+    return document.render()
+
+
+class PDFRenderer(ABC):
+
+    name = None
+    inProcess = False
+
+    @abstractmethod
+    def render_invoice(self, invoice, data, directory):
+        pass
+
+    def render_receipt(self, payment, directory):
+        return generate_receipt_file(payment, directory)
+
+
+class LatexRenderer(PDFRenderer):
+
+    name = PDFBackends.LATEX
+
+    def render_invoice(self, invoice, data, directory):
+        return generate_invoice_file(invoice, directory, data)
+
+
+class PythonRenderer(PDFRenderer):
+
+    name = PDFBackends.PYTHON
+    inProcess = True
+
+    def render_invoice(self, invoice, data, directory):
+        try:
+            pdf = draw_invoice_pdf(invoice)
+        except UnicodeEncodeError:
+            # Text the built-in fonts cannot print, such as Arabic names or
+            # addresses, is typeset by LaTeX instead.
+            return PDF_RENDERERS[PDFBackends.LATEX].render_invoice(
+                invoice,
+                data,
+                directory,
+            )
+        fileName = get_invoice_file_name(invoice)
+        with open(join(directory, fileName), 'wb') as pdfFile:
+            pdfFile.write(pdf)
+        return fileName
+
+
+PDF_RENDERERS = {
+    PDFBackends.LATEX: LatexRenderer(),
+    PDFBackends.PYTHON: PythonRenderer(),
+}
+
+
+def is_simple_invoice(invoice):
+    counts = invoice.project_set.aggregate(
+        projects=Count('id', distinct=True),
+        fees=Count('fee'),
+    )
+    return (
+        counts['projects'] <= PDF_SIMPLE_MAX_PROJECTS
+        and counts['fees'] <= PDF_SIMPLE_MAX_FEES
+    )
+
+
+def get_pdf_renderer(invoice, backend=None):
+    if not backend:
+        backend = invoice.invoicer.pdfBackend
+    if backend == PDFBackends.AUTO:
+        backend = (
+            PDFBackends.PYTHON
+            if is_simple_invoice(invoice)
+            else PDFBackends.LATEX
+        )
+    return PDF_RENDERERS.get(backend, PDF_RENDERERS[PDFBackends.LATEX])
+
+
+def get_invoice_cache_key(invoice, data, renderer):
+    return get_cache_key(
+        data,
+        join(getcwd(), TEMPTEXFILESDIR, str(invoice.invoicer.logo)),
+        digests=[get_tex_template('invoice.tex').digest, renderer.name],
+    )
+
+
+def compile_invoice_pdf(invoice, data, key, renderer):
+    with get_scratch_directory() as directory:
+        fileName = renderer.render_invoice(invoice, data, directory)
+        return store_file(key, join(directory, fileName))
+
+
+def get_invoice_pdf(invoice, backend=None):
+    renderer = get_pdf_renderer(invoice, backend)
+    data = get_placeHolder_data(invoice)
+    key = get_invoice_cache_key(invoice, data, renderer)
+    fileName = get_invoice_file_name(invoice)
+    pathToFile = get_cached_file(key)
+    if pathToFile is None:
+        pathToFile = compile_invoice_pdf(invoice, data, key, renderer)
+    return pathToFile, fileName
+
+
+class ArchiveStream:
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def submit_invoice_pdf(executor, invoice):
+    # Placeholder data is collected here, on the calling thread, so that the
+    # pool threads never touch the database and only wait on xelatex.
+    renderer = get_pdf_renderer(invoice)
+    data = get_placeHolder_data(invoice)
+    key = get_invoice_cache_key(invoice, data, renderer)
+    pathToFile = get_cached_file(key)
+    if pathToFile is None and renderer.inProcess:
+        # In-process renderers read fees from the database and finish
+        # quicker than a pool round trip, so they run right here.
+        pathToFile = compile_invoice_pdf(invoice, data, key, renderer)
+    if pathToFile is not None:
+        future = Future()
+        future.set_result(pathToFile)
+        return future
+    return executor.submit(compile_invoice_pdf, invoice, data, key, renderer)
+
+
+def get_archive_failure(invoice, exception):
+    if isinstance(exception, LateXError):
+        message = ' '.join(exception.args)
     else:
-        return f'{invoice.invoicer.name}_'\
-            f'{invoice.facturationDate}_'\
-            f'{invoice.count}.pdf'.replace(' ', '')
+        message = str(exception) or type(exception).__name__
+    return f'{invoice}: {message}'
+
+
+def stream_invoices_archive(invoices, maxWorkers=None):
+    if maxWorkers is None:
+        maxWorkers = RENDER_PARALLELISM
+    stream = ArchiveStream()
+    failures = []
+    with (
+        ThreadPoolExecutor(max_workers=maxWorkers) as executor,
+        ZipFile(stream, 'w', ZIP_DEFLATED) as archive,
+    ):
+        futures = {}
+        # Any failure is reported in errors.txt rather than raised, since
+        # the response status was sent with the first chunk.
+        for invoice in invoices:
+            try:
+                futures[submit_invoice_pdf(executor, invoice)] = invoice
+            except Exception as e:
+                failures.append(get_archive_failure(invoice, e))
+        for future in as_completed(futures):
+            invoice = futures[future]
+            try:
+                archive.write(future.result(), get_invoice_file_name(invoice))
+            except Exception as e:
+                failures.append(get_archive_failure(invoice, e))
+                continue
+            yield stream.pop()
+        if failures:
+            archive.writestr('errors.txt', '\n'.join(failures))
+    yield stream.pop()
 
 
 def get_bookkkeeping_prefix(invoicer):
@@ -474,7 +1005,7 @@ def dectifyData(data, headers):
     ]
 
 
-def export_invoice_data(invoice, headers):
+def get_invoice_export_sums(invoice):
     sumFees = 0
     sumVAT = 0
     sumFeesWithoutVAT = 0
@@ -483,10 +1014,61 @@ def export_invoice_data(invoice, headers):
         for fee in project.fee_set.all():
             sumFeesVEBaseCurrency += fee.rateUnit * fee.count
             sumFees += fee.bookKeepingAmount
-            sumVAT += fee.bookKeepingAmount * Decimal(fee.vat / 100)
-            sumFeesWithoutVAT += fee.bookKeepingAmount * Decimal(
-                1 + fee.vat / 100
+            sumVAT += fee.bookKeepingAmount * Decimal(fee.vat) / 100
+            sumFeesWithoutVAT += fee.bookKeepingAmount * (
+                1 + Decimal(fee.vat) / 100
             )
+    return sumFees, sumVAT, sumFeesWithoutVAT, sumFeesVEBaseCurrency
+
+
+def divide_half_even(numerator, denominator):
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (
+        2 * remainder == denominator and quotient % 2
+    ):
+        quotient += 1
+    return quotient
+
+
+def get_invoices_export_sums(invoiceIDs):
+    # Amounts are summed as integer cents, and VAT in hundredths of cents
+    # since rates are whole percents, so the only rounding is the final
+    # one to cents, half to even like round() on Decimals.
+    sums = {}
+    for invoiceID, rateUnit, count, vat, bookKeepingAmount in (
+        Fee.objects.filter(
+            project__invoice__in=invoiceIDs,
+        ).order_by().values_list(
+            'project__invoice',
+            'rateUnit',
+            'count',
+            'vat',
+            'bookKeepingAmount',
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    ):
+        bookKeeping = int(bookKeepingAmount * 100)
+        invoiceSums = sums.setdefault(invoiceID, [0, 0, 0])
+        invoiceSums[0] += bookKeeping
+        invoiceSums[1] += bookKeeping * vat
+        invoiceSums[2] += int(rateUnit * 100) * count
+    exportSums = {}
+    for invoiceID, (bookKeeping, vatHundredths, baseCurrency) in sums.items():
+        exportSums[invoiceID] = tuple(
+            Decimal(cents).scaleb(-2)
+            for cents in [
+                bookKeeping,
+                divide_half_even(vatHundredths, 100),
+                divide_half_even(100 * bookKeeping + vatHundredths, 100),
+                baseCurrency,
+            ]
+        )
+    return exportSums
+
+
+def export_invoice_data(invoice, headers, sums=None):
+    if sums is None:
+        sums = get_invoice_export_sums(invoice)
+    sumFees, sumVAT, sumFeesWithoutVAT, sumFeesVEBaseCurrency = sums
     if invoice.invoicer.bookKeepingCurrency == invoice.baseCurrency:
         return dectifyData(
             dataCaseDomesticFees(invoice, sumFees, sumFeesWithoutVAT, sumVAT),
@@ -499,6 +1081,87 @@ def export_invoice_data(invoice, headers):
         )
 
 
+class CSVStream:
+
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, data):
+        self.buffer.append(data)
+        return len(data)
+
+    def pop(self):
+        data = ''.join(self.buffer).encode('utf-8')
+        self.buffer.clear()
+        return data
+
+
+def get_invoice_chunks(invoices, chunkSize):
+    invoices = iter(invoices)
+    while chunk := list(islice(invoices, chunkSize)):
+        yield chunk
+
+
+def stream_invoices_export(invoices, headers, chunkSize=None):
+    # Invoices are read in chunks and the fees of each chunk are summed in
+    # one query, so memory stays bounded by the chunk size.
+    if chunkSize is None:
+        chunkSize = EXPORT_CHUNK_SIZE
+    stream = CSVStream()
+    dictWriter = DictWriter(stream, headers)
+    dictWriter.writeheader()
+    for chunk in get_invoice_chunks(
+        invoices.select_related('invoicer', 'invoicee').iterator(
+            chunk_size=chunkSize,
+        ),
+        chunkSize,
+    ):
+        for data in export_invoices_data(chunk, headers):
+            dictWriter.writerows(data)
+        yield stream.pop()
+    yield stream.pop()
+
+
+def export_invoices_data(invoices, headers):
+    invoices = list(invoices)
+    exportSums = get_invoices_export_sums([invoice.id for invoice in invoices])
+    noSums = (Decimal(0),) * 4
+    for invoice in invoices:
+        yield export_invoice_data(
+            invoice,
+            headers,
+            exportSums.get(invoice.id, noSums),
+        )
+
+
+def get_invoice_cursor(invoice):
+    return f'{invoice.facturationDate.isoformat()}_{invoice.id}'
+
+
+def get_invoice_page(invoices, cursor=None, pageSize=None):
+    # Keyset pagination on (facturationDate, id), newest first: a page
+    # starts right after the last invoice of the previous one, so deep
+    # pages cost as much as the first.
+    if pageSize is None:
+        pageSize = INVOICE_LIST_PAGE_SIZE
+    invoices = invoices.order_by('-facturationDate', '-id')
+    if cursor:
+        try:
+            facturationDate, invoiceID = cursor.split('_')
+            facturationDate = date.fromisoformat(facturationDate)
+            invoiceID = int(invoiceID)
+        except ValueError:
+            raise InvoicingError(_('InvalidInvoicePageCursor'))
+        invoices = invoices.filter(
+            Q(facturationDate__lt=facturationDate)
+            | Q(facturationDate=facturationDate, id__lt=invoiceID)
+        )
+    page = list(invoices[:pageSize + 1])
+    if len(page) > pageSize:
+        return page[:pageSize], get_invoice_cursor(page[pageSize - 1])
+    return page, None
+
+
 def processInvoiceDraftDataAndSave(invoiceData, estimate=None):
     if estimate is None:
         raise ValueError(_('Error: estimate can\'t be None.'))
@@ -556,10 +1219,12 @@ def get_placeHolder_data_receipt(payment):
 \\multicolumn{{1}}{{l}}{{\\textbf{{Total TTC ({currency})}}}}&
 \\multicolumn{{1}}{{c}}{{{lformat_decimal(payment.paidAmount)}}}\\\\\\hline
 '''
-    coverage = round(payment.paidAmount / invoices.count())
     invoices = '\\\\'.join(
-        f'Paiement pour la facture {invoice.number}&{lformat_decimal(coverage)}'
-        for invoice in invoices.all()
+        f'Paiement pour la facture {allocation.invoice.number}&'
+        f'{lformat_decimal(allocation.amount)}'
+        for allocation in payment.paymentallocation_set.select_related(
+            'invoice',
+        ).order_by('invoice_id')
     )
     return {
         '%INVOICERADRESS%': invoicerAddress,
@@ -584,20 +1249,29 @@ def get_placeHolder_data_receipt(payment):
 
 
 def generate_receipt_tex(payment):
-    template = join(getcwd(), TEMPTEXFILESDIR, 'receipt.tex')
-    with open(template, 'r', encoding='utf-8') as texFile:
-        rawTex = texFile.read()
     data = get_placeHolder_data_receipt(payment)
-    for key, value in data.items():
-        rawTex = rawTex.replace(key, value)
-    return rawTex
+    return get_tex_template('receipt.tex').render(data)
 
 
-def generate_receipt_file(payment):
+def generate_receipt_file(payment, directory):
     rawTex = generate_receipt_tex(payment)
     fileName = f'{payment.payor.name}-P{payment.paymentDay}'.replace(' ', '')
-    texFilePath = join(getcwd(), TEMPTEXFILESDIR, f'{fileName}.tex')
+    texFilePath = join(directory, f'{fileName}.tex')
     with open(texFilePath, 'w', encoding='utf-8') as texFile:
         texFile.write(rawTex)
-    compile_texFile(texFilePath)
+    compile_texFile(
+        texFilePath,
+        directory,
+        get_preamble_format('receipt.tex'),
+        'receipt.tex',
+    )
     return f'{fileName}.pdf'
+
+
+def get_receipt_pdf(payment):
+    renderer = PDF_RENDERERS[PDFBackends.LATEX]
+    with get_scratch_directory() as directory:
+        fileName = renderer.render_receipt(payment, directory)
+        # The PDF is read before the scratch directory is removed.
+        with open(join(directory, fileName), 'rb') as pdfFile:
+            return BytesIO(pdfFile.read()), fileName
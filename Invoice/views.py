@@ -1,7 +1,6 @@
 from datetime import date
 from decimal import Decimal
-from os import getcwd
-from os.path import join
+from io import BytesIO
 
 from django.contrib.messages import error, success
 from django.shortcuts import render
@@ -14,7 +13,8 @@ from django.views.generic import (
 )
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import FileResponse, HttpResponseRedirect
+from django.core.exceptions import BadRequest
+from django.http import FileResponse, HttpResponseRedirect, Http404
 from django.urls import reverse
 from django.views.decorators.http import (
     require_GET,
@@ -25,28 +25,40 @@ from django.utils.translation import gettext_lazy as _
 from django.urls import reverse_lazy
 
 from Core.forms import InvoiceFilterControlForm, PaymentFilterControlForm
+from Core.models import RenderJobStates, PDFBackends
 
 from Invoicer.models import Invoicer, BankAccount
+from Invoicer.utils import get_invoicer, has_multiple_invoicers
 from Invoicee.models import Invoicee
 from Core.utils import HTTPResponseHXRedirect
-from .models import Invoice, Project, Fee, Payment
+from .models import Invoice, Project, Fee, Payment, RenderJob
 from .forms import ProjectForm, FeeForm, InvoiceForm, PaymentForm
 from .utils import (
     create_credit_note,
-    generate_invoice_file,
-    generate_receipt_file,
+    get_invoice_pdf,
+    get_receipt_pdf,
     processInvoiceDraftDataAndSave,
+    get_invoice_page,
     LateXError,
+    InvoicingError,
+    INVOICE_LIST_PAGE_SIZE,
 )
-from InvoiceGenerator.settings import TEMPTEXFILESDIR
+from .jobs import enqueue_invoice_render, enqueue_receipt_render
+
+
+def get_requested_backend(parameters):
+    backend = parameters.get('backend', '')
+    return backend if backend in PDFBackends.values else ''
 
 
 @login_required
 def download_invoice(request, invoice):
     invoice = Invoice.objects.get(id=invoice)
     try:
-        file = generate_invoice_file(invoice)
-        pathToFile = join(getcwd(), TEMPTEXFILESDIR, file)
+        pathToFile, file = get_invoice_pdf(
+            invoice,
+            get_requested_backend(request.GET),
+        )
         response = FileResponse(
             open(pathToFile, 'rb'),
             content_type='application/pdf',
@@ -62,10 +74,9 @@ def download_invoice(request, invoice):
 def download_receipt(request, payment):
     payment = Payment.objects.get(id=payment)
     try:
-        file = generate_receipt_file(payment)
-        pathToFile = join(getcwd(), TEMPTEXFILESDIR, file)
+        pdfFile, file = get_receipt_pdf(payment)
         response = FileResponse(
-            open(pathToFile, 'rb'),
+            pdfFile,
             content_type='application/pdf',
             filename=file,
         )
@@ -75,10 +86,61 @@ def download_receipt(request, payment):
         return None
 
 
+@require_POST
+@login_required
+def render_invoice(request, invoice):
+    invoice = Invoice.objects.get(id=invoice)
+    job = enqueue_invoice_render(
+        invoice,
+        request.user,
+        get_requested_backend(request.POST),
+    )
+    return render(request, './RenderJob-status.html', {'job': job})
+
+
+@require_POST
+@login_required
+def render_receipt(request, payment):
+    payment = Payment.objects.get(id=payment)
+    job = enqueue_receipt_render(payment, request.user)
+    return render(request, './RenderJob-status.html', {'job': job})
+
+
+@require_GET
+@login_required
+def render_job_status(request, job):
+    job = RenderJob.objects.defer('pdf').filter(
+        requestedBy=request.user,
+    ).filter(id=job).first()
+    if job is None:
+        raise Http404(_('RenderJobNotFound'))
+    return render(request, './RenderJob-status.html', {'job': job})
+
+
+@require_GET
+@login_required
+def download_render_job(request, job):
+    job = RenderJob.objects.filter(
+        requestedBy=request.user,
+    ).filter(id=job).filter(state=RenderJobStates.DONE).first()
+    if job is None:
+        raise Http404(_('RenderJobNotFound'))
+    return FileResponse(
+        BytesIO(job.pdf),
+        content_type='application/pdf',
+        as_attachment=True,
+        filename=job.fileName,
+    )
+
+
 class BaseInvoiceListView(ListView, LoginRequiredMixin):
 
-    queryset = Invoice.objects.select_related('invoicer', 'invoicee')
+    queryset = Invoice.objects.select_related(
+        'invoicer',
+        'invoicee',
+    ).with_flags()
     template_name = './Invoice-index.html'
+    paginate_by = INVOICE_LIST_PAGE_SIZE
 
     def render_to_response(self, context, **response_kwargs):
         if self.request.user.is_superuser:
@@ -91,6 +153,12 @@ class BaseInvoiceListView(ListView, LoginRequiredMixin):
                     reverse_lazy('admin:Invoicee_invoice_changelist')
                 )
         if self.request.META.get('HTTP_HX_REQUEST'):
+            if self.request.GET.get('after'):
+                return render(
+                    self.request,
+                    './Invoice-list-rows.html',
+                    context,
+                )
             return render(
                 self.request,
                 './Invoice-index-partial.html',
@@ -106,9 +174,25 @@ class BaseInvoiceListView(ListView, LoginRequiredMixin):
                 **response_kwargs,
             )
 
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            invoices, cursor = get_invoice_page(
+                queryset,
+                self.request.GET.get('after'),
+                page_size,
+            )
+        except InvoicingError:
+            raise BadRequest
+        self.nextPageURL = None
+        if cursor is not None:
+            parameters = self.request.GET.copy()
+            parameters['after'] = cursor
+            self.nextPageURL = f'{self.request.path}?{parameters.urlencode()}'
+        return None, None, invoices, cursor is not None
+
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        if self.request.GET:
+        if 'beginDate' in self.request.GET:
             invoiceFilterControlForm = InvoiceFilterControlForm(
                 initial={
                     'beginDate': self.request.GET['beginDate'],
@@ -117,31 +201,29 @@ class BaseInvoiceListView(ListView, LoginRequiredMixin):
             )
         else:
             invoiceFilterControlForm = InvoiceFilterControlForm()
-        managerHasMultipleInvoicers = Invoicer.objects.filter(
-            manager=self.request.user
-        ).count() > 1
         context.update({
             'form': invoiceFilterControlForm,
-            'managerHasMultipleInvoicers': managerHasMultipleInvoicers,
+            'managerHasMultipleInvoicers': has_multiple_invoicers(
+                self.request,
+            ),
+            'nextPageURL': getattr(self, 'nextPageURL', None),
         })
         return context
 
     def get_queryset(self, *args, **kwargs):
         queryset = super().get_queryset(*args, **kwargs)
-        if self.request.GET:
-            return queryset.filter(
-                facturationDate__gte=self.request.GET['beginDate']
-            ).filter(
-                facturationDate__lte=self.request.GET['endDate']
-            ).filter(
-                invoicer=Invoicer.objects.get(manager=self.request.user)
-            )
         return queryset.filter(
-            facturationDate__gte=f'{date.today().year}-01-01'
+            facturationDate__gte=self.request.GET.get(
+                'beginDate',
+                f'{date.today().year}-01-01',
+            )
         ).filter(
-            facturationDate__lte=f'{date.today().year}-12-31'
+            facturationDate__lte=self.request.GET.get(
+                'endDate',
+                f'{date.today().year}-12-31',
+            )
         ).filter(
-            invoicer=Invoicer.objects.get(manager=self.request.user)
+            invoicer=get_invoicer(self.request)
         )
 
 
@@ -217,7 +299,7 @@ def add_estimate(request):
                 reverse_lazy('admin:Invoicee_invoice_add')
             )
     invoiceForm = InvoiceForm()
-    invoicer = Invoicer.objects.get(manager=request.user)
+    invoicer = get_invoicer(request)
     invoiceForm.fields['bankAccount'].queryset = invoicer.bankAccounts
     invoiceForm.fields['bankAccount'].empty_label = _('NoBankAccount')
     invoiceForm.fields['invoicee'].queryset = invoicer.invoicee_set.all()
@@ -256,7 +338,7 @@ def add_estimate_for(request, invoicee):
                 reverse_lazy('admin:Invoicee_invoice_add')
             )
     invoiceForm = InvoiceForm()
-    invoicer = Invoicer.objects.get(manager=request.user)
+    invoicer = get_invoicer(request)
     invoicee = Invoicee.objects.get(id=invoicee)
     invoiceForm.fields['bankAccount'].queryset = invoicer.bankAccounts
     invoiceForm.fields['bankAccount'].empty_label = _('NoBankAccount')
@@ -297,7 +379,7 @@ def add_invoice_for(request, invoicee):
             return HttpResponseRedirect(
                 reverse_lazy('admin:Invoicee_invoice_add')
             )
-    invoicer = Invoicer.objects.get(manager=request.user)
+    invoicer = get_invoicer(request)
     invoicee = Invoicee.objects.get(id=invoicee)
     invoiceForm = InvoiceForm()
     bankAccounts = invoicer.bankAccounts
@@ -345,7 +427,7 @@ def add_invoice(request):
                 reverse_lazy('admin:Invoicee_invoice_add')
             )
     invoiceForm = InvoiceForm()
-    invoicer = Invoicer.objects.get(manager=request.user)
+    invoicer = get_invoicer(request)
     invoiceForm.fields['bankAccount'].queryset = invoicer.bankAccounts
     invoiceForm.fields['bankAccount'].empty_label = _('NoBankAccount')
     invoiceForm.fields['invoicee'].queryset = invoicer.invoicee_set.all()
@@ -768,7 +850,7 @@ class PaymentCreateView(CreateView, LoginRequiredMixin):
 
     def get_form(self):
         paymentForm = super().get_form()
-        invoicer = Invoicer.objects.get(manager=self.request.user)
+        invoicer = get_invoicer(self.request)
         outStandingInvoicesOfInvoicer = Invoice.objects.select_related(
             'invoicer', 'invoicee'
         ).filter(
@@ -844,7 +926,7 @@ class PaymentUpdateView(UpdateView, LoginRequiredMixin):
         paymentForm = super().get_form()
         paymentForm.fields.pop('payor')
         paymentForm.fields.pop('invoice')
-        invoicer = Invoicer.objects.get(manager=self.request.user)
+        invoicer = get_invoicer(self.request)
         paymentForm.fields['bankAccount'].queryset = invoicer.bankAccounts
         paymentForm.fields['bankAccount'].empty_label = _('NoBankAccount')
         # paymentForm.fields['invoice'].queryset = self.object.payor.invoice_set.filter(
@@ -918,9 +1000,7 @@ class PaymentListView(ListView, LoginRequiredMixin):
                     payor__in=Invoicee.objects.select_related(
                         'invoicer'
                     ).filter(
-                        invoicer=Invoicer.objects.get(
-                            manager=self.request.user
-                        )
+                        invoicer=get_invoicer(self.request)
                     )
                 ).filter(
                     payor__name__icontains=self.request.GET['payor']
@@ -940,9 +1020,7 @@ class PaymentListView(ListView, LoginRequiredMixin):
                     payor__in=Invoicee.objects.select_related(
                         'invoicer'
                     ).filter(
-                        invoicer=Invoicer.objects.get(
-                            manager=self.request.user
-                        )
+                        invoicer=get_invoicer(self.request)
                     )
                 ).filter(
                     paymentDay__gte=f'{date.today().year}-01-01'
@@ -997,7 +1075,7 @@ class PaymentDetailView(DetailView, LoginRequiredMixin):
         if self.request.GET:
             context.update({
                 'payment': payment,
-                'invoice_list': payment.invoice.filter(
+                'invoice_list': payment.invoice.with_flags().filter(
                     facturationDate__gte=self.request.GET['beginDate']
                 ).filter(
                     facturationDate__lte=self.request.GET['endDate']
@@ -1012,7 +1090,7 @@ class PaymentDetailView(DetailView, LoginRequiredMixin):
         else:
             context.update({
                 'payment': payment,
-                'invoice_list': payment.invoice.all(),
+                'invoice_list': payment.invoice.with_flags(),
                 'form': InvoiceFilterControlForm(
                     initial={
                         'beginDate': _('dd-mm-yyyy'),
@@ -1,31 +1,15 @@
 from django.contrib.admin import (
     register,
     ModelAdmin,
-    SimpleListFilter,
 )
 from .models import Invoicee
 from Invoicer.models import Invoicer
+from Core.filters import InvoicerListFilter
 from django.utils.translation import gettext as _
 
 
-class InvoicerFilter(SimpleListFilter):
-    title = _('INVOICER')
-    parameter_name = _('INVOICER')
-
-    def lookups(self, request, model_admin):
-        if request.user.is_superuser:
-            return [
-                (invoicer.id, invoicer.name)
-                for invoicer in Invoicer.objects.all().order_by('name')
-            ]
-        return [
-            (invoicer.id, invoicer.name)
-            for invoicer in Invoicer.objects.filter(manager=request.user)
-        ]
-
-    def queryset(self, request, queryset):
-        if self.value():
-            return queryset.filter(invoicer=self.value())
+class InvoicerFilter(InvoicerListFilter):
+    lookup = 'invoicer'
 
 
 @register(Invoicee)
@@ -65,7 +49,7 @@ class InvoiceeAdmin(ModelAdmin):
         if request.user.is_superuser:
             return querySet.order_by('-id')
         return querySet.filter(
-            invoicer__in=Invoicer.objects.filter(manager=request.user),
+            invoicer__manager=request.user,
         ).order_by('-id')
 
     def has_view_permission(self, request, obj=None):
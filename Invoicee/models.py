@@ -6,6 +6,7 @@ from django.db.models import (
     IntegerField,
     TextChoices,
     BooleanField,
+    Index,
     Sum,
     CASCADE,
 )
@@ -17,7 +18,7 @@ from django.core.validators import (
 )
 from django.utils.translation import gettext_lazy as _
 
-from Invoice.models import Invoice
+from Invoice.models import Invoice, MonthlySummary
 from Core.utils import get_currency_symbol
 
 
@@ -94,58 +95,37 @@ class Invoicee(Model):
     def get_absolute_url(self):
         return reverse_lazy('Invoicee:invoicee', args=[self.id])
 
-    @property
-    def outStandingAmounts(self):
-        invoices = self.invoice_set.filter(state=2).filter(owedAmount__gte=0)
-        currencies = invoices.values('baseCurrency').distinct().values_list(
-            'baseCurrency', flat=True
-        )
+    def get_open_amounts(self, expression):
         return [
             {
-                'currency': get_currency_symbol(currency),
-                'amount': invoices.filter(
-                    baseCurrency=currency
-                ).annotate(
-                    tbpaid=F('owedAmount')-F('paidAmount')
-                ).aggregate(
-                    outstanding=Sum('tbpaid')
-                )['outstanding']
+                'currency': get_currency_symbol(row['currency']),
+                'amount': row['amount'],
             }
-            for currency in currencies
+            for row in MonthlySummary.objects.filter(
+                invoicee=self,
+                openInvoiceCount__gt=0,
+            ).values('currency').annotate(
+                amount=Sum(expression),
+            ).order_by('currency')
         ]
 
+    @property
+    def outStandingAmounts(self):
+        return self.get_open_amounts(
+            F('openOwedAmount') - F('openPaidAmount')
+        )
+
     @property
     def paidAmounts(self):
-        invoices = self.invoice_set.filter(state=2).filter(owedAmount__gte=0)
-        currencies = invoices.values('baseCurrency').distinct()
-        return [
-            {
-                'currency': get_currency_symbol(currency['baseCurrency']),
-                'amount': invoices.filter(
-                    baseCurrency=currency
-                ).aggregate(
-                    paid=Sum('paidAmount')
-                )['paid']
-            }
-            for currency in currencies
-        ]
+        return self.get_open_amounts('openPaidAmount')
 
     @property
     def owedAmounts(self):
-        invoices = self.invoice_set.filter(state=2).filter(owedAmount__gte=0)
-        currencies = invoices.values('baseCurrency').distinct()
-        return [
-            {
-                'currency': get_currency_symbol(currency['baseCurrency']),
-                'amount': invoices.filter(
-                    baseCurrency=currency
-                ).aggregate(
-                    owed=Sum('owedAmount')
-                )['owed']
-            }
-            for currency in currencies
-        ]
+        return self.get_open_amounts('openOwedAmount')
 
     class Meta:
         verbose_name = _('INVOICEE')
         verbose_name_plural = _('INVOICEES')
+        indexes = [
+            Index(fields=['invoicer', 'name'], name='invoicee_invoicer_name'),
+        ]
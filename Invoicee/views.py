@@ -15,6 +15,7 @@ from django.http import HttpResponseRedirect
 
 from .models import Invoicee
 from Invoicer.models import Invoicer
+from Invoicer.utils import get_invoicer, has_multiple_invoicers
 from Invoice.models import Invoice
 from Core.forms import InvoiceFilterControlForm, InvoiceeFilterControlForm
 from Core.utils import HTTPResponseHXRedirect
@@ -92,9 +93,7 @@ class InvoiceeCreateView(CreateView, LoginRequiredMixin, SuccessMessageMixin):
                 id=self.request.POST['invoicer']
             )
         else:
-            form.instance.invoicer = Invoicer.objects.get(
-                manager=self.request.user
-            )
+            form.instance.invoicer = get_invoicer(self.request)
         response = super().form_valid(form)
         success(self.request, _('InvoiceeSuccessfullyAdded'))
         return response
@@ -177,9 +176,7 @@ class InvoiceeUpdateView(UpdateView, LoginRequiredMixin, SuccessMessageMixin):
         invoiceeForm.fields['address'].widget = Textarea(attrs={'rows': 2})
         context.update({
             'update': True,
-            'hasMultipleInvoicers': Invoicer.objects.filter(
-                manager=self.request.user
-            ).count() > 1
+            'hasMultipleInvoicers': has_multiple_invoicers(self.request),
         })
         return context
 
@@ -220,9 +217,7 @@ class InvoiceeListView(ListView, LoginRequiredMixin):
         searchForm = InvoiceeFilterControlForm()
         context.update({
             'private': False,
-            'hasMultipleInvoicers': Invoicer.objects.filter(
-                manager=self.request.user
-            ).count() > 1,
+            'hasMultipleInvoicers': has_multiple_invoicers(self.request),
             'searchForm': searchForm,
         })
         return context
@@ -231,7 +226,7 @@ class InvoiceeListView(ListView, LoginRequiredMixin):
         if self.request.GET.get('invoiceeName'):
             success(self.request, _('ResultsSuccessfullyFilterd'))
             queryset = Invoicee.objects.select_related().filter(
-                invoicer=Invoicer.objects.get(manager=self.request.user)
+                invoicer=get_invoicer(self.request)
             ).filter(
                 name__icontains=self.request.GET['invoiceeName']
             ).filter(
@@ -239,7 +234,7 @@ class InvoiceeListView(ListView, LoginRequiredMixin):
             )
         else:
             queryset = Invoicee.objects.select_related().filter(
-                invoicer=Invoicer.objects.get(manager=self.request.user)
+                invoicer=get_invoicer(self.request)
             ).filter(
                 is_person=is_person
             )
@@ -310,8 +305,9 @@ class InvoiceeDetailView(DetailView, LoginRequiredMixin):
                 },
             )
             invoices = Invoice.objects.select_related(
-                'invoicee'
-            ).filter(
+                'invoicer',
+                'invoicee',
+            ).with_flags().filter(
                 invoicee=invoicee
             ).filter(
                 facturationDate__gte=self.request.GET['beginDate']
@@ -325,11 +321,12 @@ class InvoiceeDetailView(DetailView, LoginRequiredMixin):
                     'endDate': _('dd-mm-yy'),
                 },
             )
-            invoices = Invoice.objects.filter(invoicee=invoicee)
+            invoices = Invoice.objects.select_related(
+                'invoicer',
+                'invoicee',
+            ).with_flags().filter(invoicee=invoicee)
         context.update({
-            'managerHasManyInvoicers': Invoicer.objects.filter(
-                manager=self.request.user
-            ).count() > 1,
+            'managerHasManyInvoicers': has_multiple_invoicers(self.request),
             'invoices': invoices,
             'form': invoiceFilterControlForm,
             'private': invoicee.is_person,
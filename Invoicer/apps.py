@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class InvoicerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Invoicer'
+
+    def ready(self):
+        import Invoicer.signals
@@ -8,6 +8,7 @@ from django.db.models import (
     ForeignKey,
     OneToOneField,
     ManyToManyField,
+    Index,
     SET_NULL,
     CASCADE,
 )
@@ -18,7 +19,7 @@ from django.core.validators import (
 )
 from django.utils.translation import gettext_lazy as _
 
-from Core.models import SystemCurrency
+from Core.models import SystemCurrency, PDFBackends
 
 
 class Invoicer(Model):
@@ -68,6 +69,12 @@ class Invoicer(Model):
         default=SystemCurrency.MAD,
         verbose_name=_('BaseCurrency'),
     )
+    pdfBackend = CharField(
+        max_length=2,
+        choices=PDFBackends,
+        default=PDFBackends.LATEX,
+        verbose_name=_('PDFBackend'),
+    )
 
     @property
     def numBankAccounts(self):
@@ -79,6 +86,7 @@ class Invoicer(Model):
     class Meta:
         verbose_name = _('INVOICER')
         verbose_name_plural = _('INVOICERS')
+        indexes = [Index(fields=['name'], name='invoicer_name')]
 
 
 class BankAccount(Model):
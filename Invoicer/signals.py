@@ -0,0 +1,24 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Invoicer
+from .utils import forget_invoicer
+
+
+@receiver(pre_save, sender=Invoicer)
+def pre_save_invoicer(sender=None, instance=None, **kwargs):
+    # The stored row tells which manager the invoicer may be leaving.
+    instance._previousManagerID = None if instance._state.adding else (
+        Invoicer.objects.filter(id=instance.id).values_list(
+            'manager_id',
+            flat=True,
+        ).first()
+    )
+
+
+@receiver([post_save, post_delete], sender=Invoicer)
+def invoicer_changed(sender=None, instance=None, **kwargs):
+    previousManagerID = getattr(instance, '_previousManagerID', None)
+    if previousManagerID not in [None, instance.manager_id]:
+        forget_invoicer(previousManagerID)
+    forget_invoicer(instance.manager_id)
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Invoicer
+
+
+INVOICER_CACHE_TIMEOUT = getattr(settings, 'INVOICER_CACHE_TIMEOUT', 60)
+
+
+def get_invoicer_cache_key(userID):
+    return f'invoicer:manager:{userID}'
+
+
+def get_invoicer(request):
+    # The managed invoicer is resolved once per request, and shared across
+    # requests of the same user for INVOICER_CACHE_TIMEOUT seconds.
+    if not hasattr(request, 'invoicer'):
+        key = get_invoicer_cache_key(request.user.id)
+        invoicer = cache.get(key)
+        if invoicer is None:
+            invoicer = Invoicer.objects.get(manager=request.user)
+            cache.set(key, invoicer, INVOICER_CACHE_TIMEOUT)
+        request.invoicer = invoicer
+    return request.invoicer
+
+
+def get_invoicer_count_cache_key(userID):
+    return f'invoicer:count:{userID}'
+
+
+def has_multiple_invoicers(request):
+    # Cached like get_invoicer, since the views and the admin check it on
+    # every request.
+    if not hasattr(request, 'hasMultipleInvoicers'):
+        key = get_invoicer_count_cache_key(request.user.id)
+        invoicerCount = cache.get(key)
+        if invoicerCount is None:
+            invoicerCount = Invoicer.objects.filter(
+                manager=request.user,
+            ).count()
+            cache.set(key, invoicerCount, INVOICER_CACHE_TIMEOUT)
+        request.hasMultipleInvoicers = invoicerCount > 1
+    return request.hasMultipleInvoicers
+
+
+def get_invoicer_choices_cache_key(user):
+    if user.is_superuser:
+        return 'invoicer:choices:all'
+    return f'invoicer:choices:{user.id}'
+
+
+def get_invoicer_choices(user):
+    # The admin filters list the invoicers of a user on every changelist,
+    # so the (id, name) pairs are kept for INVOICER_CACHE_TIMEOUT seconds.
+    key = get_invoicer_choices_cache_key(user)
+    choices = cache.get(key)
+    if choices is None:
+        invoicers = Invoicer.objects.all()
+        if not user.is_superuser:
+            invoicers = invoicers.filter(manager=user)
+        choices = list(invoicers.order_by('name').values_list('id', 'name'))
+        cache.set(key, choices, INVOICER_CACHE_TIMEOUT)
+    return choices
+
+
+def forget_invoicer(userID):
+    cache.delete_many([
+        get_invoicer_cache_key(userID),
+        get_invoicer_count_cache_key(userID),
+        f'invoicer:choices:{userID}',
+        'invoicer:choices:all',
+    ])
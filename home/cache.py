@@ -0,0 +1,84 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .dashboard import get_dashboard
+
+
+DASHBOARD_CACHE_TIMEOUT = getattr(
+    settings,
+    'DASHBOARD_CACHE_TIMEOUT',
+    24 * 3600,
+)
+DASHBOARD_COUNTERS = ['hits', 'misses']
+
+
+def get_version_key(invoicerID):
+    return f'dashboard:version:{invoicerID}'
+
+
+def get_counter_key(counter):
+    return f'dashboard:{counter}'
+
+
+def get_dashboard_version(invoicerID):
+    return cache.get_or_set(
+        get_version_key(invoicerID),
+        lambda: uuid4().hex,
+        None,
+    )
+
+
+def invalidate_dashboards(*invoicerIDs):
+    # Cached dashboards are keyed by their invoicer's version, so dropping
+    # the version orphans them. The dashboard of all invoicers, shown to
+    # superusers, changes with every invoicer.
+    cache.delete_many([
+        get_version_key(invoicerID)
+        for invoicerID in {*invoicerIDs, None}
+    ])
+
+
+def count_dashboard_lookup(counter):
+    key = get_counter_key(counter)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cached_dashboard(beginDate, endDate, invoicer=None):
+    invoicerID = None if invoicer is None else invoicer.id
+    key = ':'.join([
+        'dashboard',
+        str(invoicerID),
+        get_dashboard_version(invoicerID),
+        beginDate.isoformat(),
+        endDate.isoformat(),
+    ])
+    dashboard = cache.get(key)
+    if dashboard is not None:
+        count_dashboard_lookup('hits')
+        return dashboard
+    count_dashboard_lookup('misses')
+    dashboard = get_dashboard(beginDate, endDate, invoicer)
+    cache.set(key, dashboard, DASHBOARD_CACHE_TIMEOUT)
+    return dashboard
+
+
+def get_dashboard_cache_stats():
+    counters = cache.get_many(
+        [get_counter_key(counter) for counter in DASHBOARD_COUNTERS]
+    )
+    return {
+        counter: counters.get(get_counter_key(counter), 0)
+        for counter in DASHBOARD_COUNTERS
+    }
+
+
+def reset_dashboard_cache_stats():
+    cache.delete_many(
+        [get_counter_key(counter) for counter in DASHBOARD_COUNTERS]
+    )
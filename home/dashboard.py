@@ -0,0 +1,182 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+from itertools import chain
+
+from django.db.models import F, Q, Sum
+
+from Invoice.models import (
+    Invoice,
+    MonthlySummary,
+    SUMMARY_STATES,
+    SUMMARY_AGGREGATES,
+    SUMMARY_FIELDS,
+)
+
+
+ZERO = Decimal(0)
+
+
+@dataclass
+class CurrencyFigures:
+    currency: str
+    invoiceCount: int = 0
+    paidInvoiceCount: int = 0
+    outstandingAmount: Decimal = ZERO
+    beforeVATAmount: Decimal = ZERO
+    vatAmount: Decimal = ZERO
+    afterVATAmount: Decimal = ZERO
+    turnover: Decimal = ZERO
+    paidByPaymentMethod: dict[str, Decimal] = field(default_factory=dict)
+
+
+@dataclass
+class InvoiceeFigures:
+    name: str
+    country: str
+    currency: str
+    owedAmount: Decimal
+    paidAmount: Decimal
+
+
+@dataclass
+class ProjectFigures:
+    title: str
+    currency: str
+    paidAmount: Decimal
+
+
+@dataclass
+class Dashboard:
+    currencies: dict[str, CurrencyFigures]
+    invoicees: list[InvoiceeFigures]
+    projects: list[ProjectFigures]
+
+
+def get_next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def get_whole_months(beginDate, endDate):
+    firstMonth = beginDate.replace(day=1)
+    if firstMonth < beginDate:
+        firstMonth = get_next_month(firstMonth)
+    lastMonth = endDate.replace(day=1)
+    if get_next_month(lastMonth) - timedelta(days=1) > endDate:
+        lastMonth = (lastMonth - timedelta(days=1)).replace(day=1)
+    return firstMonth, lastMonth
+
+
+def summarize(beginDate, endDate, groupBy, invoicer=None):
+    invoices = Invoice.objects.filter(state__in=SUMMARY_STATES)
+    summaries = MonthlySummary.objects.filter(invoiceCount__gt=0)
+    if invoicer is not None:
+        invoices = invoices.filter(invoicer=invoicer)
+        summaries = summaries.filter(invoicer=invoicer)
+    firstMonth, lastMonth = get_whole_months(beginDate, endDate)
+    if firstMonth > lastMonth:
+        invoices = invoices.filter(facturationDate__range=(beginDate, endDate))
+        summaries = summaries.none()
+    else:
+        # Whole months are read from the summaries, only the days around
+        # them are aggregated from the invoices.
+        invoices = invoices.filter(
+            Q(facturationDate__gte=beginDate, facturationDate__lt=firstMonth)
+            | Q(
+                facturationDate__gte=get_next_month(lastMonth),
+                facturationDate__lte=endDate,
+            )
+        )
+        summaries = summaries.filter(month__range=(firstMonth, lastMonth))
+    totals = {}
+    for row in chain(
+        summaries.values('currency', *groupBy).annotate(
+            **{alias: Sum(field) for alias, field in SUMMARY_FIELDS.items()}
+        ).order_by(),
+        invoices.values(*groupBy, currency=F('baseCurrency')).annotate(
+            **SUMMARY_AGGREGATES
+        ).order_by(),
+    ):
+        key = tuple(row[name] for name in ['currency', *groupBy])
+        if key not in totals:
+            totals[key] = {**row, **{alias: 0 for alias in SUMMARY_AGGREGATES}}
+        for alias in SUMMARY_AGGREGATES:
+            totals[key][alias] += row[alias] or 0
+    return list(totals.values())
+
+
+def get_currency_figures(beginDate, endDate, invoicer=None):
+    figures = {}
+    for row in sorted(
+        summarize(beginDate, endDate, ['paymentMethod'], invoicer),
+        key=lambda row: row['currency'],
+    ):
+        currency = row['currency']
+        if currency not in figures:
+            figures[currency] = CurrencyFigures(currency)
+        currencyFigures = figures[currency]
+        currencyFigures.invoiceCount += row['numInvoices']
+        currencyFigures.paidInvoiceCount += row['numPaidInvoices']
+        currencyFigures.outstandingAmount += row['sumOutstanding']
+        currencyFigures.beforeVATAmount += row['sumBeforeVAT']
+        currencyFigures.vatAmount += row['sumVAT']
+        currencyFigures.afterVATAmount += row['sumAfterVAT']
+        currencyFigures.turnover += row['sumPaid']
+        paymentMethod = row['paymentMethod']
+        currencyFigures.paidByPaymentMethod[paymentMethod] = (
+            currencyFigures.paidByPaymentMethod.get(paymentMethod, ZERO)
+            + row['sumPaid']
+        )
+    return figures
+
+
+def get_invoicee_figures(beginDate, endDate, invoicer=None):
+    return [
+        InvoiceeFigures(
+            row['invoicee__name'],
+            row['invoicee__country'],
+            row['currency'],
+            row['sumOpenOwed'],
+            row['sumOpenPaid'],
+        )
+        for row in sorted(
+            summarize(
+                beginDate,
+                endDate,
+                ['invoicee', 'invoicee__name', 'invoicee__country'],
+                invoicer,
+            ),
+            key=lambda row: (row['currency'], row['invoicee__name']),
+        )
+        if row['numOpenInvoices']
+    ]
+
+
+def get_project_figures(beginDate, endDate, invoicer=None):
+    invoices = Invoice.objects.filter(
+        state__in=SUMMARY_STATES,
+        facturationDate__range=(beginDate, endDate),
+    )
+    if invoicer is not None:
+        invoices = invoices.filter(invoicer=invoicer)
+    return [
+        ProjectFigures(
+            row['project__title'],
+            row['baseCurrency'],
+            row['sumPaid'],
+        )
+        for row in invoices.values(
+            'baseCurrency',
+            'project__title',
+        ).annotate(
+            sumPaid=Sum('paidAmount'),
+        ).order_by('baseCurrency', 'project__title')
+    ]
+
+
+def get_dashboard(beginDate, endDate, invoicer=None):
+    return Dashboard(
+        get_currency_figures(beginDate, endDate, invoicer),
+        get_invoicee_figures(beginDate, endDate, invoicer),
+        get_project_figures(beginDate, endDate, invoicer),
+    )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from home.cache import get_dashboard_cache_stats, reset_dashboard_cache_stats
+
+
+class Command(BaseCommand):
+
+    help = 'Reports the hits and misses of the dashboard cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after reporting them.',
+        )
+
+    def handle(self, *args, **options):
+        stats = get_dashboard_cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        hitRate = stats['hits'] / lookups if lookups else 0
+        self.stdout.write(
+            f'{stats["hits"]} hits, {stats["misses"]} misses '
+            f'({hitRate:.1%} hit rate).'
+        )
+        if options['reset']:
+            reset_dashboard_cache_stats()
@@ -0,0 +1,62 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.transaction import on_commit
+from django.dispatch import receiver
+
+from Invoice.models import Invoice, Project, Fee, Payment
+from Invoicee.models import Invoicee
+from .cache import invalidate_dashboards
+
+
+def invalidate_on_commit(invoicerIDs):
+    # Invalidating before the commit would let a concurrent request cache
+    # the old figures under the new version.
+    invoicerIDs = set(invoicerIDs)
+    on_commit(lambda: invalidate_dashboards(*invoicerIDs))
+
+
+@receiver([post_save, post_delete], sender=Invoice)
+def invoice_changed(sender=None, instance=None, **kwargs):
+    invalidate_on_commit([instance.invoicer_id])
+
+
+@receiver([post_save, post_delete], sender=Project)
+def project_changed(sender=None, instance=None, **kwargs):
+    invalidate_on_commit(
+        Invoice.objects.filter(
+            id=instance.invoice_id,
+        ).values_list('invoicer', flat=True)
+    )
+
+
+@receiver([post_save, post_delete], sender=Fee)
+def fee_changed(sender=None, instance=None, **kwargs):
+    invalidate_on_commit(
+        Invoice.objects.filter(
+            project=instance.project_id,
+        ).values_list('invoicer', flat=True)
+    )
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def payment_changed(sender=None, instance=None, **kwargs):
+    invalidate_on_commit(
+        Invoicee.objects.filter(
+            id=instance.payor_id,
+        ).values_list('invoicer', flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=Payment.invoice.through)
+def payment_invoices_changed(
+    sender=None,
+    instance=None,
+    action=None,
+    reverse=None,
+    **kwargs,
+):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        invalidate_on_commit([instance.invoicer_id])
+    else:
+        payment_changed(instance=instance)
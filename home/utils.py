@@ -1,15 +1,9 @@
-from itertools import chain
-
-from django.db.models import Sum
-from django.db.utils import NotSupportedError
-
-from Invoice.models import Project, Invoice
+from Invoice.models import Invoice
 from Core.utils import (
     lformat_decimal,
     get_currency_symbol,
 )
 from Core.models import PaymentMethod
-from InvoiceGenerator.settings import DATABASES
 
 
 def printAmountWithCurrency(amount, currencySymbol):
@@ -19,18 +13,6 @@ def printAmountWithCurrency(amount, currencySymbol):
         return f'{lformat_decimal(amount)}{currencySymbol}'
 
 
-def getVATOfInvoices(invoices):
-    return sum(invoice.totalVAT for invoice in invoices)
-
-
-def getBeforeVATOfInvoices(invoices):
-    return sum(invoice.totalBeforeVAT for invoice in invoices)
-
-
-def getAfterVATOfInvoices(invoices):
-    return sum(invoice.totalAfterVAT for invoice in invoices)
-
-
 def getOutstandingAmountOfInvoicee(invoicee, beginDate, endDate):
     outStandingAmount = {}
     for invoice in Invoice.objects.filter(
@@ -70,133 +52,76 @@ def getPaidAmountOfInvoicee(invoicee, beginDate, endDate):
     return paidAmount
 
 
-def getInvoiceesInformation(invoices, currencies):
-    invoices = invoices.exclude(state=3)
-    invoiceesData = [
-        [
-            {
-                'name': invoiceeData['invoicee__name'],
-                'country': invoiceeData['invoicee__country'],
-                'totalOwed': printAmountWithCurrency(
-                    invoiceeData['totalOwed'],
-                    get_currency_symbol(currency)
+def get_dashboard_context(dashboard):
+    currencies = dashboard.currencies.values()
+    paymentMethods = PaymentMethod.values
+    paymentMethods.remove('DV')
+    return {
+        'numCurrencies': len(currencies),
+        'invoicesInformation': {
+            figures.currency: (
+                get_currency_symbol(figures.currency),
+                figures.invoiceCount,
+                figures.paidInvoiceCount,
+                printAmountWithCurrency(
+                    figures.outstandingAmount,
+                    get_currency_symbol(figures.currency),
                 ),
-                'totalPaid': printAmountWithCurrency(
-                    invoiceeData['totalPaid'],
-                    get_currency_symbol(currency)
+                printAmountWithCurrency(
+                    figures.vatAmount,
+                    get_currency_symbol(figures.currency),
                 ),
-            } for invoiceeData in invoices.filter(
-                baseCurrency=currency
-            ).values('invoicee').annotate(
-                totalPaid=Sum('paidAmount')
-            ).annotate(
-                totalOwed=Sum('owedAmount')
-            ).values(
-                'invoicee__name',
-                'invoicee__country',
-                'totalPaid',
-                'totalOwed'
-            )
-        ] for currency in currencies
-    ]
-    return chain.from_iterable(invoiceesData)
-
-
-def getInvoicesInformation(invoices, currencies):
-    invoiceData = {}
-    for currency in currencies:
-        invoices = invoices.filter(baseCurrency=currency)
-        paidInvoices = invoices.filter(state=3)
-        outStandingInvoices = invoices.filter(state=2)
-        invoiceData[currency] = (
-            get_currency_symbol(currency),
-            invoices.count(),
-            paidInvoices.count(),
-            printAmountWithCurrency(
-                sum(
-                    owed - paid
-                    for owed, paid in outStandingInvoices.filter(
-                        paidAmount__gt=0
-                    ).values_list(
-                        'owedAmount', 'paidAmount'
-                    )
+                printAmountWithCurrency(
+                    figures.beforeVATAmount,
+                    get_currency_symbol(figures.currency),
                 ),
-                get_currency_symbol(currency),
-            ),
-            printAmountWithCurrency(
-                getVATOfInvoices(invoices),
-                get_currency_symbol(currency),
-            ),
-            printAmountWithCurrency(
-                getBeforeVATOfInvoices(invoices),
-                get_currency_symbol(currency),
-            ),
-            printAmountWithCurrency(
-                getAfterVATOfInvoices(invoices),
-                get_currency_symbol(currency),
-            ),
-        )
-    return invoiceData
-
-
-def getPaymentMethodDistribution(invoices, currencies):
-    paymentMethods = PaymentMethod.values
-    paymentMethods.remove('DV')
-    distributionAmountsPaidOnPaymentMethod = [
-        [
-            printAmountWithCurrency(
-                sum(
-                    invoices.filter(
-                        paidAmount__gt=0
-                    ).filter(
-                        paymentMethod=paymentMethod
-                    ).filter(
-                        baseCurrency=currency
-                    ).values_list(
-                        'paidAmount',
-                        flat=True,
-                    )
+                printAmountWithCurrency(
+                    figures.afterVATAmount,
+                    get_currency_symbol(figures.currency),
                 ),
-                get_currency_symbol(currency),
             )
+            for figures in currencies
+        },
+        'invoiceesInformation': [
+            {
+                'name': invoicee.name,
+                'country': invoicee.country,
+                'totalOwed': printAmountWithCurrency(
+                    invoicee.owedAmount,
+                    get_currency_symbol(invoicee.currency),
+                ),
+                'totalPaid': printAmountWithCurrency(
+                    invoicee.paidAmount,
+                    get_currency_symbol(invoicee.currency),
+                ),
+            }
+            for invoicee in dashboard.invoicees
+        ],
+        'paymentMethodDistribution': {
+            paymentMethod: [
+                printAmountWithCurrency(
+                    figures.paidByPaymentMethod.get(paymentMethod),
+                    get_currency_symbol(figures.currency),
+                )
+                for figures in currencies
+            ]
             for paymentMethod in paymentMethods
-        ]
-        for currency in currencies
-    ]
-    return {
-        paymentMethod: [
-            distributionAmountPaid[i]
-            for distributionAmountPaid in distributionAmountsPaidOnPaymentMethod
-        ]
-        for i, paymentMethod in enumerate(paymentMethods)
-    }
-
-
-def getProjectsInformation(invoices, currencies):
-    return chain.from_iterable(
-        [
+        },
+        'projectsInformation': [
             [
-                nature['project__title'],
+                project.title,
                 printAmountWithCurrency(
-                    nature['totalPaid'],
-                    get_currency_symbol(currency)
-                )
-            ] for nature in invoices.filter(
-                baseCurrency=currency
-            ).values('project__title').annotate(
-                totalPaid=Sum('paidAmount')
-            )
-        ] for currency in currencies
-    )
-
-
-def getTotalTurnoversInvoices(invoices, currencies):
-    return [
-        (
+                    project.paidAmount,
+                    get_currency_symbol(project.currency),
+                ),
+            ]
+            for project in dashboard.projects
+        ],
+        'totalTurnovers': [
             printAmountWithCurrency(
-                invoices.aggregate(totalPaid=Sum('paidAmount'))['totalPaid'],
-                get_currency_symbol(currency),
+                figures.turnover,
+                get_currency_symbol(figures.currency),
             )
-        )
-        for currency in currencies
-    ]
+            for figures in currencies
+        ],
+    }
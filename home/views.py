@@ -3,19 +3,13 @@ from datetime import date
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 
-from Invoicer.models import Invoicer
+from Invoicer.utils import get_invoicer
 from Invoicee.models import Invoicee
-from Invoice.models import Invoice
 from .forms import (
     ContactDataForm,
 )
-from .utils import (
-    getInvoiceesInformation,
-    getInvoicesInformation,
-    getPaymentMethodDistribution,
-    getProjectsInformation,
-    getTotalTurnoversInvoices,
-)
+from .utils import get_dashboard_context
+from .cache import get_cached_dashboard
 
 from Core.forms import InvoiceFilterControlForm
 
@@ -32,46 +26,19 @@ def index(request, invoicer=None, beginDate=None, endDate=None):
         endDate = f'{date.today().year}-12-31'
 
     if request.user.is_superuser:
-        invoices = Invoice.objects.select_related('invoicee').filter(
-            state__in=[2, 3]
-        ).filter(
-            facturationDate__gte=beginDate
-        ).filter(
-            facturationDate__lte=endDate
-        )
+        invoicer = None
     else:
-        invoices = Invoice.objects.select_related(
-            'invoicer', 'invoicee'
-        ).filter(
-            state__in=[2, 3]
-        ).filter(
-            invoicer=Invoicer.objects.get(manager=request.user)
-        ).filter(
-            facturationDate__gte=beginDate
-        ).filter(
-            facturationDate__lte=endDate
-        )
-
-    currencies = invoices.values_list('baseCurrency', flat=True).distinct()
-    invoicesInformation = getInvoicesInformation(invoices, currencies)
-    invoiceesInformation = getInvoiceesInformation(invoices, currencies)
-    paymentMethodDistribution = getPaymentMethodDistribution(
-        invoices,
-        currencies,
-    )
-    projectsInformation = getProjectsInformation(invoices, currencies)
-    totalTurnovers = getTotalTurnoversInvoices(invoices, currencies)
+        invoicer = get_invoicer(request)
 
     context = {
         'beginDate': beginDate,
         'endDate': endDate,
-        'numCurrencies': len(currencies),
-        'invoicesInformation': invoicesInformation,
-        'invoiceesInformation': invoiceesInformation,
-        'projectsInformation': projectsInformation,
-        'totalTurnovers': totalTurnovers,
-        'paymentMethodDistribution': paymentMethodDistribution,
         'form': homeControlForm,
+        **get_dashboard_context(get_cached_dashboard(
+            date.fromisoformat(beginDate),
+            date.fromisoformat(endDate),
+            invoicer,
+        )),
     }
     if request.META.get('HTTP_HX_REQUEST'):
         return render(request, 'home-index-partial.html', context)